@@ -0,0 +1,254 @@
+"""
+Control de admisión de las peticiones de predicción, antes de leer el upload.
+
+Es un middleware ASGI: decide con la ruta y los headers, antes de que FastAPI
+parsee el multipart, así una petición rechazada nunca llega a tener su imagen en
+memoria. Hay un máximo de peticiones procesándose a la vez (lectura del upload +
+inferencia) y una cola acotada por carril:
+
+- interactive: /predict y /predict/sites (una imagen, alguien esperando)
+- batch: /predict/batch y /predict/batch/stream, o cualquier petición con
+  el header `X-Priority: batch` (clientes que mandan muchas imágenes con /predict)
+
+Cuando se libera un lugar pasa primero la cola interactive. Batch además no puede
+ocupar más que una fracción de los lugares, así siempre queda espacio para las
+interactivas aunque haya un lote grande en curso. Con la cola llena, o si la
+espera supera el timeout, se responde 503 con Retry-After sin leer el cuerpo.
+
+La admisión es el único rechazo para estas rutas: ya dentro, el carril (LANE) se
+pasa a InferenceExecutor, que reparte las imágenes en inferencia con las mismas
+prioridades (batch usa como mucho su fracción) y hace esperar en vez de dar 503.
+
+Todas las respuestas llevan `X-Queue-Time-Ms`: cuánto esperó la petición antes de
+empezar a procesarse (0 si entró directo o no pasa por el control).
+"""
+import asyncio
+import collections
+import contextvars
+import json
+import time
+
+from executor import Overloaded
+from metrics import REQUEST_START, STAGES, Histogram
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+# Orden de prioridad al liberar un lugar
+LANES = (INTERACTIVE, BATCH)
+
+# Carril de la petición admitida (None si no pasó por el control). Los endpoints lo
+# pasan a EXECUTOR.slot() para que una petición admitida espere su lugar con la
+# prioridad de su carril en vez de recibir un 503 del executor
+LANE = contextvars.ContextVar("admission_lane", default=None)
+
+QUEUE_MS_BUCKETS = (0.1, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Lane:
+
+    def __init__(self, name, max_active, max_queued):
+        self.name = name
+        self.max_active = max(1, int(max_active))
+        self.max_queued = max(0, int(max_queued))
+        self.active = 0
+        self.waiters = collections.deque()
+        self.admitted = 0
+        self.rejected = collections.Counter()  # motivo -> peticiones
+        self.queue_ms = Histogram(QUEUE_MS_BUCKETS)
+
+    def stats(self):
+        return {
+            "max_active": self.max_active,
+            "max_queued": self.max_queued,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "queue_ms": self.queue_ms.snapshot(),
+        }
+
+
+class AdmissionController:
+    """
+    max_active: peticiones procesándose a la vez entre todos los carriles.
+    max_queued / batch_max_queued: peticiones esperando en cada carril.
+    batch_share: fracción de max_active que puede usar el carril batch.
+    Solo se usa desde el event loop, no necesita lock (como InferenceExecutor).
+    """
+
+    def __init__(self, max_active=32, max_queued=64, batch_max_queued=8, batch_share=0.5,
+                 queue_timeout_s=10.0, retry_after_s=1):
+        self.max_active = max(1, int(max_active))
+        self.queue_timeout_s = queue_timeout_s
+        self.retry_after_s = retry_after_s
+        self.active = 0
+        self.lanes = {
+            INTERACTIVE: Lane(INTERACTIVE, self.max_active, max_queued),
+            BATCH: Lane(BATCH, self.max_active * batch_share, batch_max_queued),
+        }
+
+    def _has_room(self, lane):
+        return self.active < self.max_active and lane.active < lane.max_active
+
+    def _ahead(self, lane):
+        """¿Hay peticiones esperando que deben pasar antes que una nueva de este carril?"""
+        for name in LANES:
+            if self.lanes[name].waiters:
+                return True
+            if name == lane.name:
+                return False
+        return False
+
+    def _grant(self, lane):
+        lane.active += 1
+        lane.admitted += 1
+        self.active += 1
+
+    def _dispatch(self):
+        """Entrega los lugares libres a las colas, por prioridad y en orden de llegada"""
+        while self.active < self.max_active:
+            for name in LANES:
+                lane = self.lanes[name]
+                while lane.waiters and lane.waiters[0].done():
+                    lane.waiters.popleft()  # abandonada (timeout o cliente desconectado)
+                if lane.waiters and lane.active < lane.max_active:
+                    self._grant(lane)
+                    lane.waiters.popleft().set_result(None)
+                    break
+            else:
+                return
+
+    def _reject(self, lane, reason):
+        lane.rejected[reason] += 1
+        raise Overloaded(self.retry_after_s)
+
+    async def acquire(self, lane_name):
+        """Espera un lugar en el carril. Retorna los ms de espera o lanza Overloaded"""
+        lane = self.lanes[lane_name]
+        start = time.perf_counter()
+        if self._has_room(lane) and not self._ahead(lane):
+            self._grant(lane)
+            lane.queue_ms.observe(0.0)
+            return 0.0
+        if len(lane.waiters) >= lane.max_queued:
+            self._reject(lane, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        lane.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Se le entregó el lugar justo al vencer el timeout: se usa igual
+                pass
+            else:
+                waiter.cancel()
+                lane.queue_ms.observe((time.perf_counter() - start) * 1000)
+                self._reject(lane, "timeout")
+        except asyncio.CancelledError:
+            # Cliente desconectado mientras esperaba: devolver el lugar si ya se le dio
+            if waiter.done() and not waiter.cancelled():
+                self.release(lane_name)
+            else:
+                waiter.cancel()
+            raise
+        queue_ms = (time.perf_counter() - start) * 1000
+        lane.queue_ms.observe(queue_ms)
+        return queue_ms
+
+    def release(self, lane_name):
+        lane = self.lanes[lane_name]
+        lane.active -= 1
+        self.active -= 1
+        self._dispatch()
+
+    def stats(self):
+        return {
+            "max_active": self.max_active,
+            "active": self.active,
+            "queue_timeout_s": self.queue_timeout_s,
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+        }
+
+
+class AdmissionControl:
+    """
+    Middleware ASGI. routes: {ruta: carril}; las demás rutas pasan sin control.
+    Va dentro de CORS (los 503 llevan los headers de CORS) y de RequestMetrics
+    (los rechazos se cuentan en /metrics).
+    """
+
+    def __init__(self, app, controller, routes, enabled=True):
+        self.app = app
+        self.controller = controller
+        self.routes = dict(routes)
+        self.enabled = enabled
+
+    def _lane(self, scope):
+        if scope["method"] != "POST":
+            return None
+        lane = self.routes.get(scope["path"].rstrip("/") or "/")
+        if lane is None:
+            return None
+        # Un cliente puede bajar su prioridad (nunca subirla)
+        for key, value in scope.get("headers", ()):
+            if key == b"x-priority" and value.strip().lower() == BATCH.encode():
+                return BATCH
+        return lane
+
+    async def __call__(self, scope, receive, send):
+        lane = self._lane(scope) if self.enabled and scope["type"] == "http" else None
+        if lane is None:
+            if scope["type"] == "http":
+                send = _with_queue_time(send, 0.0)
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        try:
+            queue_ms = await self.controller.acquire(lane)
+        except Overloaded as e:
+            await _overloaded(send, e, lane, (time.perf_counter() - start) * 1000)
+            return
+
+        STAGES.observe("queue", queue_ms)
+        # upload_read se mide desde que la petición entra, no desde que llegó a la cola
+        token = REQUEST_START.set(time.perf_counter())
+        lane_token = LANE.set(lane)
+        try:
+            await self.app(scope, receive, _with_queue_time(send, queue_ms, lane))
+        finally:
+            LANE.reset(lane_token)
+            REQUEST_START.reset(token)
+            self.controller.release(lane)
+
+
+def _queue_headers(queue_ms, lane=None):
+    headers = [(b"x-queue-time-ms", f"{queue_ms:.2f}".encode())]
+    if lane is not None:
+        headers.append((b"x-priority", lane.encode()))
+    return headers
+
+
+def _with_queue_time(send, queue_ms, lane=None):
+    async def send_wrapper(message):
+        if message["type"] == "http.response.start":
+            message = {**message, "headers": list(message.get("headers", ())) + _queue_headers(queue_ms, lane)}
+        await send(message)
+    return send_wrapper
+
+
+async def _overloaded(send, e, lane, queue_ms):
+    """503 sin leer el cuerpo de la petición"""
+    body = json.dumps({"error": str(e), "lane": lane}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(e.retry_after).encode()),
+            *_queue_headers(queue_ms, lane),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
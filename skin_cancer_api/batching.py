@@ -0,0 +1,153 @@
+"""
+Micro-batching dinámico delante del modelo.
+
+Las peticiones concurrentes se encolan y un único hilo consumidor las agrupa
+en un batch (hasta `max_batch_size` imágenes o `max_wait_ms` desde la primera),
+ejecuta UNA pasada del modelo y entrega a cada llamador su propia fila.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import Counts, Histogram
+
+
+class _Item:
+    __slots__ = ("sample", "future", "enqueued")
+
+    def __init__(self, sample):
+        self.sample = sample
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+_STOP = object()
+
+
+class MicroBatcher:
+    """
+    predict_fn(samples) -> array (N, ...) con una fila por muestra.
+    postprocess_fn(fila) -> resultado que recibe cada llamador (ej. format_top3).
+    postprocess_batch_fn(array) -> lista de resultados, uno por fila, calculados
+    para todo el batch a la vez (ej. format_predictions). Reemplaza a postprocess_fn.
+    """
+
+    def __init__(self, predict_fn, postprocess_fn=None, max_batch_size=16, max_wait_ms=10.0,
+                 postprocess_batch_fn=None):
+        self.predict_fn = predict_fn
+        self.postprocess_fn = postprocess_fn or (lambda row: row)
+        self.postprocess_batch_fn = postprocess_batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._thread = None
+
+        # Métricas
+        self.batch_sizes = Counts()
+        self.queue_wait_ms = Histogram()
+        self.forward_ms = Histogram()
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5.0):
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def submit(self, sample):
+        """Encola una muestra y retorna un concurrent.futures.Future con su resultado"""
+        if self._thread is None:
+            raise RuntimeError("MicroBatcher no iniciado, llama a start()")
+        item = _Item(sample)
+        self._queue.put(item)
+        return item.future
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._queue.qsize(),
+            "batch_size_histogram": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            "forward_ms": self.forward_ms.snapshot(),
+        }
+
+    # ------------------------------------------------------------------
+    # Hilo consumidor
+    # ------------------------------------------------------------------
+
+    def _collect(self, first):
+        """Junta items hasta llenar el batch o agotar la espera de la primera petición"""
+        items = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(items) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    # Plazo vencido: solo tomar lo que ya está en cola
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self._queue.put(_STOP)
+                break
+            items.append(item)
+        return items
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            items = [it for it in self._collect(first) if it.future.set_running_or_notify_cancel()]
+            if items:
+                self._process(items)
+
+    def _process(self, items):
+        start = time.perf_counter()
+        for it in items:
+            self.queue_wait_ms.observe((start - it.enqueued) * 1000.0)
+        self.batch_sizes.inc(len(items))
+
+        try:
+            preds = self.predict_fn([it.sample for it in items])
+        except Exception as e:
+            for it in items:
+                it.future.set_exception(e)
+            return
+        finally:
+            self.forward_ms.observe((time.perf_counter() - start) * 1000.0)
+
+        if self.postprocess_batch_fn is not None:
+            try:
+                results = self.postprocess_batch_fn(preds)
+            except Exception as e:
+                for it in items:
+                    it.future.set_exception(e)
+                return
+            for it, result in zip(items, results):
+                it.future.set_result(result)
+            return
+
+        for it, row in zip(items, preds):
+            try:
+                it.future.set_result(self.postprocess_fn(row))
+            except Exception as e:
+                it.future.set_exception(e)
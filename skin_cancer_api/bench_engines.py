@@ -0,0 +1,125 @@
+"""
+Benchmark de motores de inferencia: arranque en frío, memoria (RSS) y latencia.
+
+Cada motor se mide en un proceso nuevo para que el arranque y la RSS sean reales
+(importar TensorFlow una vez contamina las mediciones de los demás).
+
+Uso:
+    python bench_engines.py                              # keras, tflite, onnx
+    python bench_engines.py --engines keras tflite --iters 200 --batch 1
+    python bench_engines.py --out bench_engines.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+
+def rss_mb():
+    """RSS actual y pico del proceso en MB (Linux /proc, con fallback a getrusage)"""
+    try:
+        values = {}
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":")
+                    values[key] = int(value.split()[0]) / 1024
+        return values["VmRSS"], values["VmHWM"]
+    except (OSError, KeyError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+
+
+def run_worker(engine_name, iters, batch_size):
+    start = time.perf_counter()
+    import numpy as np
+    import config
+    from engines import engine_paths, load_engine
+    from export_model import ARTIFACTS_PATH, MODEL_DIR, make_check_batch
+
+    paths = [config.ENGINE_PATH] if config.ENGINE_PATH else engine_paths(MODEL_DIR, engine_name, config.MODEL_VARIANT)
+    engine = load_engine(engine_name, paths, compiled=config.COMPILED_INFERENCE,
+                         buckets=config.BATCH_BUCKETS, max_diff=config.COMPILED_MAX_DIFF,
+                         num_threads=config.ENGINE_THREADS, xnnpack=config.TFLITE_XNNPACK)
+    with open(ARTIFACTS_PATH, "r", encoding="utf-8") as f:
+        artifacts = json.load(f)
+    batch = make_check_batch(artifacts, batch_size)
+    engine.predict(batch)
+    cold_start_s = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        engine.predict(batch)
+        latencies.append((time.perf_counter() - t0) * 1000)
+
+    rss, peak = rss_mb()
+    lat = np.array(latencies)
+    return {
+        "engine": engine_name,
+        "model": str(engine.path),
+        "batch_size": batch_size,
+        "iters": iters,
+        "cold_start_s": cold_start_s,
+        "rss_mb": rss,
+        "peak_rss_mb": peak,
+        "latency_ms": {
+            "mean": float(lat.mean()),
+            "p50": float(np.percentile(lat, 50)),
+            "p95": float(np.percentile(lat, 95)),
+            "p99": float(np.percentile(lat, 99)),
+        },
+        "images_per_s": batch_size * 1000.0 / float(lat.mean()),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=["keras", "tflite", "onnx"])
+    parser.add_argument("--iters", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--out", help="Guardar resultados en JSON")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        # Última línea de stdout = resultado en JSON para el proceso padre
+        print(json.dumps(run_worker(args.worker, args.iters, args.batch)))
+        return 0
+
+    results = []
+    for name in args.engines:
+        print(f"⏱️  Midiendo motor {name}...")
+        proc = subprocess.run(
+            [sys.executable, __file__, "--worker", name, "--iters", str(args.iters), "--batch", str(args.batch)],
+            cwd=Path(__file__).resolve().parent,
+            env=dict(os.environ, SKIN_ENGINE=name),
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode != 0:
+            print(f"⚠️ {name} falló:\n{proc.stderr.strip()[-2000:]}")
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print("\n" + "=" * 78)
+    print(f"{'motor':<8} {'arranque (s)':>12} {'RSS (MB)':>10} {'p50 (ms)':>10} {'p95 (ms)':>10} {'img/s':>10}")
+    print("=" * 78)
+    for r in results:
+        lat = r["latency_ms"]
+        print(f"{r['engine']:<8} {r['cold_start_s']:>12.2f} {r['rss_mb']:>10.0f} "
+              f"{lat['p50']:>10.2f} {lat['p95']:>10.2f} {r['images_per_s']:>10.1f}")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Resultados guardados en {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,354 @@
+"""
+Prueba de carga reproducible de /predict: throughput, latencia p50/p95/p99, RSS y CPU.
+
+Dos modos:
+- inprocess: la app FastAPI corre en este mismo proceso (TestClient, sin red ni
+  uvicorn). Mide el camino de la petición sin el costo del socket; la CPU incluye
+  la del cliente.
+- http: contra un servidor real. Sin --url arranca `uvicorn main:app` (o
+  `serve.py --workers N` con --workers) y mide su RSS/CPU en /proc; con --url usa
+  un servidor ya levantado (RSS/CPU solo si se pasa --server-pid).
+
+Cada escenario (resolución x concurrencia) envía imágenes sintéticas distintas con
+clientes keep-alive durante --duration segundos, después de un warmup. La caché
+se desactiva en los servidores que arranca este script y cada petición usa otra
+imagen/edad, así que todas pasan por el modelo.
+
+Los resultados van a un JSON con el commit, la configuración y el entorno, para
+comparar entre commits:
+
+    python bench_load.py --mode inprocess --out base.json
+    python bench_load.py --mode http --concurrency 1 8 32 --resolutions 600x450 4032x3024 --out new.json
+    python bench_load.py --mode inprocess --out new.json --compare base.json --tolerance 0.10
+
+Con --compare el proceso termina con código 1 si algún escenario empeora más de
+--tolerance en throughput o p95.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from bench_workers import child_pids, multipart_body, synthetic_jpeg, wait_ready
+
+HERE = Path(__file__).resolve().parent
+SEXES = ["male", "female"]
+SITES = ["anterior torso", "head/neck", "lower extremity", "upper extremity", "back", "palms/soles"]
+
+
+def parse_resolution(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def make_bodies(width, height, count, seed=0):
+    """Peticiones multipart con imágenes y metadatos distintos (sin aciertos de caché)"""
+    return [
+        multipart_body(
+            synthetic_jpeg(width, height, seed=seed + i),
+            {"age": 20 + i % 70, "sex": SEXES[i % 2], "anatom_site_general": SITES[i % len(SITES)]},
+        )
+        for i in range(count)
+    ]
+
+
+# ============================================================================
+# RSS Y CPU DESDE /proc
+# ============================================================================
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def proc_usage(pid):
+    """CPU acumulada (s), RSS y pico de RSS (MB) de un proceso; None si no hay /proc"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+    return {
+        # utime y stime son los campos 14 y 15 de stat (11 y 12 después del nombre)
+        "cpu_s": (int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+        "rss_mb": int(status["VmRSS"].split()[0]) / 1024,
+        "peak_rss_mb": int(status["VmHWM"].split()[0]) / 1024,
+    }
+
+
+def server_usage(pids):
+    """Suma de CPU y RSS del servidor (padre + workers de serve.py)"""
+    usages = [u for u in (proc_usage(pid) for pid in pids) if u is not None]
+    if not usages:
+        return None
+    return {key: sum(u[key] for u in usages) for key in ("cpu_s", "rss_mb", "peak_rss_mb")}
+
+
+# ============================================================================
+# CLIENTES
+# ============================================================================
+
+def http_client_factory(url):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+
+    def make():
+        conn = [http.client.HTTPConnection(host, port, timeout=120)]
+
+        def send(body, content_type):
+            try:
+                conn[0].request("POST", "/predict", body=body, headers={"Content-Type": content_type})
+                response = conn[0].getresponse()
+                response.read()
+                return response.status
+            except OSError:
+                conn[0].close()
+                conn[0] = http.client.HTTPConnection(host, port, timeout=120)
+                return 0
+
+        return send
+
+    return make
+
+
+def inprocess_client_factory(client):
+    def make():
+        def send(body, content_type):
+            return client.post("/predict", content=body, headers={"Content-Type": content_type}).status_code
+
+        return send
+
+    return make
+
+
+def run_load(make_client, bodies, concurrency, duration_s):
+    """`concurrency` clientes enviando sin pausa hasta agotar el tiempo"""
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration_s
+
+    def worker(i):
+        send = make_client()
+        local, local_statuses, k = [], {}, i
+        while time.monotonic() < deadline:
+            body, content_type = bodies[k % len(bodies)]
+            k += concurrency
+            t0 = time.perf_counter()
+            status = send(body, content_type)
+            if status == 200:
+                local.append((time.perf_counter() - t0) * 1000)
+            local_statuses[status] = local_statuses.get(status, 0) + 1
+        with lock:
+            latencies.extend(local)
+            for status, n in local_statuses.items():
+                statuses[status] = statuses.get(status, 0) + n
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def summarize(latencies, statuses, elapsed):
+    lat = np.array(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(n for status, n in statuses.items() if status != 200),
+        "status_counts": {str(k): v for k, v in sorted(statuses.items())},
+        "seconds": round(elapsed, 3),
+        "requests_per_s": len(latencies) / elapsed,
+        # Sin respuestas 200 no hay latencias (None en el JSON)
+        "latency_ms": {
+            "mean": float(np.mean(lat)) if len(lat) else None,
+            "p50": float(np.percentile(lat, 50)) if len(lat) else None,
+            "p95": float(np.percentile(lat, 95)) if len(lat) else None,
+            "p99": float(np.percentile(lat, 99)) if len(lat) else None,
+            "max": float(np.max(lat)) if len(lat) else None,
+        },
+    }
+
+
+def scenario(make_client, bodies, concurrency, args, pids):
+    run_load(make_client, bodies, concurrency, args.warmup)
+    before = server_usage(pids())
+    latencies, statuses, elapsed = run_load(make_client, bodies, concurrency, args.duration)
+    after = server_usage(pids())
+    result = summarize(latencies, statuses, elapsed)
+    if before and after:
+        result["cpu_pct"] = 100 * (after["cpu_s"] - before["cpu_s"]) / elapsed
+        result["rss_mb"] = after["rss_mb"]
+        result["peak_rss_mb"] = after["peak_rss_mb"]
+    return result
+
+
+# ============================================================================
+# MODOS
+# ============================================================================
+
+def run_scenarios(make_client, args, pids):
+    results = []
+    for resolution in args.resolutions:
+        width, height = parse_resolution(resolution)
+        bodies = make_bodies(width, height, args.images, seed=args.seed)
+        for concurrency in args.concurrency:
+            print(f"⏱️  {resolution} con {concurrency} cliente(s)...")
+            r = scenario(make_client, bodies, concurrency, args, pids)
+            results.append({"resolution": resolution, "concurrency": concurrency, **r})
+    return results
+
+
+def bench_inprocess(args):
+    os.environ["SKIN_CACHE_ENABLED"] = "0"
+    sys.path.insert(0, str(HERE))
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as client:
+        deadline = time.monotonic() + args.ready_timeout
+        while client.get("/health/ready").status_code != 200:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"El modelo no estuvo listo en {args.ready_timeout} s")
+            time.sleep(0.5)
+        return run_scenarios(inprocess_client_factory(client), args, lambda: [os.getpid()])
+
+
+def bench_http(args):
+    if args.url:
+        server_pid = args.server_pid
+        pids = (lambda: [server_pid] + child_pids(server_pid)) if server_pid else (lambda: [])
+        return run_scenarios(http_client_factory(args.url), args, pids)
+
+    if args.workers:
+        cmd = [sys.executable, "serve.py", "--workers", str(args.workers)]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "main:app"]
+    cmd += ["--host", "127.0.0.1", "--port", str(args.port)]
+    server = subprocess.Popen(cmd, cwd=HERE, env=dict(os.environ, SKIN_CACHE_ENABLED="0"))
+    try:
+        if not wait_ready(args.port, args.ready_timeout):
+            raise RuntimeError(f"El servidor no estuvo listo en {args.ready_timeout} s")
+        return run_scenarios(
+            http_client_factory(f"http://127.0.0.1:{args.port}"),
+            args,
+            lambda: [server.pid] + child_pids(server.pid),
+        )
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+# ============================================================================
+# METADATOS Y COMPARACIÓN
+# ============================================================================
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(args):
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "mode": args.mode,
+        "workers": args.workers,
+        "duration_s": args.duration,
+        "warmup_s": args.warmup,
+        "images": args.images,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "skin_env": {k: v for k, v in sorted(os.environ.items()) if k.startswith("SKIN_") and "TOKEN" not in k},
+    }
+
+
+def compare(results, baseline_path, tolerance):
+    """Imprime la variación contra otra corrida. Retorna la lista de regresiones"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["resolution"], r["concurrency"]): r for r in baseline["scenarios"]}
+    regressions = []
+    print(f"\nComparación con {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for r in results:
+        old = previous.get((r["resolution"], r["concurrency"]))
+        if old is None or not old["requests"] or not r["requests"]:
+            continue
+        d_rps = r["requests_per_s"] / old["requests_per_s"] - 1
+        d_p95 = r["latency_ms"]["p95"] / old["latency_ms"]["p95"] - 1
+        worse = d_rps < -tolerance or d_p95 > tolerance
+        mark = "❌" if worse else "✅"
+        print(f"  {mark} {r['resolution']:>10} x{r['concurrency']:<4} req/s {d_rps:+.1%}   p95 {d_p95:+.1%}")
+        if worse:
+            regressions.append((r["resolution"], r["concurrency"]))
+    return regressions
+
+
+def print_table(results):
+    print("\n" + "=" * 92)
+    print(f"{'resolución':>10} {'conc':>5} {'req/s':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'CPU %':>7} {'RSS (MB)':>9} {'errores':>8}")
+    print("=" * 92)
+    def fmt(value, spec):
+        return "-" if value is None else format(value, spec)
+
+    for r in results:
+        lat = r["latency_ms"]
+        print(f"{r['resolution']:>10} {r['concurrency']:>5} {r['requests_per_s']:>8.1f} {fmt(lat['p50'], '.1f'):>9} "
+              f"{fmt(lat['p95'], '.1f'):>9} {fmt(lat['p99'], '.1f'):>9} {fmt(r.get('cpu_pct'), '.0f'):>7} "
+              f"{fmt(r.get('rss_mb'), '.0f'):>9} {r['errors']:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", help="Servidor ya levantado (modo http), ej. http://127.0.0.1:8000")
+    parser.add_argument("--server-pid", type=int, help="PID del servidor de --url para medir RSS/CPU")
+    parser.add_argument("--workers", type=int, help="Arrancar serve.py con N workers en vez de uvicorn (modo http)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--resolutions", nargs="+", default=["600x450", "1024x768", "2048x1536"],
+                        help="Resoluciones de las imágenes (600x450 = dermatoscopio ISIC, mayores = celular)")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos de medición por escenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Segundos de warmup por escenario")
+    parser.add_argument("--images", type=int, default=64, help="Imágenes sintéticas distintas por resolución")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--out", help="Guardar resultados en JSON")
+    parser.add_argument("--compare", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Empeoramiento admitido en req/s y p95")
+    args = parser.parse_args(argv)
+
+    results = bench_inprocess(args) if args.mode == "inprocess" else bench_http(args)
+    print_table(results)
+
+    # Comparar antes de guardar: --out puede ser el mismo archivo que --compare
+    regressions = compare(results, args.compare, args.tolerance) if args.compare else []
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"meta": environment(args), "scenarios": results}, f, indent=2)
+        print(f"\n✅ Resultados guardados en {args.out}")
+    if regressions:
+        print(f"\n❌ {len(regressions)} escenario(s) empeoraron más de {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
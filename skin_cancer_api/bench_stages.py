@@ -0,0 +1,251 @@
+"""
+Microbenchmarks de cada etapa de /predict, medidas por separado.
+
+Etapas: preprocess_image_bytes (y sus partes decode / resize / to_array /
+preprocess_input, exacto y rápido), encode_metadata (una fila y vectorizado),
+el Top-k (argsort + format_top3), el armado de la respuesta JSON, stack_samples y
+la pasada del modelo con batch 1..64.
+
+Cada benchmark se mide como timeit: warmup, calibración del número de llamadas
+para que una repetición dure al menos --min-time, y --repeats repeticiones con el
+GC desactivado. Se reporta el tiempo por llamada: mínimo, mediana, media, desvío
+relativo e IQR. La mediana es la que se compara entre corridas.
+
+Uso:
+    python bench_stages.py                                  # todo, incluido el modelo
+    python bench_stages.py --only preprocess metadata --out stages.json
+    python bench_stages.py --no-model --out new.json --compare base.json --tolerance 0.10
+    SKIN_ENGINE=tflite python bench_stages.py --only model --batch-sizes 1 8 32 64
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+import config
+import inference
+from bench_load import git_commit, parse_resolution
+from bench_workers import synthetic_jpeg
+from preprocessing import (
+    decode_image,
+    decode_image_fast,
+    efficientnet_preprocess_input,
+    encode_metadata,
+    preprocess_image_bytes,
+    preprocess_image_bytes_fast,
+)
+
+
+def measure(fn, min_time=0.2, repeats=7, warmup=0.1):
+    """Tiempo por llamada de fn() en µs para cada repetición (como timeit.repeat)"""
+    deadline = time.perf_counter() + warmup
+    while True:
+        fn()
+        if time.perf_counter() >= deadline:
+            break
+
+    # Calibrar: duplicar llamadas hasta que una repetición dure al menos min_time
+    number = 1
+    while True:
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - t0 >= min_time:
+            break
+        number *= 2
+
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        times = []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            for _ in range(number):
+                fn()
+            times.append((time.perf_counter() - t0) / number * 1e6)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    return times, number
+
+
+def describe(times, number):
+    q1, _, q3 = statistics.quantiles(times, n=4) if len(times) > 1 else (times[0],) * 3
+    mean = statistics.fmean(times)
+    return {
+        "calls_per_repeat": number,
+        "repeats": len(times),
+        "min_us": min(times),
+        "median_us": statistics.median(times),
+        "mean_us": mean,
+        "rel_stdev": statistics.stdev(times) / mean if len(times) > 1 and mean else 0.0,
+        "iqr_us": q3 - q1,
+    }
+
+
+# ============================================================================
+# BENCHMARKS (nombre, grupo, función sin argumentos, unidades por llamada)
+# ============================================================================
+
+def preprocess_benchmarks(resolutions):
+    img_size = tuple(inference.ARTIFACTS.get("img_size", [224, 224]))
+    draft = config.FAST_DECODE_DRAFT_FACTOR
+    min_pixels = config.FAST_DECODE_MIN_PIXELS
+    for resolution in resolutions:
+        width, height = parse_resolution(resolution)
+        contents = synthetic_jpeg(width, height)
+        img = decode_image(contents)
+        resized = img.resize(img_size, Image.BILINEAR)
+        arr = np.array(resized).astype("float32")
+        yield f"preprocess_image_bytes[{resolution}]", "preprocess", lambda c=contents: preprocess_image_bytes(c, img_size), 1
+        yield f"preprocess_image_bytes_fast[{resolution}]", "preprocess", \
+            lambda c=contents: preprocess_image_bytes_fast(c, img_size, draft, min_pixels), 1
+        yield f"decode[{resolution}]", "preprocess", lambda c=contents: decode_image(c), 1
+        yield f"decode_fast[{resolution}]", "preprocess", lambda c=contents: decode_image_fast(c, img_size, draft, min_pixels), 1
+        yield f"resize[{resolution}]", "preprocess", lambda i=img: i.resize(img_size, Image.BILINEAR), 1
+    yield "to_array", "preprocess", lambda: np.array(resized).astype("float32"), 1
+    # preprocess_input de EfficientNet es la identidad: mide el costo de la llamada
+    yield "preprocess_input", "preprocess", lambda: efficientnet_preprocess_input(arr), 1
+
+
+def metadata_benchmarks():
+    artifacts = inference.ARTIFACTS
+    sites = list(artifacts.get("site2idx", {"other": 0})) or ["other"]
+    yield "encode_metadata", "metadata", lambda: encode_metadata(54, "female", sites[0], artifacts), 1
+    n = 64
+    ages = [20 + i % 70 for i in range(n)]
+    sexes = [("male", "female", "unknown")[i % 3] for i in range(n)]
+    site_col = [sites[i % len(sites)] for i in range(n)]
+    yield f"encode_metadata_batch[{n}]", "metadata", \
+        lambda: inference.METADATA_ENCODER.encode_batch(ages, sexes, site_col), n
+
+
+def output_benchmarks():
+    num_classes = len(inference.ARTIFACTS.get("class2idx", {"MEL": 0, "NV": 1, "BCC": 2, "BKL": 3}))
+    rng = np.random.default_rng(0)
+    preds = rng.random(num_classes)
+    preds /= preds.sum()
+    yield "argsort_top3", "topk", lambda: np.argsort(preds)[::-1][:3], 1
+    yield "format_top3", "topk", lambda: inference.format_top3(preds), 1
+    batch = rng.random((64, num_classes))
+    batch /= batch.sum(axis=1, keepdims=True)
+    yield "format_predictions[64]", "topk", lambda: inference.format_predictions(batch), 64
+    top3 = inference.format_top3(preds)
+    yield "json_dumps", "json", lambda: json.dumps({"top3": top3}).encode("utf-8"), 1
+    try:
+        from fastapi.responses import JSONResponse
+    except ImportError:
+        return
+    yield "json_response", "json", lambda: JSONResponse({"top3": top3}), 1
+
+
+def model_benchmarks(batch_sizes):
+    """stack_samples y la pasada del modelo; requiere el modelo (se carga aquí)"""
+    sample = inference.make_sample(
+        np.zeros(inference.image_shape(), np.float32), *inference.encode_request_metadata(50, "male", "other")
+    )
+    for n in batch_sizes:
+        yield f"stack_samples[{n}]", "model", lambda s=[sample] * n: inference.stack_samples(s), n
+    engine = inference.load_model()
+    for n in batch_sizes:
+        batch = inference.stack_samples([sample] * n)
+        yield f"forward[{n}]", "model", lambda b=batch: engine.predict(b), n
+
+
+def run(args):
+    groups = []
+    if "preprocess" in args.only:
+        groups.append(preprocess_benchmarks(args.resolutions))
+    if "metadata" in args.only:
+        groups.append(metadata_benchmarks())
+    if "topk" in args.only or "json" in args.only:
+        groups.append(b for b in output_benchmarks() if b[1] in args.only)
+    if "model" in args.only and not args.no_model:
+        groups.append(model_benchmarks(args.batch_sizes))
+
+    results = []
+    for group in groups:
+        try:
+            for name, kind, fn, units in group:
+                times, number = measure(fn, args.min_time, args.repeats, args.warmup)
+                r = {"name": name, "group": kind, "units_per_call": units, **describe(times, number)}
+                r["median_us_per_unit"] = r["median_us"] / units
+                results.append(r)
+                print(f"  {name:<40} {r['median_us']:>12.1f} µs  (±{100 * r['rel_stdev']:.1f}%, "
+                      f"{r['calls_per_repeat']} x {r['repeats']})")
+        except Exception as e:
+            print(f"⚠️ Grupo omitido: {type(e).__name__}: {e}")
+    return results
+
+
+def compare(results, baseline_path, tolerance):
+    """Variación de la mediana contra otra corrida. Retorna los benchmarks que empeoraron"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {r["name"]: r for r in baseline["benchmarks"]}
+    regressions = []
+    print(f"\nComparación con {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for r in results:
+        old = previous.get(r["name"])
+        if old is None:
+            continue
+        delta = r["median_us"] / old["median_us"] - 1
+        # Más lento que la tolerancia Y fuera del ruido medido en ambas corridas
+        noise = max(r["rel_stdev"], old["rel_stdev"])
+        worse = delta > max(tolerance, 2 * noise)
+        print(f"  {'❌' if worse else '✅'} {r['name']:<40} {delta:+.1%}")
+        if worse:
+            regressions.append(r["name"])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", default=["preprocess", "metadata", "topk", "json", "model"],
+                        choices=["preprocess", "metadata", "topk", "json", "model"])
+    parser.add_argument("--resolutions", nargs="+", default=["600x450", "2048x1536"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--no-model", action="store_true", help="No cargar el modelo (solo etapas de CPU)")
+    parser.add_argument("--repeats", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Segundos mínimos por repetición")
+    parser.add_argument("--warmup", type=float, default=0.1, help="Segundos de warmup por benchmark")
+    parser.add_argument("--out", help="Guardar resultados en JSON")
+    parser.add_argument("--compare", help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Empeoramiento admitido de la mediana")
+    args = parser.parse_args(argv)
+
+    print(f"⏱️  {args.repeats} repeticiones de al menos {args.min_time} s por benchmark")
+    results = run(args)
+    regressions = compare(results, args.compare, args.tolerance) if args.compare else []
+
+    if args.out:
+        meta = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "engine": config.ENGINE,
+            "repeats": args.repeats,
+            "min_time_s": args.min_time,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "skin_env": {k: v for k, v in sorted(os.environ.items()) if k.startswith("SKIN_") and "TOKEN" not in k},
+        }
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"meta": meta, "benchmarks": results}, f, indent=2)
+        print(f"\n✅ Resultados guardados en {args.out}")
+    if regressions:
+        print(f"\n❌ {len(regressions)} benchmark(s) empeoraron más de {args.tolerance:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
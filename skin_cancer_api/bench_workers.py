@@ -0,0 +1,231 @@
+"""
+Benchmark de serve.py: memoria por worker y throughput con 1..N workers.
+
+Para cada cantidad de workers arranca `serve.py --workers n`, espera a que
+/health/ready responda 200, envía /predict concurrentes durante unos segundos y
+lee la memoria de cada worker en /proc/<pid>/smaps_rollup (solo Linux):
+
+- RSS: páginas residentes, cuenta varias veces las compartidas
+- PSS: cada página compartida dividida entre los procesos que la usan
+- USS: memoria privada del worker (lo que se libera si se mata)
+
+La suma de PSS es la memoria real que ocupa el servidor. La caché de predicciones
+se desactiva para que cada petición pase por el modelo.
+
+Uso:
+    SKIN_ENGINE=tflite SKIN_TFLITE_XNNPACK=0 python bench_workers.py --workers 1 2 4 8
+    python bench_workers.py --workers 1 2 4 --concurrency 32 --duration 20 --out workers.json
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+
+def synthetic_jpeg(width=600, height=450, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def multipart_body(image, fields):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="img.jpg"\r\n'
+        f"Content-Type: image/jpeg\r\n\r\n".encode() + image + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def wait_ready(port, timeout_s):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/health/ready")
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def child_pids(pid):
+    """Workers de serve.py: hijos directos del proceso padre"""
+    pids = []
+    for entry in Path("/proc").iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            stat = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # El nombre del proceso va entre paréntesis y puede contener espacios
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        if ppid == pid:
+            pids.append(int(entry.name))
+    return sorted(pids)
+
+
+def memory_mb(pid):
+    """RSS, PSS y USS de un proceso en MB (smaps_rollup, Linux >= 4.14)"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1]) / 1024
+    return {
+        "rss": values.get("Rss", 0.0),
+        "pss": values.get("Pss", 0.0),
+        "uss": values.get("Private_Clean", 0.0) + values.get("Private_Dirty", 0.0),
+    }
+
+
+def load(port, bodies, concurrency, duration_s):
+    """Clientes con keep-alive enviando /predict hasta agotar el tiempo"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration_s
+
+    def client(i):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        local, failed, k = [], 0, i
+        while time.monotonic() < deadline:
+            body, content_type = bodies[k % len(bodies)]
+            k += concurrency
+            t0 = time.perf_counter()
+            try:
+                conn.request("POST", "/predict", body=body, headers={"Content-Type": content_type})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except OSError:
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+                ok = False
+            if ok:
+                local.append((time.perf_counter() - t0) * 1000)
+            else:
+                failed += 1
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    lat = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "requests_per_s": len(latencies) / elapsed,
+        "latency_ms": {
+            "p50": float(np.percentile(lat, 50)),
+            "p95": float(np.percentile(lat, 95)),
+            "p99": float(np.percentile(lat, 99)),
+        },
+    }
+
+
+def bench(n_workers, args, bodies):
+    env = dict(os.environ, SKIN_CACHE_ENABLED="0")
+    server = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(n_workers), "--host", "127.0.0.1", "--port", str(args.port)],
+        cwd=Path(__file__).resolve().parent,
+        env=env,
+    )
+    try:
+        if not wait_ready(args.port, args.ready_timeout):
+            raise RuntimeError(f"serve.py con {n_workers} workers no estuvo listo en {args.ready_timeout} s")
+        load(args.port, bodies, args.concurrency, min(2.0, args.duration))  # warmup de todos los workers
+        result = load(args.port, bodies, args.concurrency, args.duration)
+        workers = [memory_mb(pid) for pid in child_pids(server.pid)]
+        parent = memory_mb(server.pid)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    total_pss = parent["pss"] + sum(w["pss"] for w in workers)
+    return {
+        "workers": n_workers,
+        **result,
+        "parent_mb": parent,
+        "worker_mb": workers,
+        "rss_per_worker_mb": float(np.mean([w["rss"] for w in workers])) if workers else 0.0,
+        "uss_per_worker_mb": float(np.mean([w["uss"] for w in workers])) if workers else 0.0,
+        "total_pss_mb": total_pss,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="Segundos de carga por configuración")
+    parser.add_argument("--images", type=int, default=32, help="Imágenes sintéticas distintas")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ready-timeout", type=float, default=300.0)
+    parser.add_argument("--out", help="Guardar resultados en JSON")
+    args = parser.parse_args(argv)
+
+    if not Path("/proc/self/smaps_rollup").exists():
+        print("❌ Se necesita Linux con /proc/<pid>/smaps_rollup")
+        return 1
+
+    sexes, sites = ["male", "female"], ["anterior torso", "head/neck", "lower extremity"]
+    bodies = [
+        multipart_body(synthetic_jpeg(seed=i), {"age": 30 + i % 50, "sex": sexes[i % 2], "anatom_site_general": sites[i % 3]})
+        for i in range(args.images)
+    ]
+
+    results = []
+    for n in args.workers:
+        print(f"⏱️  Midiendo {n} worker(s)...")
+        try:
+            results.append(bench(n, args, bodies))
+        except Exception as e:
+            print(f"⚠️ {n} workers falló: {e}")
+
+    print("\n" + "=" * 84)
+    print(f"{'workers':>7} {'req/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'RSS/worker':>11} {'USS/worker':>11} {'PSS total':>10} {'errores':>8}")
+    print("=" * 84)
+    for r in results:
+        print(f"{r['workers']:>7} {r['requests_per_s']:>9.1f} {r['latency_ms']['p50']:>9.1f} "
+              f"{r['latency_ms']['p99']:>9.1f} {r['rss_per_worker_mb']:>11.0f} "
+              f"{r['uss_per_worker_mb']:>11.0f} {r['total_pss_mb']:>10.0f} {r['errors']:>8}")
+    print("(MB; USS = memoria privada de cada worker, PSS total = memoria real del servidor)")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Resultados guardados en {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,334 @@
+"""
+Re-scoring offline de directorios completos de imágenes dermatoscópicas.
+
+    procesos de decode/resize  ->  cola acotada  ->  un consumidor con el modelo (batches grandes)
+
+- La metadata sale de un CSV (imagen, edad, sexo, zona); sin CSV se usan valores desconocidos.
+- Reanudable: la salida CSV es el checkpoint, se vuelve a lanzar y salta lo ya
+  puntuado. Las imágenes que fallaron se reintentan (salvo --skip-errors).
+- Los metadatos se codifican una sola vez, vectorizados, para todo el CSV.
+- Reporta imágenes/s y cuánto tiempo va a cada etapa (lectura, decode, resize, modelo, escritura).
+
+Uso:
+    python bulk_score.py --images /datos/isic --csv /datos/isic/metadata.csv --out scores.csv
+    python bulk_score.py --images /datos/isic --out scores.parquet --workers 8 --batch-size 64
+"""
+import argparse
+import csv
+import json
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from postprocess import Postprocessor
+from preprocessing import MetadataEncoder, decode_image, decode_image_fast, image_to_array
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+MODEL_DIR = BASE_DIR / "fastapi_skin_demo" / "model"
+ARTIFACTS_PATH = MODEL_DIR / "preprocess_artifacts.json"
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+IMAGE_COLUMNS = ("image", "filename", "file", "image_name", "isic_id")
+AGE_COLUMNS = ("age", "age_approx")
+SEX_COLUMNS = ("sex",)
+SITE_COLUMNS = ("anatom_site_general", "anatom_site_general_challenge", "site")
+
+STAGES = ("read", "decode", "resize", "metadata", "queue_wait", "model", "write")
+
+
+# ============================================================================
+# ENTRADAS
+# ============================================================================
+
+def _pick(row, names, default=None):
+    for name in names:
+        if name in row and row[name] not in (None, ""):
+            return row[name]
+    return default
+
+
+def _find_image(images_dir, name):
+    path = images_dir / name
+    if path.suffix:
+        return path
+    for ext in (".jpg", ".jpeg", ".png"):
+        if (images_dir / f"{name}{ext}").exists():
+            return images_dir / f"{name}{ext}"
+    return images_dir / f"{name}.jpg"
+
+
+def list_jobs(images_dir, csv_path=None):
+    """Lista de (id, ruta, edad, sexo, zona) a puntuar"""
+    images_dir = Path(images_dir)
+    if csv_path is None:
+        return [
+            (str(p.relative_to(images_dir)), str(p), None, "unknown", "other")
+            for p in sorted(images_dir.rglob("*")) if p.suffix.lower() in IMAGE_EXTENSIONS
+        ]
+    jobs = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            name = _pick(row, IMAGE_COLUMNS)
+            if name is None:
+                continue
+            jobs.append((
+                name,
+                str(_find_image(images_dir, name)),
+                _pick(row, AGE_COLUMNS),
+                _pick(row, SEX_COLUMNS, "unknown"),
+                _pick(row, SITE_COLUMNS, "other"),
+            ))
+    return jobs
+
+
+def already_done(checkpoint, retry_errors=True):
+    """
+    Ids ya escritos en el CSV de salida (checkpoint). Con retry_errors las filas con
+    error no cuentan como hechas (un error de lectura puede ser transitorio) y se
+    quitan del checkpoint, así la imagen no queda dos veces al reintentarla.
+    """
+    if not checkpoint.exists():
+        return set()
+    with open(checkpoint, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+    failed = [row for row in rows if row.get("error")]
+    if not retry_errors or not failed:
+        return {row["image"] for row in rows}
+
+    ok = [row for row in rows if not row.get("error")]
+    tmp = checkpoint.with_name(checkpoint.name + ".tmp")
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(ok)
+    os.replace(tmp, checkpoint)
+    print(f"🔁 {len(failed)} imágenes con error en la corrida anterior: se reintentan")
+    return {row["image"] for row in ok}
+
+
+# ============================================================================
+# WORKERS DE DECODE (procesos, sin TensorFlow)
+# ============================================================================
+
+_ARTIFACTS = None
+_FAST_DECODE = False
+
+
+def _init_worker(artifacts, fast_decode=False):
+    global _ARTIFACTS, _FAST_DECODE
+    _ARTIFACTS = artifacts
+    _FAST_DECODE = fast_decode
+
+
+def _decode_job(task):
+    """Corre en un proceso del pool: lectura + decode + resize (metadatos ya codificados)"""
+    job, meta = task
+    image_id, path, age, sex, site = job
+    timings = {}
+    try:
+        t0 = time.perf_counter()
+        with open(path, "rb") as f:
+            contents = f.read()
+        t1 = time.perf_counter()
+        img_size = tuple(_ARTIFACTS.get("img_size", [224, 224]))
+        img = decode_image_fast(contents, img_size) if _FAST_DECODE else decode_image(contents)
+        t2 = time.perf_counter()
+        arr = image_to_array(img, img_size)
+        t3 = time.perf_counter()
+        timings = {"read": t1 - t0, "decode": t2 - t1, "resize": t3 - t2}
+        return job, arr, meta, timings, None
+    except Exception as e:
+        return job, None, None, timings, f"{type(e).__name__}: {e}"
+
+
+# ============================================================================
+# SALIDA
+# ============================================================================
+
+def _fieldnames(class_names):
+    return (
+        ["image", "age", "sex", "anatom_site_general"]
+        + [f"top{k}_{field}" for k in (1, 2, 3) for field in ("class", "prob")]
+        + [f"prob_{c}" for c in class_names]
+        + ["error"]
+    )
+
+
+def _row(job, result, error=None):
+    """result: una fila de Postprocessor.rows() o None si la imagen falló"""
+    image_id, _, age, sex, site = job
+    row = {"image": image_id, "age": age, "sex": sex, "anatom_site_general": site, "error": error or ""}
+    if result is not None:
+        for k, entry in enumerate(result["top3"], 1):
+            row[f"top{k}_class"] = entry["class"]
+            row[f"top{k}_prob"] = entry["prob"]
+        for c, p in result["probs"].items():
+            row[f"prob_{c}"] = p
+    return row
+
+
+def to_parquet(csv_path, parquet_path):
+    import pandas as pd
+
+    pd.read_csv(csv_path).to_parquet(parquet_path, index=False)
+    print(f"✅ Parquet escrito: {parquet_path}")
+
+
+# ============================================================================
+# PIPELINE
+# ============================================================================
+
+def run(args):
+    with open(ARTIFACTS_PATH, "r", encoding="utf-8") as f:
+        artifacts = json.load(f)
+    class2idx = artifacts.get("class2idx", {"MEL": 0, "NV": 1, "BCC": 2, "BKL": 3})
+    postprocessor = Postprocessor(class2idx)
+    class_names = list(postprocessor.labels)
+
+    out_path = Path(args.out)
+    checkpoint = out_path if out_path.suffix.lower() == ".csv" else out_path.with_suffix(".partial.csv")
+
+    jobs = list_jobs(args.images, args.csv)
+    done = already_done(checkpoint, retry_errors=not args.skip_errors) if not args.no_resume else set()
+    todo = [j for j in jobs if j[0] not in done]
+    print(f"📋 {len(jobs)} imágenes, {len(done)} ya puntuadas, {len(todo)} pendientes")
+
+    totals = dict.fromkeys(STAGES, 0.0)
+    scored = errors = 0
+
+    # Metadatos de todas las imágenes pendientes en una sola pasada vectorizada
+    t0 = time.perf_counter()
+    encoded = MetadataEncoder(artifacts).encode_batch(
+        [j[2] for j in todo], [j[3] for j in todo], [j[4] for j in todo]
+    )
+    metadata = list(zip(encoded["age"].tolist(), encoded["sex_ohe"].tolist(), encoded["site_idx"].tolist()))
+    totals["metadata"] = time.perf_counter() - t0
+
+    if todo:
+        # La cola y el semáforo acotan cuántas imágenes decodificadas hay en memoria
+        ready = queue.Queue(maxsize=args.queue_size)
+        slots = threading.BoundedSemaphore(args.queue_size + args.workers * 2)
+
+        def gated_jobs():
+            for task in zip(todo, metadata):
+                slots.acquire()
+                yield task
+
+        # El pool se crea ANTES de cargar el modelo: los hijos no heredan TensorFlow
+        pool = mp.get_context(args.start_method).Pool(args.workers, _init_worker, (artifacts, args.fast_decode))
+
+        def producer():
+            for result in pool.imap_unordered(_decode_job, gated_jobs(), chunksize=4):
+                ready.put((time.perf_counter(), result))
+            ready.put(None)
+
+        import config
+        from engines import engine_paths, load_engine
+
+        engine_name = args.engine or config.ENGINE
+        paths = [config.ENGINE_PATH] if config.ENGINE_PATH else engine_paths(MODEL_DIR, engine_name, config.MODEL_VARIANT)
+        engine = load_engine(engine_name, paths, compiled=config.COMPILED_INFERENCE,
+                             buckets=config.BATCH_BUCKETS, max_diff=config.COMPILED_MAX_DIFF,
+                             num_threads=config.ENGINE_THREADS, xnnpack=config.TFLITE_XNNPACK)
+
+        new_file = not checkpoint.exists() or args.no_resume
+        out = open(checkpoint, "w" if new_file else "a", newline="", encoding="utf-8")
+        writer = csv.DictWriter(out, fieldnames=_fieldnames(class_names))
+        if new_file:
+            writer.writeheader()
+
+        start = time.perf_counter()
+        threading.Thread(target=producer, daemon=True).start()
+        finished = False
+        try:
+            while not finished:
+                batch = []
+                while len(batch) < args.batch_size:
+                    # Primer elemento: esperar; resto: solo lo que ya está listo
+                    try:
+                        item = ready.get(timeout=None if not batch else 0.005)
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        finished = True
+                        break
+                    enqueued, result = item
+                    totals["queue_wait"] += time.perf_counter() - enqueued
+                    slots.release()
+                    job, arr, meta, timings, error = result
+                    for stage, value in timings.items():
+                        totals[stage] += value
+                    if error is not None:
+                        writer.writerow(_row(job, None, error))
+                        errors += 1
+                    else:
+                        batch.append((job, arr, meta))
+
+                if batch:
+                    t0 = time.perf_counter()
+                    probs = engine.predict({
+                        "image": np.stack([b[1] for b in batch]),
+                        "age": np.array([b[2][0] for b in batch]),
+                        "sex_ohe": np.array([b[2][1] for b in batch]),
+                        "site_idx": np.array([b[2][2] for b in batch]),
+                    })
+                    t1 = time.perf_counter()
+                    # Top 3 y probabilidades de todo el batch de una vez
+                    for (job, _, _), result in zip(batch, postprocessor.rows(probs)):
+                        writer.writerow(_row(job, result))
+                    out.flush()
+                    totals["model"] += t1 - t0
+                    totals["write"] += time.perf_counter() - t1
+                    scored += len(batch)
+
+                elapsed = time.perf_counter() - start
+                print(f"\r⏳ {scored + errors}/{len(todo)} ({scored / elapsed if elapsed else 0:.1f} img/s)", end="", flush=True)
+        finally:
+            out.close()
+            pool.terminate()
+
+        elapsed = time.perf_counter() - start
+        print(f"\n\n✅ {scored} imágenes puntuadas, {errors} con error, en {elapsed:.1f} s "
+              f"({scored / elapsed if elapsed else 0:.1f} img/s)")
+        print(f"\n{'etapa':<12} {'total s':>10} {'ms/img':>10} {'%':>6}")
+        processed = max(scored + errors, 1)
+        stage_sum = sum(totals.values()) or 1.0
+        for stage in STAGES:
+            print(f"{stage:<12} {totals[stage]:>10.2f} {totals[stage] * 1000 / processed:>10.2f} "
+                  f"{totals[stage] * 100 / stage_sum:>5.1f}%")
+        print(f"(read/decode/resize son tiempo sumado de {args.workers} procesos en paralelo)")
+
+    if out_path != checkpoint and checkpoint.exists():
+        to_parquet(checkpoint, out_path)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", required=True, help="Directorio de imágenes")
+    parser.add_argument("--csv", help="CSV con image/filename, age, sex, anatom_site_general")
+    parser.add_argument("--out", default="scores.csv", help="Salida .csv o .parquet")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--queue-size", type=int, default=256, help="Imágenes decodificadas en espera (memoria)")
+    parser.add_argument("--engine", choices=["keras", "tflite", "onnx"], help="Por defecto SKIN_ENGINE")
+    parser.add_argument("--start-method", default="spawn" if sys.platform != "linux" else "fork",
+                        choices=["fork", "spawn", "forkserver"])
+    parser.add_argument("--fast-decode", action="store_true",
+                        help="Decode JPEG reducido (draft), ver preprocessing.FAST_DECODE_TOLERANCE")
+    parser.add_argument("--no-resume", action="store_true", help="Ignorar la salida existente y empezar de cero")
+    parser.add_argument("--skip-errors", action="store_true",
+                        help="Al reanudar, no reintentar las imágenes que fallaron en la corrida anterior")
+    return run(parser.parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+"""
+Caché de predicciones direccionada por contenido.
+
+La clave base es el SHA-256 de los bytes de la imagen (el mismo hash que calcula
+el frontend en fileHashService.js). Se usan dos niveles:
+  - imagen preprocesada por digest: un cambio solo de metadatos evita decode + resize
+  - predicción completa por (digest, metadatos codificados): una repetición exacta
+    evita también el modelo
+"""
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def image_digest(contents):
+    """SHA-256 hex de los bytes de la imagen"""
+    return hashlib.sha256(contents).hexdigest()
+
+
+def prediction_key(digest, age_norm, sex_ohe, site_idx, version=None):
+    """
+    Clave con los metadatos YA codificados, así 'mujer' y 'female' comparten entrada.
+    `version` separa las predicciones de cada versión del modelo (ver registry.py).
+    """
+    return (digest, round(float(age_norm), 6), tuple(sex_ohe), int(site_idx), version)
+
+
+def _size_of(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_size_of(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_size_of(k) + _size_of(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+
+class LRUCache:
+    """LRU thread-safe con TTL, límite de entradas y límite de memoria"""
+
+    def __init__(self, max_items=1000, max_bytes=None, ttl_s=3600.0):
+        self.max_items = max(1, int(max_items))
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._data = OrderedDict()  # key -> (expira, tamaño, valor)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, _, value = entry
+            if expires < now:
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if isinstance(value, np.ndarray):
+            # El mismo array se comparte entre peticiones: que nadie lo modifique
+            value.flags.writeable = False
+        size = _size_of(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + self.ttl_s, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_items or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self._data),
+                "bytes": self._bytes,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "ttl_s": self.ttl_s,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / total) if total else 0.0,
+            }
@@ -0,0 +1,183 @@
+"""
+Configuración del servidor leída desde variables de entorno.
+Todas tienen un valor por defecto para que `uvicorn main:app` funcione sin nada extra.
+"""
+import os
+from pathlib import Path
+
+
+def env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        print(f"⚠️ {name} inválido, usando {default}")
+        return int(default)
+
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        print(f"⚠️ {name} inválido, usando {default}")
+        return float(default)
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on", "si", "sí")
+
+
+def env_pairs(name, sep):
+    """Pares separados por coma: a=1,b=2 -> {"a": "1", "b": "2"} con sep='='"""
+    pairs = {}
+    for item in os.environ.get(name, "").split(","):
+        if sep in item:
+            key, value = item.split(sep, 1)
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+
+# Micro-batching: máximo de imágenes por pasada del modelo y espera máxima
+# para completar un batch desde que llega la primera petición
+BATCH_MAX_SIZE = env_int("SKIN_BATCH_MAX_SIZE", 16)
+BATCH_MAX_WAIT_MS = env_float("SKIN_BATCH_MAX_WAIT_MS", 10.0)
+
+# Pool de hilos para decodificar/preprocesar fuera del event loop y límite de
+# imágenes en inferencia a la vez (repartido por carril de admisión; las peticiones
+# admitidas esperan su lugar, solo sin admisión se responde 503 con Retry-After)
+INFERENCE_WORKERS = env_int("SKIN_INFERENCE_WORKERS", min(4, os.cpu_count() or 1))
+INFERENCE_MAX_IN_FLIGHT = env_int("SKIN_INFERENCE_MAX_IN_FLIGHT", 32)
+RETRY_AFTER_S = env_int("SKIN_RETRY_AFTER_S", 1)
+
+# Inferencia compilada (tf.function con firma fija por bucket de batch).
+# En el warmup (muestras realistas, cada bucket lleno y con relleno) se compara con
+# Model.predict sobre las mismas filas, y el relleno no puede cambiar las filas
+# reales; si alguno difiere más que COMPILED_MAX_DIFF se desactiva. Los kernels por
+# lotes no son bit a bit iguales entre tamaños de batch (tampoco Model.predict con
+# los micro-batches): 1e-5 en probabilidades es ruido de float32, no un cambio de clase.
+COMPILED_INFERENCE = env_bool("SKIN_COMPILED_INFERENCE", True)
+BATCH_BUCKETS = tuple(
+    int(b) for b in os.environ.get("SKIN_BATCH_BUCKETS", "1,2,4,8,16,32").split(",") if b.strip()
+)
+COMPILED_MAX_DIFF = env_float("SKIN_COMPILED_MAX_DIFF", 1e-5)
+
+# Motor de inferencia: keras, tflite u onnx (ver export_model.py).
+# SKIN_ENGINE_PATH fuerza un archivo concreto en lugar de buscar en fastapi_skin_demo/model
+ENGINE = os.environ.get("SKIN_ENGINE", "keras").strip().lower()
+ENGINE_PATH = Path(os.environ["SKIN_ENGINE_PATH"]) if os.environ.get("SKIN_ENGINE_PATH") else None
+ENGINE_THREADS = env_int("SKIN_ENGINE_THREADS", 0) or None
+
+# Variante del modelo tflite: float32, float16, dynamic o int8 (ver quantize.py)
+MODEL_VARIANT = os.environ.get("SKIN_MODEL_VARIANT", "float32").strip().lower()
+
+# Delegado XNNPACK en tflite. Con 0 los pesos se leen del archivo mapeado en memoria
+# y se comparten entre workers (ver serve.py), a costa de kernels más lentos
+TFLITE_XNNPACK = env_bool("SKIN_TFLITE_XNNPACK", True)
+
+# Caché de predicciones por contenido (SHA-256 de la imagen)
+CACHE_ENABLED = env_bool("SKIN_CACHE_ENABLED", True)
+CACHE_TTL_S = env_float("SKIN_CACHE_TTL_S", 3600)
+IMAGE_CACHE_MB = env_float("SKIN_IMAGE_CACHE_MB", 256)
+PREDICTION_CACHE_ITEMS = env_int("SKIN_PREDICTION_CACHE_ITEMS", 10000)
+
+# Dividir el modelo keras en rama de imagen + cabeza para cachear features por imagen.
+# Opcional: al cargar se compara contra Model.predict con las mismas filas y si difiere
+# más que COMPILED_MAX_DIFF se usa el modelo completo
+SPLIT_MODEL = env_bool("SKIN_SPLIT_MODEL", False)
+EMBEDDING_CACHE_ITEMS = env_int("SKIN_EMBEDDING_CACHE_ITEMS", 20000)
+
+# Máximo de imágenes por petición en /predict/batch
+BATCH_MAX_FILES = env_int("SKIN_BATCH_MAX_FILES", 64)
+
+# /predict/batch/stream: imágenes procesándose a la vez y máximo por petición. El
+# multipart se parsea a medida que llega (sin límite de campos de request.form()):
+# en memoria hay como mucho STREAM_WINDOW imágenes más los metadatos sin emparejar
+STREAM_WINDOW = env_int("SKIN_STREAM_WINDOW", 16)
+STREAM_MAX_FILES = env_int("SKIN_STREAM_MAX_FILES", 100000)
+
+# Decode rápido de JPEG (draft + resize) en lugar del decode completo. Aproximado,
+# ver preprocessing.FAST_DECODE_TOLERANCE y verificar_decodificacion.py. Solo se
+# aplica a imágenes de al menos FAST_DECODE_MIN_PIXELS; las más chicas siguen el
+# camino exacto, que a esa resolución es igual de rápido
+FAST_DECODE = env_bool("SKIN_FAST_DECODE", False)
+FAST_DECODE_DRAFT_FACTOR = env_int("SKIN_FAST_DECODE_DRAFT_FACTOR", 2)
+FAST_DECODE_MIN_PIXELS = env_int("SKIN_FAST_DECODE_MIN_PIXELS", 1_000_000)
+
+# Cargar el modelo en segundo plano al arrancar el servidor. Con 0 se carga con
+# la primera petición de predicción (que recibe 503 mientras tanto)
+LOAD_MODEL_ON_STARTUP = env_bool("SKIN_LOAD_MODEL_ON_STARTUP", True)
+
+# Inferencia en un proceso aparte (inference_server.py). Con un socket configurado
+# el front-end no carga el modelo: envía los tensores por memoria compartida.
+# Si el servidor no responde en IPC_CONNECT_TIMEOUT_S se usa el modelo local
+# (salvo SKIN_IPC_FALLBACK=0)
+INFERENCE_SOCKET = os.environ.get("SKIN_INFERENCE_SOCKET", "").strip()
+IPC_SLOTS = env_int("SKIN_IPC_SLOTS", 64)
+IPC_FALLBACK = env_bool("SKIN_IPC_FALLBACK", True)
+IPC_CONNECT_TIMEOUT_S = env_float("SKIN_IPC_CONNECT_TIMEOUT_S", 30)
+# Plazo de cada imagen enviada al servidor: vencido, la petición falla y su slot se libera
+IPC_REQUEST_TIMEOUT_S = env_float("SKIN_IPC_REQUEST_TIMEOUT_S", 30)
+
+# Registro de versiones del modelo (registry.py). SKIN_MODEL_VERSION nombra la
+# versión base. SKIN_MODEL_VERSIONS carga versiones extra al arrancar:
+# "improved=model_multimodal_improved.keras,int8=model_multimodal.int8.tflite"
+# (rutas relativas a fastapi_skin_demo/model, motor según la extensión).
+# SKIN_CANARY reparte tráfico: "improved:0.1" manda el 10% a esa versión
+MODEL_VERSION = os.environ.get("SKIN_MODEL_VERSION", "base").strip() or "base"
+MODEL_VERSIONS = env_pairs("SKIN_MODEL_VERSIONS", "=")
+CANARY = {k: float(v) for k, v in env_pairs("SKIN_CANARY", ":").items()}
+
+# Token para los endpoints de administración (/models). Vacío = deshabilitados
+ADMIN_TOKEN = os.environ.get("SKIN_ADMIN_TOKEN", "")
+
+# Modo sombra (shadow.py): una versión del registro se compara con la principal en
+# una fracción de /predict, después de responder. Con SHADOW_LOG cada comparación
+# se agrega como una línea JSON
+SHADOW_VERSION = os.environ.get("SKIN_SHADOW_VERSION", "").strip()
+SHADOW_FRACTION = env_float("SKIN_SHADOW_FRACTION", 0.0)
+SHADOW_MAX_IN_FLIGHT = env_int("SKIN_SHADOW_MAX_IN_FLIGHT", 4)
+SHADOW_LOG = os.environ.get("SKIN_SHADOW_LOG", "").strip()
+
+# Latencia por etapa (decode, resize, metadatos, modelo, serialización) en /metrics.
+# Cuesta ~1 µs por etapa; con 0 se usa el preprocesamiento original sin medir
+STAGE_METRICS = env_bool("SKIN_STAGE_METRICS", True)
+
+# Perfiles bajo demanda (profiling.py, endpoints /profile con X-Admin-Token).
+# Los archivos se guardan en PROFILE_DIR. Cada captura dura como mucho
+# PROFILE_MAX_SECONDS; el muestreo de CPU no usa más de PROFILE_OVERHEAD_BUDGET
+# del tiempo (0.02 = 2%). Con PROFILE_SIGNAL, `kill -USR2 <pid>` guarda un perfil
+# de CPU de PROFILE_SIGNAL_SECONDS de ese proceso (útil con varios workers)
+PROFILE_DIR = os.environ.get("SKIN_PROFILE_DIR", str(Path(__file__).resolve().parent / "profiles"))
+PROFILE_MAX_SECONDS = env_float("SKIN_PROFILE_MAX_SECONDS", 60)
+PROFILE_INTERVAL_MS = env_float("SKIN_PROFILE_INTERVAL_MS", 10)
+PROFILE_OVERHEAD_BUDGET = env_float("SKIN_PROFILE_OVERHEAD_BUDGET", 0.02)
+PROFILE_SIGNAL = env_bool("SKIN_PROFILE_SIGNAL", True)
+PROFILE_SIGNAL_SECONDS = env_float("SKIN_PROFILE_SIGNAL_SECONDS", 10)
+
+# Control de admisión (admission.py): peticiones de predicción procesándose a la vez
+# y colas acotadas por carril (interactive: /predict y /predict/sites; batch:
+# /predict/batch*). Se rechaza con 503 antes de leer el upload si la cola del carril
+# está llena o la espera supera ADMISSION_QUEUE_TIMEOUT_S. Batch puede usar como
+# mucho ADMISSION_BATCH_SHARE de los lugares
+ADMISSION_ENABLED = env_bool("SKIN_ADMISSION_ENABLED", True)
+ADMISSION_MAX_ACTIVE = env_int("SKIN_ADMISSION_MAX_ACTIVE", INFERENCE_MAX_IN_FLIGHT)
+ADMISSION_MAX_QUEUED = env_int("SKIN_ADMISSION_MAX_QUEUED", 64)
+ADMISSION_BATCH_MAX_QUEUED = env_int("SKIN_ADMISSION_BATCH_MAX_QUEUED", 8)
+ADMISSION_BATCH_SHARE = env_float("SKIN_ADMISSION_BATCH_SHARE", 0.5)
+ADMISSION_QUEUE_TIMEOUT_S = env_float("SKIN_ADMISSION_QUEUE_TIMEOUT_S", 10)
+
+# Uploads (uploads.py): cada imagen se lee por bloques de UPLOAD_CHUNK_KB con un
+# máximo de UPLOAD_MAX_BYTES; el formato y las dimensiones se comprueban con la
+# cabecera antes de decodificar (más de UPLOAD_MAX_PIXELS = bomba de descompresión).
+# El cuerpo de cada petición tiene su propio límite (ver main.BODY_LIMITS);
+# STREAM_MAX_BYTES limita /predict/batch/stream (0 = sin límite: el cuerpo se lee
+# a medida que hay lugar en la ventana, no se acumula en memoria ni en disco)
+UPLOAD_MAX_BYTES = env_int("SKIN_UPLOAD_MAX_BYTES", 20 * 1024 * 1024)
+UPLOAD_MAX_PIXELS = env_int("SKIN_UPLOAD_MAX_PIXELS", 50_000_000)
+UPLOAD_FORMATS = tuple(
+    f.strip().upper() for f in os.environ.get("SKIN_UPLOAD_FORMATS", "JPEG,PNG,WEBP,BMP,TIFF").split(",") if f.strip()
+)
+UPLOAD_CHUNK_KB = env_int("SKIN_UPLOAD_CHUNK_KB", 64)
+STREAM_MAX_BYTES = env_int("SKIN_STREAM_MAX_BYTES", 0)
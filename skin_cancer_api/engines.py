@@ -0,0 +1,545 @@
+"""
+Motores de inferencia intercambiables: keras, tflite y onnx.
+
+Todos exponen la misma interfaz:
+    engine.predict(batch) -> np.ndarray (N, num_clases)
+donde batch es el diccionario de stack_samples() con image, age, sex_ohe y site_idx.
+
+TensorFlow solo se importa si el motor lo necesita (keras, o tflite sin
+tflite_runtime), así los workers con tflite/onnx arrancan más rápido y usan menos RAM.
+"""
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+INPUT_NAMES = ("image", "age", "sex_ohe", "site_idx")
+ENGINE_NAMES = ("keras", "tflite", "onnx")
+# Variantes cuantizadas producidas por quantize.py (solo motor tflite)
+VARIANTS = ("float32", "float16", "dynamic", "int8")
+
+
+def _conform(arr, shape, dtype):
+    """Ajusta un array del batch a la forma (rango) y dtype que espera el motor"""
+    arr = np.asarray(arr)
+    n = arr.shape[0]
+    dims = tuple(d if isinstance(d, (int, np.integer)) and d > 0 else -1 for d in tuple(shape)[1:])
+    return np.ascontiguousarray(arr.reshape((n,) + dims).astype(dtype, copy=False))
+
+
+# ============================================================================
+# PARIDAD: los caminos rápidos (buckets compilados, modelo dividido) se comparan
+# contra Model.predict sobre las MISMAS n filas sin relleno, que es el camino que
+# reemplazan (el micro-batcher también le pasa n filas). Los kernels por lotes no
+# son bit a bit iguales entre tamaños de batch, por eso se tolera un max |Δ|
+# pequeño. Aparte, el relleno de los buckets se verifica por separado: cambiar
+# las filas de relleno no puede cambiar las filas reales.
+# Las muestras son realistas: imagen aleatoria 0-255, edad normalizada, sex_ohe
+# one-hot válido y varias zonas anatómicas.
+# ============================================================================
+
+PARITY_SAMPLES = 8
+
+
+def parity_batch(specs, n=PARITY_SAMPLES, num_sites=1, seed=0):
+    """specs: {entrada: (forma sin el batch, dtype numpy)} -> batch de n muestras distintas"""
+    rng = np.random.default_rng(seed)
+    batch = {}
+    for name, (shape, dtype) in specs.items():
+        shape = tuple(int(d) for d in shape)
+        if name == "image":
+            arr = rng.uniform(0, 255, (n,) + shape)
+        elif name == "sex_ohe":
+            arr = np.zeros((n,) + shape)
+            arr[np.arange(n), ..., np.arange(n) % shape[-1]] = 1.0
+        elif name == "site_idx":
+            arr = (np.arange(n) % max(1, int(num_sites))).reshape((n,) + (1,) * len(shape))
+            arr = np.broadcast_to(arr, (n,) + shape)
+        else:
+            arr = rng.normal(0, 1, (n,) + shape)
+        batch[name] = np.ascontiguousarray(arr.astype(dtype))
+    return batch
+
+
+def padding_sizes(buckets):
+    """Tamaños a verificar: cada bucket lleno y con el máximo relleno (anterior + 1)"""
+    sizes = set()
+    previous = 0
+    for b in sorted(buckets):
+        sizes.update({previous + 1, b})
+        previous = b
+    return sorted(sizes)
+
+
+def tile_samples(samples, n, offset=0):
+    """n filas repitiendo las muestras en orden (fila i = muestra (i + offset) % len)"""
+    idx = (np.arange(n) + offset) % len(samples["image"])
+    return {k: v[idx] for k, v in samples.items()}
+
+
+def max_parity_diff(predict, reference, samples, sizes, progress=None, label="batch"):
+    """Mayor |Δ| entre predict(n filas) y reference(las mismas n filas), para cada n"""
+    max_diff = 0.0
+    for n in sizes:
+        if progress is not None:
+            progress(f"warmup {label}={n}")
+        batch = tile_samples(samples, n)
+        start = time.perf_counter()
+        out = np.asarray(predict(batch))
+        elapsed = (time.perf_counter() - start) * 1000
+        max_diff = max(max_diff, float(np.max(np.abs(out - np.asarray(reference(batch))))))
+        print(f"🔥 Warmup {label}={n}: {elapsed:.1f} ms")
+    return max_diff
+
+
+# ============================================================================
+# KERAS (con inferencia compilada por buckets)
+# Model.predict crea un data adapter + iterador en cada llamada. Aquí se traza
+# UNA función por tamaño de batch (bucket) al cargar el modelo y se rellena cada
+# batch hasta su bucket, así nunca se retraza con tráfico real.
+# ============================================================================
+
+class CompiledInference:
+
+    def __init__(self, model, buckets=(1, 2, 4, 8, 16, 32)):
+        import tensorflow as tf
+
+        self._tf = tf
+        self.model = model
+        self.buckets = tuple(sorted(set(int(b) for b in buckets if int(b) > 0))) or (1,)
+        self.specs = self._input_specs(model)
+        if set(self.specs) != set(INPUT_NAMES):
+            raise ValueError(f"Entradas del modelo inesperadas: {sorted(self.specs)}")
+        forward = tf.function(lambda inputs: model(inputs, training=False))
+        self._fns = {}
+        for b in self.buckets:
+            signature = {
+                name: tf.TensorSpec((b,) + tuple(spec.shape[1:]), spec.dtype, name=name)
+                for name, spec in self.specs.items()
+            }
+            self._fns[b] = forward.get_concrete_function(signature)
+
+    @staticmethod
+    def _input_specs(model):
+        """Firma de entradas tomada del propio modelo: image, age, sex_ohe, site_idx"""
+        import tensorflow as tf
+
+        specs = {}
+        for inp in model.inputs:
+            name = inp.name.split(":")[0]
+            specs[name] = tf.TensorSpec((None,) + tuple(inp.shape[1:]), tf.as_dtype(inp.dtype), name=name)
+        return specs
+
+    def _bucket_for(self, n):
+        for b in self.buckets:
+            if b >= n:
+                return b
+        return self.buckets[-1]
+
+    def _prepare(self, batch, n, bucket, filler=None):
+        """Castea al dtype de la entrada y rellena hasta el tamaño del bucket (con ceros, o
+        con las filas de `filler` para verificar que el relleno no se filtra)"""
+        tensors = {}
+        for name, spec in self.specs.items():
+            arr = _conform(batch[name], spec.shape, spec.dtype.as_numpy_dtype)
+            if bucket > n:
+                if filler is None:
+                    pad = np.zeros((bucket - n,) + arr.shape[1:], dtype=arr.dtype)
+                else:
+                    pad = _conform(filler[name][:bucket - n], spec.shape, spec.dtype.as_numpy_dtype)
+                arr = np.concatenate([arr, pad])
+            tensors[name] = self._tf.constant(arr)
+        return tensors
+
+    def __call__(self, batch):
+        n = len(batch["image"])
+        max_bucket = self.buckets[-1]
+        outputs = []
+        # Batches más grandes que el mayor bucket se parten en trozos
+        for start in range(0, n, max_bucket):
+            chunk = {k: np.asarray(v)[start:start + max_bucket] for k, v in batch.items()}
+            m = len(chunk["image"])
+            bucket = self._bucket_for(m)
+            out = self._fns[bucket](self._prepare(chunk, m, bucket))
+            outputs.append(np.asarray(out)[:m])
+        return np.concatenate(outputs)
+
+    def warmup(self, samples, reference, progress=None):
+        """
+        Ejecuta cada bucket (lleno y con el máximo relleno, ej. 3 -> 4) y compara
+        contra reference (Model.predict) con las mismas filas sin rellenar.
+        Retorna (mayor |Δ| contra reference, mayor |Δ| por cambiar el relleno).
+        """
+        diff = max_parity_diff(self, reference, samples, padding_sizes(self.buckets), progress)
+        return diff, self.padding_leak(samples)
+
+    def padding_leak(self, samples):
+        """Mayor |Δ| en las filas reales al rellenar con ceros o con otras muestras"""
+        leak = 0.0
+        previous = 0
+        for bucket in self.buckets:
+            n = previous + 1
+            previous = bucket
+            if n >= bucket:
+                continue
+            batch = tile_samples(samples, n)
+            zeros = np.asarray(self._fns[bucket](self._prepare(batch, n, bucket)))[:n]
+            filled = self._fns[bucket](self._prepare(batch, n, bucket, tile_samples(samples, bucket - n, offset=n)))
+            leak = max(leak, float(np.max(np.abs(zeros - np.asarray(filled)[:n]))))
+        return leak
+
+
+def _flatten(x):
+    if isinstance(x, dict):
+        x = list(x.values())
+    if isinstance(x, (list, tuple)):
+        out = []
+        for v in x:
+            out.extend(_flatten(v))
+        return out
+    return [x]
+
+
+class SplitModel:
+    """
+    Divide el grafo Keras en dos submodelos:
+      image_model: image -> features (todo lo que depende SOLO de la imagen)
+      head_model:  features + age + sex_ohe + site_idx -> probabilidades
+    Así las features de una imagen se cachean y cambiar metadatos solo corre la cabeza.
+    """
+
+    def __init__(self, model, image_input="image"):
+        import tensorflow as tf
+
+        keras = tf.keras
+        inputs = {inp.name.split(":")[0]: inp for inp in model.inputs}
+        if set(inputs) != set(INPUT_NAMES):
+            raise ValueError(f"Entradas del modelo inesperadas: {sorted(inputs)}")
+
+        # Qué entradas alimentan a cada tensor del grafo
+        deps = {id(t): {name} for name, t in inputs.items()}
+        tensors = []
+        consumers = {}
+        for layer in model.layers:
+            if isinstance(layer, keras.layers.InputLayer):
+                continue
+            layer_inputs = _flatten(layer.input)
+            d = set().union(*(deps.get(id(t), set()) for t in layer_inputs))
+            for t in layer_inputs:
+                consumers.setdefault(id(t), []).append(d)
+            for t in _flatten(layer.output):
+                deps[id(t)] = d
+                tensors.append(t)
+
+        # Frontera: tensores solo-imagen que consume una capa que mezcla metadatos
+        frontier = [
+            t for t in tensors
+            if deps[id(t)] == {image_input}
+            and any(d != {image_input} for d in consumers.get(id(t), []))
+        ]
+        if not frontier:
+            raise ValueError("No se encontró la frontera entre la rama de imagen y la de metadatos")
+
+        self.meta_names = [name for name in INPUT_NAMES if name != image_input]
+        self._meta_inputs = {name: inputs[name] for name in self.meta_names}
+        self.image_model = keras.Model(inputs[image_input], frontier)
+        self.head_model = keras.Model(frontier + [inputs[n] for n in self.meta_names], model.outputs)
+        self._embed_fn = tf.function(lambda x: self.image_model(x, training=False), reduce_retracing=True)
+        self._head_fn = tf.function(lambda xs: self.head_model(xs, training=False), reduce_retracing=True)
+        self._image_dtype = tf.as_dtype(inputs[image_input].dtype).as_numpy_dtype
+        self._tf = tf
+
+    def embed(self, images):
+        """(N, H, W, 3) -> lista de arrays de features, uno por tensor de la frontera"""
+        outs = self._embed_fn(self._tf.constant(np.asarray(images, dtype=self._image_dtype)))
+        return [np.asarray(o) for o in _flatten(outs)]
+
+    def head(self, features, batch):
+        """features: lista de arrays (N, ...) en el orden de embed(); batch: age, sex_ohe, site_idx"""
+        meta = []
+        for name in self.meta_names:
+            inp = self._meta_inputs[name]
+            dtype = self._tf.as_dtype(inp.dtype).as_numpy_dtype
+            meta.append(_conform(batch[name], inp.shape, dtype))
+        xs = [self._tf.constant(f) for f in features] + [self._tf.constant(m) for m in meta]
+        return np.asarray(self._head_fn(xs))
+
+    def predict(self, batch):
+        """Imagen -> features -> cabeza, como lo hace el servidor con la caché de features"""
+        return self.head(self.embed(batch["image"]), batch)
+
+    def warmup(self, samples, reference, sizes, progress=None):
+        """
+        Traza embed/cabeza con los tamaños de batch que va a recibir (así no se trazan
+        con tráfico real) y compara contra reference (Model.predict) con las mismas filas.
+        """
+        return max_parity_diff(self.predict, reference, samples, sizes, progress, label="split")
+
+
+def _num_sites(model):
+    """Zonas válidas para las muestras de paridad: el menor input_dim de los Embedding"""
+    import tensorflow as tf
+
+    dims = [layer.input_dim for layer in model.layers if isinstance(layer, tf.keras.layers.Embedding)]
+    return min(dims) if dims else 1
+
+
+class KerasEngine:
+    name = "keras"
+
+    def __init__(self, path, compiled=True, buckets=(1, 2, 4, 8, 16, 32), max_diff=1e-5, split=False,
+                 num_sites=None, progress=None):
+        progress = progress or (lambda stage: None)
+        progress("importando TensorFlow")
+        import tensorflow as tf
+
+        self.path = path
+        progress(f"cargando pesos {Path(path).name}")
+        self.model = tf.keras.models.load_model(str(path))
+        self.infer_fn = None
+        self.split = None
+        if not (compiled or split):
+            return
+
+        # Referencia: Model.predict con las mismas filas, el camino que se reemplaza
+        specs = {
+            inp.name.split(":")[0]: (tuple(inp.shape[1:]), tf.as_dtype(inp.dtype).as_numpy_dtype)
+            for inp in self.model.inputs
+        }
+        samples = parity_batch(specs, num_sites=num_sites or _num_sites(self.model))
+        reference = lambda batch: self.model.predict(batch, verbose=0)
+
+        if compiled:
+            try:
+                progress("trazando inferencia compilada")
+                infer_fn = CompiledInference(self.model, buckets)
+                diff, leak = infer_fn.warmup(samples, reference, progress)
+                if max(diff, leak) > max_diff:
+                    print(f"⚠️ Inferencia compilada difiere de Model.predict (max |Δ|={diff:.2e}, "
+                          f"relleno={leak:.2e}, tolerancia={max_diff:.0e}), usando Model.predict")
+                else:
+                    self.infer_fn = infer_fn
+                    print(f"✅ Inferencia compilada lista, buckets={infer_fn.buckets} "
+                          f"(max |Δ|={diff:.2e}, relleno={leak:.2e})")
+            except Exception as e:
+                print(f"⚠️ No se pudo compilar la inferencia, usando Model.predict: {e}")
+        if split:
+            progress("dividiendo modelo imagen/cabeza")
+            try:
+                split_model = SplitModel(self.model)
+                diff = split_model.warmup(samples, reference, padding_sizes(buckets), progress)
+                if diff > max_diff:
+                    print(f"⚠️ Modelo dividido difiere de Model.predict (max |Δ|={diff:.2e}, "
+                          f"tolerancia={max_diff:.0e}), se usa completo")
+                else:
+                    self.split = split_model
+                    print(f"✅ Modelo dividido: imagen -> {len(split_model.image_model.outputs)} tensor(es) "
+                          f"de features -> cabeza (max |Δ|={diff:.2e})")
+            except Exception as e:
+                print(f"⚠️ No se pudo dividir el modelo, se usa completo: {e}")
+
+    def predict(self, batch):
+        if self.infer_fn is not None:
+            return self.infer_fn(batch)
+        return self.model.predict(batch, verbose=0)
+
+
+# ============================================================================
+# TFLITE
+# ============================================================================
+
+def _tflite_interpreter_cls():
+    """Prefiere intérpretes livianos; TensorFlow completo solo como último recurso"""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+
+def _op_resolver_without_delegates(Interpreter):
+    """OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES del mismo paquete que el intérprete"""
+    import sys
+    module = sys.modules[Interpreter.__module__]
+    return module.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+
+
+class TFLiteEngine:
+    name = "tflite"
+
+    def __init__(self, path, num_threads=None, xnnpack=True):
+        Interpreter = _tflite_interpreter_cls()
+        self.path = path
+        # Con model_path el archivo se mapea en memoria (mmap). XNNPACK reempaqueta
+        # los pesos en memoria propia de cada proceso; sin él los kernels leen los
+        # pesos directo del mmap y todos los workers comparten las mismas páginas.
+        kwargs = {} if xnnpack else {"experimental_op_resolver_type": _op_resolver_without_delegates(Interpreter)}
+        self.interpreter = Interpreter(model_path=str(path), num_threads=num_threads, **kwargs)
+        # El intérprete no es thread-safe
+        self._lock = threading.Lock()
+        self._inputs = {}
+        for detail in self.interpreter.get_input_details():
+            key = self._input_key(detail["name"])
+            self._inputs[key] = detail
+        if set(self._inputs) != set(INPUT_NAMES):
+            raise ValueError(f"Entradas TFLite inesperadas: {[d['name'] for d in self.interpreter.get_input_details()]}")
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = None
+
+    @staticmethod
+    def _input_key(tensor_name):
+        """'serving_default_sex_ohe:0' -> 'sex_ohe'"""
+        base = tensor_name.split(":")[0]
+        for key in sorted(INPUT_NAMES, key=len, reverse=True):
+            if base == key or base.endswith("_" + key):
+                return key
+        return base
+
+    def _resize(self, n):
+        for detail in self._inputs.values():
+            shape = [n] + list(detail["shape_signature"][1:])
+            self.interpreter.resize_tensor_input(detail["index"], [d if d > 0 else 1 for d in shape])
+        self.interpreter.allocate_tensors()
+        self._batch_size = n
+
+    @staticmethod
+    def _input_array(arr, detail):
+        """Cuantiza entradas float si el modelo es int8 de punta a punta"""
+        scale, zero_point = detail.get("quantization", (0.0, 0))
+        if scale and np.issubdtype(detail["dtype"], np.integer):
+            info = np.iinfo(detail["dtype"])
+            arr = np.clip(np.round(np.asarray(arr, np.float32) / scale + zero_point), info.min, info.max)
+        return _conform(arr, detail["shape_signature"], detail["dtype"])
+
+    def predict(self, batch):
+        n = len(batch["image"])
+        with self._lock:
+            if self._batch_size != n:
+                self._resize(n)
+            for key, detail in self._inputs.items():
+                self.interpreter.set_tensor(detail["index"], self._input_array(batch[key], detail))
+            self.interpreter.invoke()
+            out = np.array(self.interpreter.get_tensor(self._output["index"]))
+        scale, zero_point = self._output.get("quantization", (0.0, 0))
+        if scale:
+            out = (out.astype(np.float32) - zero_point) * scale
+        return out
+
+
+# ============================================================================
+# ONNX
+# ============================================================================
+
+class OnnxEngine:
+    name = "onnx"
+
+    _DTYPES = {
+        "tensor(float)": np.float32,
+        "tensor(double)": np.float64,
+        "tensor(int32)": np.int32,
+        "tensor(int64)": np.int64,
+    }
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+
+        self.path = path
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = int(num_threads)
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self._inputs = {inp.name.split(":")[0]: inp for inp in self.session.get_inputs()}
+        if set(self._inputs) != set(INPUT_NAMES):
+            raise ValueError(f"Entradas ONNX inesperadas: {sorted(self._inputs)}")
+        self._output_name = self.session.get_outputs()[0].name
+
+    def predict(self, batch):
+        feed = {
+            inp.name: _conform(batch[key], inp.shape, self._DTYPES.get(inp.type, np.float32))
+            for key, inp in self._inputs.items()
+        }
+        return self.session.run([self._output_name], feed)[0]
+
+
+# ============================================================================
+# SELECCIÓN DE MOTOR
+# ============================================================================
+
+def engine_paths(model_dir, name, variant="float32"):
+    """
+    Archivos candidatos para cada motor, en orden de preferencia.
+    Con tflite, variant elige la versión cuantizada (ej. model_multimodal.int8.tflite).
+    """
+    if name == "keras":
+        return [
+            model_dir / "best_model_checkpoint.keras",
+            model_dir / "model_multimodal.keras",
+        ]
+    if name == "tflite" and variant and variant != "float32":
+        if variant not in VARIANTS:
+            raise ValueError(f"Variante desconocida '{variant}', opciones: {', '.join(VARIANTS)}")
+        suffix = f".{variant}.tflite"
+    else:
+        suffix = {"tflite": ".tflite", "onnx": ".onnx"}[name]
+    return [
+        model_dir / f"best_model_checkpoint{suffix}",
+        model_dir / f"model_multimodal{suffix}",
+    ]
+
+
+def engine_for_path(path):
+    """Motor según la extensión del archivo (.keras/.h5, .tflite, .onnx)"""
+    suffix = Path(path).suffix.lower()
+    if suffix == ".tflite":
+        return "tflite"
+    if suffix == ".onnx":
+        return "onnx"
+    return "keras"
+
+
+def load_engine(name, paths, **options):
+    """
+    Carga el primer archivo disponible de `paths` con el motor indicado.
+    options["progress"], si se pasa, recibe un texto por cada etapa de la carga.
+    """
+    progress = options.get("progress") or (lambda stage: None)
+    if name not in ENGINE_NAMES:
+        raise ValueError(f"Motor desconocido '{name}', opciones: {', '.join(ENGINE_NAMES)}")
+
+    for path in paths:
+        if not path.exists():
+            continue
+        try:
+            print(f"📦 Cargando modelo ({name}) desde {path}...")
+            if name == "keras":
+                engine = KerasEngine(
+                    path,
+                    compiled=options.get("compiled", True),
+                    buckets=options.get("buckets", (1, 2, 4, 8, 16, 32)),
+                    max_diff=options.get("max_diff", 1e-5),
+                    split=options.get("split", False),
+                    num_sites=options.get("num_sites"),
+                    progress=progress,
+                )
+            elif name == "tflite":
+                progress(f"cargando {path.name}")
+                engine = TFLiteEngine(path, num_threads=options.get("num_threads"),
+                                      xnnpack=options.get("xnnpack", True))
+            else:
+                progress(f"cargando {path.name}")
+                engine = OnnxEngine(path, num_threads=options.get("num_threads"))
+            print(f"✅ Modelo cargado: {path.name}")
+            return engine
+        except Exception as e:
+            print(f"⚠️ Error cargando {path.name}: {e}")
+
+    raise RuntimeError(f"❌ No se pudo cargar ningún modelo para el motor '{name}'")
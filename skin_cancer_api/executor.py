@@ -0,0 +1,161 @@
+"""
+Ejecución de la inferencia fuera del event loop de asyncio.
+
+La decodificación de imágenes (PIL) y el preprocesamiento corren en un pool de
+hilos acotado, y el número de imágenes en inferencia tiene un límite.
+
+Sin carril, al alcanzarlo la petición se rechaza de inmediato (Overloaded -> 503
+con Retry-After) en lugar de encolarse sin límite. Las peticiones que ya pasaron
+por el control de admisión (admission.py) piden lugar con su carril y esperan:
+la admisión es la única que rechaza, y aquí cada carril tiene su parte de las
+imágenes (lane_shares) y al liberarse lugar pasa primero el carril más prioritario.
+"""
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """Se alcanzó el límite de peticiones de inferencia en curso"""
+
+    def __init__(self, retry_after):
+        super().__init__("Servidor ocupado, reintentar más tarde")
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """
+    lane_shares: {carril: fracción de max_in_flight que puede usar}, en orden de
+    prioridad (ej. {"interactive": 1.0, "batch": 0.5}).
+    """
+
+    def __init__(self, max_workers=4, max_in_flight=32, retry_after_s=1, lane_shares=None):
+        self.max_workers = max(1, int(max_workers))
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.retry_after_s = retry_after_s
+        self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix="inference")
+        # Solo se modifica desde el event loop, no necesita lock
+        self.in_flight = 0
+        self.rejected = 0
+        self.lane_limits = {
+            lane: max(1, min(self.max_in_flight, int(self.max_in_flight * share)))
+            for lane, share in (lane_shares or {}).items()
+        }
+        self.lane_in_flight = {lane: 0 for lane in self.lane_limits}
+        self._waiters = {lane: collections.deque() for lane in self.lane_limits}
+
+    @asynccontextmanager
+    async def slot(self, weight=1, lane=None):
+        """
+        Reserva `weight` lugares (una petición batch ocupa uno por imagen). Sin
+        carril lanza Overloaded si no hay; con carril espera su turno (ver reserve).
+        Un batch nunca pide más que el límite de su carril: el bloque recibe los
+        lugares concedidos y no debe tener más imágenes que esas en proceso a la vez.
+        """
+        weight = self.acquire(weight) if lane is None else await self.reserve(weight, lane)
+        try:
+            yield weight
+        finally:
+            self.release(weight, lane)
+
+    def _clamp(self, weight, lane):
+        limit = self.max_in_flight if lane is None else self.lane_limits[lane]
+        return min(max(1, int(weight)), limit)
+
+    def _fits(self, weight, lane):
+        return (self.in_flight + weight <= self.max_in_flight
+                and self.lane_in_flight[lane] + weight <= self.lane_limits[lane])
+
+    def _take(self, weight, lane):
+        self.in_flight += weight
+        if lane is not None:
+            self.lane_in_flight[lane] += weight
+
+    def acquire(self, weight=1):
+        """Versión explícita de slot() para reservas que viven más que un bloque (streaming)"""
+        weight = self._clamp(weight, None)
+        if self.in_flight + weight > self.max_in_flight:
+            self.rejected += 1
+            raise Overloaded(self.retry_after_s)
+        self._take(weight, None)
+        return weight
+
+    async def reserve(self, weight, lane):
+        """
+        Como acquire pero para una petición ya admitida: espera lugar en vez de
+        rechazar. Dentro de un carril, en orden de llegada; el carril con prioridad
+        pasa antes aunque haya llegado después.
+        """
+        weight = self._clamp(weight, lane)
+        if not self._ahead(lane) and self._fits(weight, lane):
+            self._take(weight, lane)
+            return weight
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (weight, waiter)
+        self._waiters[lane].append(entry)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(weight, lane)
+            elif entry in self._waiters[lane]:
+                self._waiters[lane].remove(entry)
+            raise
+        return weight
+
+    def _ahead(self, lane):
+        """¿Hay peticiones esperando que deben pasar antes que una nueva de este carril?"""
+        for name, waiters in self._waiters.items():
+            if waiters:
+                return True
+            if name == lane:
+                return False
+        return False
+
+    def _dispatch(self):
+        """Entrega el lugar liberado: el primero de la cola más prioritaria, si cabe"""
+        for lane, waiters in self._waiters.items():
+            while waiters:
+                weight, waiter = waiters[0]
+                if waiter.done():
+                    waiters.popleft()  # cancelada (cliente desconectado)
+                    continue
+                if not self._fits(weight, lane):
+                    # No se adelanta a los carriles de menor prioridad mientras este espera
+                    return
+                waiters.popleft()
+                self._take(weight, lane)
+                waiter.set_result(None)
+
+    def release(self, weight, lane=None):
+        self.in_flight -= weight
+        if lane is not None:
+            self.lane_in_flight[lane] -= weight
+        if any(self._waiters.values()):
+            self._dispatch()
+
+    async def run(self, fn, *args):
+        """Ejecuta fn(*args) en el pool sin bloquear el event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, fn, *args)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "lanes": {
+                lane: {
+                    "max_in_flight": limit,
+                    "in_flight": self.lane_in_flight[lane],
+                    "waiting": len(self._waiters[lane]),
+                }
+                for lane, limit in self.lane_limits.items()
+            },
+        }
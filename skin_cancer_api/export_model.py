@@ -0,0 +1,149 @@
+"""
+Exporta el modelo Keras multimodal a formatos livianos para CPU (TFLite / ONNX)
+y verifica que cada motor reproduce las salidas de Keras dentro de una tolerancia.
+
+Uso:
+    python export_model.py                          # tflite + onnx desde el primer .keras disponible
+    python export_model.py --formats tflite --atol 1e-4
+    python export_model.py --model ../fastapi_skin_demo/model/model_multimodal.keras
+
+Luego se sirve con SKIN_ENGINE=tflite (o onnx) uvicorn main:app
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from engines import INPUT_NAMES, CompiledInference, OnnxEngine, TFLiteEngine, engine_paths
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+MODEL_DIR = BASE_DIR / "fastapi_skin_demo" / "model"
+ARTIFACTS_PATH = MODEL_DIR / "preprocess_artifacts.json"
+
+
+def load_keras_model(path=None):
+    import tensorflow as tf
+
+    paths = [Path(path)] if path else engine_paths(MODEL_DIR, "keras")
+    for p in paths:
+        if p.exists():
+            print(f"📦 Cargando modelo Keras desde {p}...")
+            return tf.keras.models.load_model(str(p)), p
+    raise RuntimeError("❌ No se encontró ningún modelo .keras")
+
+
+def serving_function(model):
+    """tf.function con entradas posicionales con nombre (image, age, sex_ohe, site_idx)"""
+    import tensorflow as tf
+
+    specs = CompiledInference._input_specs(model)
+    signature = [specs[name] for name in INPUT_NAMES]
+
+    @tf.function(input_signature=signature)
+    def serve(image, age, sex_ohe, site_idx):
+        inputs = {"image": image, "age": age, "sex_ohe": sex_ohe, "site_idx": site_idx}
+        return model(inputs, training=False)
+
+    return serve, signature
+
+
+def export_tflite(model, out_path, quantization=None, representative_dataset=None):
+    """
+    Convierte a TFLite. quantization:
+      None      -> float32
+      "float16" -> pesos en float16
+      "dynamic" -> pesos int8, activaciones float (no necesita calibración)
+      "int8"    -> pesos y activaciones int8 calibradas con representative_dataset
+                   (entradas/salidas siguen en float para no cambiar la API)
+    """
+    import tensorflow as tf
+
+    serve, _ = serving_function(model)
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([serve.get_concrete_function()], model)
+    if quantization:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        if representative_dataset is None:
+            raise ValueError("La cuantización int8 necesita representative_dataset")
+        converter.representative_dataset = representative_dataset
+    data = converter.convert()
+    Path(out_path).write_bytes(data)
+    print(f"✅ TFLite exportado: {out_path} ({len(data) / 1e6:.1f} MB)")
+    return Path(out_path)
+
+
+def export_onnx(model, out_path, opset=17):
+    import tf2onnx
+
+    serve, signature = serving_function(model)
+    tf2onnx.convert.from_function(serve, input_signature=signature, opset=opset, output_path=str(out_path))
+    print(f"✅ ONNX exportado: {out_path} ({Path(out_path).stat().st_size / 1e6:.1f} MB)")
+    return Path(out_path)
+
+
+def make_check_batch(artifacts, n=8, seed=0):
+    """Batch sintético reproducible con imágenes aleatorias y metadatos válidos"""
+    rng = np.random.default_rng(seed)
+    img_size = artifacts.get("img_size", [224, 224])
+    n_sex = len(artifacts.get("sex2idx", {"male": 0, "female": 1, "unknown": 2}))
+    n_site = len(artifacts.get("site2idx", {"other": 0}))
+    sex_ohe = np.zeros((n, n_sex))
+    sex_ohe[np.arange(n), rng.integers(0, n_sex, n)] = 1.0
+    return {
+        "image": rng.uniform(0, 255, (n, img_size[0], img_size[1], 3)).astype("float32"),
+        "age": rng.normal(0, 1, n),
+        "sex_ohe": sex_ohe,
+        "site_idx": rng.integers(0, n_site, n),
+    }
+
+
+def check_engine(engine, reference, batch, atol):
+    """Compara las salidas del motor contra las de Keras. Retorna (ok, max |Δ|, acuerdo top-1)"""
+    preds = engine.predict(batch)
+    max_diff = float(np.max(np.abs(preds - reference)))
+    top1 = float(np.mean(np.argmax(preds, 1) == np.argmax(reference, 1)))
+    ok = max_diff <= atol
+    status = "✅" if ok else "❌"
+    print(f"{status} {engine.name}: max |Δ|={max_diff:.2e} (tolerancia {atol:.0e}), top-1 igual en {top1 * 100:.1f}%")
+    return ok, max_diff, top1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Ruta al .keras (por defecto el primero disponible)")
+    parser.add_argument("--formats", nargs="+", default=["tflite", "onnx"], choices=["tflite", "onnx"])
+    parser.add_argument("--out-dir", default=str(MODEL_DIR))
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--atol", type=float, default=1e-4, help="Tolerancia absoluta contra Keras")
+    parser.add_argument("--samples", type=int, default=8, help="Tamaño del batch de verificación")
+    args = parser.parse_args(argv)
+
+    with open(ARTIFACTS_PATH, "r", encoding="utf-8") as f:
+        artifacts = json.load(f)
+
+    model, model_path = load_keras_model(args.model)
+    out_dir = Path(args.out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    batch = make_check_batch(artifacts, args.samples)
+    reference = model.predict(batch, verbose=0)
+
+    all_ok = True
+    for fmt in args.formats:
+        out_path = out_dir / f"{model_path.stem}.{fmt}"
+        if fmt == "tflite":
+            engine = TFLiteEngine(export_tflite(model, out_path))
+        else:
+            engine = OnnxEngine(export_onnx(model, out_path, args.opset))
+        ok, _, _ = check_engine(engine, reference, batch, args.atol)
+        all_ok = all_ok and ok
+
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,42 +1,51 @@
 """
 Módulo de inferencia - COPIA EXACTA del código de fastapi_skin_demo
 SIN MODIFICACIONES para garantizar cero interferencias
+
+Importar este módulo es liviano: NO importa TensorFlow ni carga el modelo.
+La carga ocurre en load_model() (el servidor la lanza al arrancar) o, en
+scripts, automáticamente en la primera predicción.
 """
 from pathlib import Path
-import tensorflow as tf
 import numpy as np
 import json
-import io
-from PIL import Image
+import threading
+import time
+
+import config
+from engines import engine_paths, load_engine
+# Funciones copiadas exactamente de fastapi_skin_demo (módulo sin TensorFlow)
+from preprocessing import preprocess_image_bytes, encode_metadata, efficientnet_preprocess_input
+from preprocessing import preprocess_image_bytes_fast, preprocess_image_bytes_staged, MetadataEncoder
+from metrics import STAGES
+from postprocess import Postprocessor
+from profiling import TF_TRACE
 
 # Configuración
 BASE_DIR = Path(__file__).resolve().parent.parent
 MODEL_DIR = BASE_DIR / "fastapi_skin_demo" / "model"
 ARTIFACTS_PATH = MODEL_DIR / "preprocess_artifacts.json"
 
-MODEL_PATHS = [
-    MODEL_DIR / "best_model_checkpoint.keras",
-    MODEL_DIR / "model_multimodal.keras",
-]
-
-print(f"🔍 Buscando modelo en: {MODEL_DIR}")
+MODEL_PATHS = [config.ENGINE_PATH] if config.ENGINE_PATH else engine_paths(MODEL_DIR, config.ENGINE, config.MODEL_VARIANT)
 
-MODEL = None
 ARTIFACTS = None
 
-# Cargar modelo
-for model_path in MODEL_PATHS:
-    if model_path.exists():
-        try:
-            print(f"📦 Cargando modelo desde {model_path}...")
-            MODEL = tf.keras.models.load_model(str(model_path))
-            print(f"✅ Modelo cargado: {model_path.name}")
-            break
-        except Exception as e:
-            print(f"⚠️ Error cargando {model_path.name}: {e}")
+# Se completan en load_model()
+ENGINE = None
+MODEL = None
+SPLIT = None
 
-if MODEL is None:
-    raise RuntimeError("❌ No se pudo cargar ningún modelo")
+# Estado de carga para el probe de readiness
+MODEL_STATUS = {
+    "state": "not_loaded",  # not_loaded | loading | ready | failed
+    "stage": None,
+    "engine": config.ENGINE,
+    "path": None,
+    "started_at": None,
+    "load_seconds": None,
+    "error": None,
+}
+_LOAD_LOCK = threading.Lock()
 
 # Cargar artifacts
 try:
@@ -47,46 +56,75 @@ except Exception as e:
     print(f"⚠️ Error cargando artifacts: {e}")
     ARTIFACTS = {}
 
+# Tablas de metadatos precalculadas para los caminos batch/offline
+METADATA_ENCODER = MetadataEncoder(ARTIFACTS)
+# Tablas de clases y Top-k vectorizado (una vez, no en cada predicción)
+POSTPROCESSOR = Postprocessor(ARTIFACTS.get("class2idx"))
+
 
 # ============================================================================
-# FUNCIONES COPIADAS EXACTAMENTE DE fastapi_skin_demo/app/utils/preprocessing.py
-# LÍNEA POR LÍNEA, SIN CAMBIOS
+# CICLO DE VIDA DEL MODELO
 # ============================================================================
 
-def preprocess_image_bytes(contents, img_size=(224,224)):
-    """COPIA EXACTA - NO MODIFICAR"""
-    img = Image.open(io.BytesIO(contents)).convert("RGB")
-    img = img.resize((img_size[0], img_size[1]), Image.BILINEAR)
-    arr = np.array(img).astype("float32")
-    return tf.keras.applications.efficientnet.preprocess_input(arr)
+def _progress(stage):
+    MODEL_STATUS["stage"] = stage
+    print(f"⏳ {stage}...")
 
 
-def encode_metadata(age_input, sex_input, site_input, artifacts):
-    """COPIA EXACTA - NO MODIFICAR"""
-    sex2idx = artifacts.get("sex2idx", {"male":0,"female":1,"unknown":2})
-    site2idx = artifacts.get("site2idx", {"other":0})
-    age_mean = float(artifacts.get("age_mean",60))
-    age_std = float(artifacts.get("age_std",16))
+def load_model():
+    """
+    Carga el motor configurado (keras, tflite u onnx). Idempotente y thread-safe:
+    llamadas concurrentes esperan a la misma carga.
+    """
+    global ENGINE, MODEL, SPLIT
+    with _LOAD_LOCK:
+        if ENGINE is not None:
+            return ENGINE
+
+        print(f"🔍 Buscando modelo en: {MODEL_DIR}")
+        MODEL_STATUS.update(state="loading", stage=None, started_at=time.time(), load_seconds=None, error=None)
+        start = time.perf_counter()
+        try:
+            engine = load_engine(
+                config.ENGINE,
+                MODEL_PATHS,
+                compiled=config.COMPILED_INFERENCE,
+                buckets=config.BATCH_BUCKETS,
+                max_diff=config.COMPILED_MAX_DIFF,
+                num_threads=config.ENGINE_THREADS,
+                xnnpack=config.TFLITE_XNNPACK,
+                split=config.SPLIT_MODEL,
+                num_sites=len(ARTIFACTS.get("site2idx", {})) or None,
+                progress=_progress,
+            )
+        except Exception as e:
+            MODEL_STATUS.update(state="failed", error=str(e), load_seconds=time.perf_counter() - start)
+            raise
+
+        # El modelo Keras (y su división imagen/cabeza) solo existe con el motor keras
+        MODEL = getattr(engine, "model", None)
+        SPLIT = getattr(engine, "split", None)
+        ENGINE = engine
+        MODEL_STATUS.update(
+            state="ready",
+            stage="listo",
+            path=str(engine.path),
+            load_seconds=time.perf_counter() - start,
+        )
+        print(f"✅ Modelo listo en {MODEL_STATUS['load_seconds']:.1f} s")
+        return ENGINE
 
-    try:
-        age = float(age_input)
-    except:
-        age = age_mean
-    age_norm = (age - age_mean) / (age_std if age_std!=0 else 1)
 
-    s = str(sex_input).lower()
-    if s in ["f","female","mujer"]:
-        s="female"
-    elif s in ["m","male","hombre"]:
-        s="male"
-    sex_idx = sex2idx.get(s, sex2idx.get("unknown",0))
-    sex_ohe = [0.0]*len(sex2idx)
-    sex_ohe[int(sex_idx)] = 1.0
+def is_ready():
+    return ENGINE is not None
 
-    site_str = str(site_input)
-    site_idx = site2idx.get(site_str, site2idx.get("other",0))
 
-    return age_norm, sex_ohe, int(site_idx)
+def model_status():
+    """Copia del estado de carga, con el tiempo transcurrido si sigue cargando"""
+    status = dict(MODEL_STATUS)
+    if status["state"] == "loading" and status["started_at"]:
+        status["elapsed_seconds"] = time.time() - status["started_at"]
+    return status
 
 
 # ============================================================================
@@ -94,49 +132,189 @@ def encode_metadata(age_input, sex_input, site_input, artifacts):
 # ADAPTADA SOLO PARA RETORNAR TOP 3 EN LUGAR DE TOP 2
 # ============================================================================
 
+def preprocess_image(contents):
+    """Imagen -> tensor (H, W, 3) con el tamaño de los artifacts"""
+    img_size = tuple(ARTIFACTS.get("img_size",[224,224]))
+    if config.STAGE_METRICS:
+        # Mismo resultado, con decode/resize/to_array/preprocess_input medidos por separado
+        return preprocess_image_bytes_staged(
+            contents, img_size, STAGES.time, fast=config.FAST_DECODE, draft_factor=config.FAST_DECODE_DRAFT_FACTOR,
+            min_pixels=config.FAST_DECODE_MIN_PIXELS,
+        )
+    if config.FAST_DECODE:
+        return preprocess_image_bytes_fast(
+            contents, img_size, config.FAST_DECODE_DRAFT_FACTOR, config.FAST_DECODE_MIN_PIXELS,
+        )
+    return preprocess_image_bytes(contents, img_size)
+
+
+def image_shape():
+    """Forma (H, W, 3) de los tensores que produce preprocess_image"""
+    img_size = tuple(ARTIFACTS.get("img_size",[224,224]))
+    return (int(img_size[1]), int(img_size[0]), 3)
+
+
+def sex_dims():
+    """Largo del one-hot de sexo"""
+    return len(ARTIFACTS.get("sex2idx", {"male":0,"female":1,"unknown":2}))
+
+
+def encode_request_metadata(age_value, sex_str: str, anatom_site_str: str):
+    """Metadatos -> (age_norm, sex_ohe, site_idx) con los artifacts cargados"""
+    with STAGES.time("metadata"):
+        return encode_metadata(age_value, sex_str, anatom_site_str, ARTIFACTS)
+
+
+def encode_metadata_batch(ages, sexes, sites):
+    """
+    Versión vectorizada de encode_request_metadata para N filas.
+    Retorna lista de (age_norm, sex_ohe, site_idx), idéntica fila a fila.
+    """
+    with STAGES.time("metadata_batch"):
+        encoded = METADATA_ENCODER.encode_batch(ages, sexes, sites)
+    return list(zip(encoded["age"].tolist(), encoded["sex_ohe"].tolist(), encoded["site_idx"].tolist()))
+
+
+def make_sample(img_arr, age_norm, sex_ohe, site_idx):
+    return {
+        "image": img_arr,
+        "age": age_norm,
+        "sex_ohe": sex_ohe,
+        "site_idx": site_idx,
+    }
+
+
+def build_sample(contents, age_value, sex_str: str, anatom_site_str: str):
+    """
+    Preprocesa imagen + metadatos de UNA petición (EXACTAMENTE como fastapi_skin_demo)
+    y devuelve una muestra lista para apilarse en un batch con stack_samples().
+    """
+    img_arr = preprocess_image(contents)
+    age_norm, sex_ohe, site_idx = encode_request_metadata(age_value, sex_str, anatom_site_str)
+    return make_sample(img_arr, age_norm, sex_ohe, site_idx)
+
+
+def stack_samples(samples):
+    """
+    Apila N muestras en el diccionario de entradas del modelo.
+    Con N=1 produce exactamente el mismo batch que fastapi_skin_demo.
+    """
+    return {
+        "image": np.stack([s["image"] for s in samples]),
+        "age": np.array([s["age"] for s in samples]),
+        "sex_ohe": np.array([s["sex_ohe"] for s in samples]),
+        "site_idx": np.array([s["site_idx"] for s in samples]),
+    }
+
+
+def predict_batch(samples):
+    """Una sola pasada del modelo para N muestras. Retorna array (N, num_clases)"""
+    engine = ENGINE or load_model()
+    with TF_TRACE.forward(len(samples)):
+        return engine.predict(stack_samples(samples))
+
+
+def load_version_engine(engine_name, path):
+    """Motor para una versión adicional del registro (sin dividir, con batcher propio)"""
+    path = Path(path)
+    if not path.is_absolute():
+        path = MODEL_DIR / path
+    return load_engine(
+        engine_name or config.ENGINE,
+        [path],
+        compiled=config.COMPILED_INFERENCE,
+        buckets=config.BATCH_BUCKETS,
+        max_diff=config.COMPILED_MAX_DIFF,
+        num_threads=config.ENGINE_THREADS,
+        xnnpack=config.TFLITE_XNNPACK,
+        num_sites=len(ARTIFACTS.get("site2idx", {})) or None,
+    )
+
+
+def warmup_engine(engine, sizes=None):
+    """Pasadas con imágenes en cero para los tamaños de batch que verá en producción"""
+    sample = make_sample(np.zeros(image_shape(), np.float32), *encode_request_metadata(50, "unknown", "other"))
+    for n in sizes or (1, config.BATCH_MAX_SIZE):
+        engine.predict(stack_samples([sample] * n))
+
+
+def predict_with(engine, samples):
+    """Como predict_batch pero con un motor concreto (versiones del registro)"""
+    with TF_TRACE.forward(len(samples)):
+        return engine.predict(stack_samples(samples))
+
+
+def site_names():
+    """Zonas anatómicas conocidas por el modelo, en orden de índice"""
+    site2idx = ARTIFACTS.get("site2idx", {"other": 0})
+    return sorted(site2idx, key=lambda s: site2idx[s])
+
+
+def embed_images(images):
+    """
+    Features de la rama de imagen para N imágenes preprocesadas (requiere SPLIT).
+    Retorna una tupla de arrays por imagen, lista para cachear.
+    """
+    # La cabeza (predict_from_embedding) queda dentro de la traza sin contar aparte
+    with TF_TRACE.forward(len(images)):
+        outs = SPLIT.embed(np.stack(images))
+    return [tuple(np.array(o[i]) for o in outs) for i in range(len(images))]
+
+
+def predict_from_embedding(embedding, metadata):
+    """
+    Corre solo la cabeza del modelo para UNA imagen con varias combinaciones de
+    metadatos. metadata: lista de (age_norm, sex_ohe, site_idx). Retorna (N, num_clases)
+    """
+    n = len(metadata)
+    features = [np.repeat(np.asarray(e)[None], n, axis=0) for e in embedding]
+    batch = {
+        "age": np.array([m[0] for m in metadata]),
+        "sex_ohe": np.array([m[1] for m in metadata]),
+        "site_idx": np.array([m[2] for m in metadata]),
+    }
+    return SPLIT.head(features, batch)
+
+
+def format_top3(preds):
+    """Convierte el vector de probabilidades de UNA muestra en el Top 3 de la API"""
+    return POSTPROCESSOR.top3_rows(np.asarray(preds)[None])[0]
+
+
+def format_predictions(probs):
+    """
+    Resultados de un batch (N, num_clases) de una sola vez: por fila
+    {"top3": [...], "probs": {clase: prob}, "uncertain": bool}
+    """
+    return POSTPROCESSOR.rows(probs)
+
+
+def format_prediction(preds):
+    """format_predictions para UNA muestra (resultados que llegan de a uno, ej. IPC)"""
+    return POSTPROCESSOR.rows(np.asarray(preds)[None])[0]
+
+
+def predict_top3_from_bytes(contents, age_value: float, sex_str: str, anatom_site_str: str):
+    """
+    Predicción desde los bytes de la imagen en memoria (bytes, bytearray o memoryview),
+    sin pasar por disco. Misma lógica que fastapi_skin_demo, retorna Top 3.
+    """
+    sample = build_sample(contents, age_value, sex_str, anatom_site_str)
+    
+    # Predicción con batch de 1 (EXACTAMENTE como fastapi_skin_demo)
+    preds = predict_batch([sample])[0]
+    
+    return format_top3(preds)
+
+
 def predict_top3(image_path: str, age_value: float, sex_str: str, anatom_site_str: str):
     """
     Predicción usando LA MISMA LÓGICA que fastapi_skin_demo
     Única diferencia: retorna Top 3 en lugar de Top 2
+    Se mantiene para scripts que trabajan con rutas (test_final.py, etc.)
     """
     # Leer imagen
     with open(image_path, "rb") as f:
         contents = f.read()
     
-    # Preprocesar imagen (EXACTAMENTE como fastapi_skin_demo)
-    img_arr = preprocess_image_bytes(contents, tuple(ARTIFACTS.get("img_size",[224,224])))
-    
-    # Codificar metadatos (EXACTAMENTE como fastapi_skin_demo)
-    age_norm, sex_ohe, site_idx = encode_metadata(age_value, sex_str, anatom_site_str, ARTIFACTS)
-    
-    # Preparar batch (EXACTAMENTE como fastapi_skin_demo)
-    batch = {
-        "image": np.expand_dims(img_arr,0),
-        "age": np.array([age_norm]),
-        "sex_ohe": np.expand_dims(np.array(sex_ohe),0),
-        "site_idx": np.array([site_idx])
-    }
-    
-    # Predicción (EXACTAMENTE como fastapi_skin_demo)
-    preds = MODEL.predict(batch, verbose=0)[0]
-    
-    # Ordenar predicciones (EXACTAMENTE como fastapi_skin_demo)
-    order = np.argsort(preds)[::-1]
-    
-    # Obtener Top 3 (en lugar de Top 2 del original)
-    top3_indices = order[:3]
-    
-    # Formatear resultados usando idx2class (EXACTAMENTE como fastapi_skin_demo)
-    # Crear idx2class invirtiendo class2idx
-    class2idx = ARTIFACTS.get("class2idx", {"MEL": 0, "NV": 1, "BCC": 2, "BKL": 3})
-    idx2class = {str(v): k for k, v in class2idx.items()}
-    
-    results = []
-    for idx in top3_indices:
-        class_name = idx2class.get(str(idx), str(idx))
-        results.append({
-            "class": class_name,
-            "prob": float(preds[idx])
-        })
-    
-    return results
+    return predict_top3_from_bytes(contents, age_value, sex_str, anatom_site_str)
@@ -0,0 +1,158 @@
+"""
+Proceso de inferencia dedicado para varios front-ends FastAPI.
+
+Es dueño del modelo (TensorFlow/tflite/onnx) y de un único micro-batcher. Los
+front-ends (serve.py o uvicorn con SKIN_INFERENCE_SOCKET) no cargan el modelo:
+decodifican la imagen, la escriben en su memoria compartida y envían por el socket
+Unix solo el índice del slot y los metadatos (ver ipc.py). Así las peticiones de
+todos los front-ends se agrupan en los mismos batches.
+
+Uso:
+    python inference_server.py --socket /tmp/skin_inference.sock
+    SKIN_INFERENCE_SOCKET=/tmp/skin_inference.sock python serve.py --workers 4
+"""
+import argparse
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import wait
+
+import numpy as np
+
+import config
+from batching import MicroBatcher
+from ipc import (
+    REQUEST,
+    RESPONSE,
+    STATUS_ERROR,
+    STATUS_OK,
+    attach_shared_memory,
+    recv_exact,
+    recv_json,
+    send_json,
+    slot_views,
+)
+
+
+class Connection:
+    """Un front-end conectado: su memoria compartida y las respuestas pendientes"""
+
+    def __init__(self, sock, batcher, image_shape, sex_dims):
+        self.sock = sock
+        self.batcher = batcher
+        self.image_shape = tuple(image_shape)
+        self.sex_dims = sex_dims
+        self._send_lock = threading.Lock()
+        self._futures = set()
+        self._shm = None
+        self._views = []
+
+    def _handshake(self):
+        hello = recv_json(self.sock)
+        if tuple(hello.get("image_shape", ())) != self.image_shape or hello.get("sex_dims") != self.sex_dims:
+            send_json(self.sock, {
+                "ok": False,
+                "error": f"Formato incompatible: se esperaba imagen {list(self.image_shape)} "
+                         f"y sex_ohe de {self.sex_dims}",
+            })
+            return False
+        self._shm = attach_shared_memory(hello["shm"])
+        self._views = slot_views(self._shm, int(hello["slots"]), self.image_shape)
+        send_json(self.sock, {"ok": True})
+        return True
+
+    def _reply(self, req_id, generation, future):
+        self._futures.discard(future)
+        try:
+            payload = np.asarray(future.result(), dtype=np.float64).tobytes()
+            status = STATUS_OK
+        except Exception as e:
+            payload = f"{type(e).__name__}: {e}".encode("utf-8")
+            status = STATUS_ERROR
+        try:
+            with self._send_lock:
+                self.sock.sendall(RESPONSE.pack(req_id, generation, status, len(payload)) + payload)
+        except OSError:
+            pass  # El front-end se desconectó; serve() libera la conexión
+
+    def serve(self):
+        sex_bytes = self.sex_dims * 8
+        try:
+            if not self._handshake():
+                return
+            while True:
+                req_id, generation, slot, age_norm, site_idx = REQUEST.unpack(recv_exact(self.sock, REQUEST.size))
+                sex_ohe = np.frombuffer(recv_exact(self.sock, sex_bytes), dtype=np.float64)
+                # La imagen se pasa como vista del slot compartido: stack_samples la
+                # copia una sola vez al armar el batch
+                sample = {
+                    "image": self._views[slot],
+                    "age": age_norm,
+                    "sex_ohe": sex_ohe.tolist(),
+                    "site_idx": site_idx,
+                }
+                future = self.batcher.submit(sample)
+                self._futures.add(future)
+                future.add_done_callback(lambda f, req_id=req_id, gen=generation: self._reply(req_id, gen, f))
+        except (OSError, ValueError, KeyError, IndexError):
+            pass
+        finally:
+            # No soltar la memoria compartida mientras el batcher lea de sus slots
+            wait(list(self._futures), timeout=30)
+            self._views = []
+            if self._shm is not None:
+                self._shm.close()
+            self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=config.INFERENCE_SOCKET or "/tmp/skin_inference.sock")
+    parser.add_argument("--max-batch", type=int, default=config.BATCH_MAX_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=config.BATCH_MAX_WAIT_MS)
+    args = parser.parse_args(argv)
+
+    import inference
+
+    start = time.perf_counter()
+    inference.load_model()
+    print(f"✅ Modelo cargado en {time.perf_counter() - start:.1f} s")
+
+    batcher = MicroBatcher(
+        inference.predict_batch,
+        max_batch_size=args.max_batch,
+        max_wait_ms=args.max_wait_ms,
+    ).start()
+    image_shape = inference.image_shape()
+    sex_dims = inference.sex_dims()
+
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(args.socket)
+    server.listen(128)
+    print(f"✅ Servidor de inferencia escuchando en {args.socket} (batch máx {batcher.max_batch_size})")
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        while True:
+            sock, _ = server.accept()
+            conn = Connection(sock, batcher, image_shape, sex_dims)
+            threading.Thread(target=conn.serve, name="ipc-connection", daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(args.socket)
+        batcher.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
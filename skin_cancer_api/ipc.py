@@ -0,0 +1,308 @@
+"""
+Canal local entre los procesos FastAPI (front-end) y el proceso de inferencia.
+
+Cada front-end crea un bloque de memoria compartida con `slots` tensores de imagen
+(H, W, 3) float32 y se conecta por un socket Unix a inference_server.py. Por el
+socket solo viajan mensajes de pocos bytes (índice del slot + metadatos codificados
+y, de vuelta, las probabilidades): el servidor lee la imagen directo de la memoria
+compartida, sin serializarla ni copiarla al socket, y agrupa las muestras de
+TODOS los front-ends en el mismo micro-batcher.
+
+Protocolo (little endian):
+    handshake   cliente -> servidor: JSON con prefijo de largo <I
+                servidor -> cliente: JSON {"ok": true} o {"ok": false, "error": ...}
+    petición    REQUEST (req_id, generación, slot, age_norm, site_idx) + sex_ohe float64[sex_dims]
+    respuesta   RESPONSE (req_id, generación, estado, largo) + probabilidades float64 o texto de error
+
+La generación cambia en cada (re)conexión. Cada petición tiene un plazo
+(request_timeout_s): vencido, su future falla y el slot vuelve a quedar libre. Al
+reconectar, las peticiones de la conexión anterior fallan y una respuesta con
+otra generación se descarta, así un slot reutilizado nunca recibe el resultado
+de la petición vieja. El servidor solo lee de los slots, nunca escribe en ellos.
+
+IPCClient.submit() tiene la misma interfaz que MicroBatcher.submit(), así main.py
+usa uno u otro sin cambiar los endpoints.
+"""
+import json
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from executor import Overloaded
+
+HEADER = struct.Struct("<I")
+REQUEST = struct.Struct("<IIIdi")
+RESPONSE = struct.Struct("<IIBI")
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+IMAGE_DTYPE = np.float32
+
+
+def recv_exact(sock, n):
+    """Lee exactamente n bytes o lanza ConnectionError si el otro extremo cierra"""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        k = sock.recv_into(view[got:])
+        if k == 0:
+            raise ConnectionError("Conexión cerrada")
+        got += k
+    return bytes(buf)
+
+
+def send_json(sock, obj):
+    data = json.dumps(obj).encode("utf-8")
+    sock.sendall(HEADER.pack(len(data)) + data)
+
+
+def recv_json(sock):
+    (n,) = HEADER.unpack(recv_exact(sock, HEADER.size))
+    return json.loads(recv_exact(sock, n).decode("utf-8"))
+
+
+def attach_shared_memory(name):
+    """
+    Abre memoria compartida creada por otro proceso. En Python < 3.13 el
+    resource_tracker la registraría como propia y la borraría al salir este
+    proceso, dejando sin buffer al front-end que la creó.
+    """
+    shm = SharedMemory(name=name, create=False)
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+def slot_views(shm, slots, image_shape):
+    """Un array (H, W, 3) por slot, apuntando directo al buffer compartido"""
+    slot_bytes = int(np.prod(image_shape)) * np.dtype(IMAGE_DTYPE).itemsize
+    return [
+        np.ndarray(image_shape, dtype=IMAGE_DTYPE, buffer=shm.buf, offset=i * slot_bytes)
+        for i in range(slots)
+    ]
+
+
+class IPCClient:
+    """
+    Lado front-end. Conecta (y reconecta) en un hilo de fondo; mientras no está
+    conectado, `connected` es False y main.py decide si usar la inferencia local.
+    postprocess_fn(fila) se aplica a cada resultado, igual que en MicroBatcher.
+    """
+
+    def __init__(self, path, image_shape, sex_dims, postprocess_fn=None, slots=64, retry_s=1.0,
+                 retry_after_s=1, request_timeout_s=30.0):
+        self.path = str(path)
+        self.image_shape = tuple(int(d) for d in image_shape)
+        self.sex_dims = int(sex_dims)
+        self.postprocess_fn = postprocess_fn or (lambda row: row)
+        self.slots = max(1, int(slots))
+        self.retry_s = float(retry_s)
+        self.retry_after_s = retry_after_s
+        self.request_timeout_s = float(request_timeout_s)
+
+        slot_bytes = int(np.prod(self.image_shape)) * np.dtype(IMAGE_DTYPE).itemsize
+        self._shm = SharedMemory(create=True, size=self.slots * slot_bytes)
+        self._views = slot_views(self._shm, self.slots, self.image_shape)
+
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._free = list(range(self.slots))
+        self._pending = {}  # req_id -> (slot, future, generación, plazo)
+        self._next_id = 0
+        self._generation = 0
+        self._sock = None
+        self._closed = False
+        self._unavailable_since = time.monotonic()
+        self._thread = None
+        self._reaper = None
+
+        self.sent = 0
+        self.rejected = 0
+        self.disconnects = 0
+        self.timeouts = 0
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def unavailable_for(self):
+        """Segundos sin conexión (0 si está conectado)"""
+        if self.connected:
+            return 0.0
+        return time.monotonic() - self._unavailable_since
+
+    # ------------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ipc-client", daemon=True)
+            self._thread.start()
+            self._reaper = threading.Thread(target=self._reap, name="ipc-reaper", daemon=True)
+            self._reaper.start()
+        return self
+
+    def close(self):
+        self._closed = True
+        sock = self._sock
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread is not None:
+            self._thread.join(5.0)
+            self._thread = None
+        if self._reaper is not None:
+            self._reaper.join(5.0)
+            self._reaper = None
+        self._views = []
+        self._shm.close()
+        self._shm.unlink()
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+
+    def submit(self, sample):
+        """Copia la imagen a un slot libre y envía la petición. Retorna un Future"""
+        future = Future()
+        with self._lock:
+            sock = self._sock
+            if sock is None:
+                future.set_exception(ConnectionError("Servidor de inferencia no conectado"))
+                return future
+            if not self._free:
+                self.rejected += 1
+                future.set_exception(Overloaded(self.retry_after_s))
+                return future
+            slot = self._free.pop()
+            req_id = self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+            generation = self._generation
+            self._pending[req_id] = (slot, future, generation, time.monotonic() + self.request_timeout_s)
+
+        self._views[slot][...] = sample["image"]
+        message = REQUEST.pack(req_id, generation, slot, float(sample["age"]), int(sample["site_idx"]))
+        message += np.asarray(sample["sex_ohe"], dtype=np.float64).tobytes()
+        try:
+            with self._send_lock:
+                sock.sendall(message)
+            self.sent += 1
+        except OSError as e:
+            self._finish(req_id, error=ConnectionError(f"Servidor de inferencia desconectado: {e}"))
+        return future
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._pending)
+        return {
+            "path": self.path,
+            "connected": self.connected,
+            "slots": self.slots,
+            "in_flight": in_flight,
+            "sent": self.sent,
+            "rejected": self.rejected,
+            "disconnects": self.disconnects,
+            "timeouts": self.timeouts,
+        }
+
+    # ------------------------------------------------------------------
+    # Hilo de conexión / lectura
+    # ------------------------------------------------------------------
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            send_json(sock, {
+                "shm": self._shm.name,
+                "slots": self.slots,
+                "image_shape": list(self.image_shape),
+                "sex_dims": self.sex_dims,
+            })
+            reply = recv_json(sock)
+        except BaseException:
+            sock.close()
+            raise
+        if not reply.get("ok"):
+            sock.close()
+            raise ConnectionError(reply.get("error", "handshake rechazado"))
+        return sock
+
+    def _run(self):
+        while not self._closed:
+            try:
+                sock = self._connect()
+            except OSError:
+                time.sleep(self.retry_s)
+                continue
+            print(f"✅ Conectado al servidor de inferencia en {self.path}")
+            with self._lock:
+                self._generation = (self._generation + 1) & 0xFFFFFFFF
+                generation = self._generation
+                self._sock = sock
+            try:
+                self._read(sock, generation)
+            except (OSError, ValueError) as e:
+                if not self._closed:
+                    print(f"⚠️ Servidor de inferencia desconectado: {e}")
+            with self._lock:
+                self._sock = None
+                self._unavailable_since = time.monotonic()
+                pending = [req_id for req_id, entry in self._pending.items() if entry[2] == generation]
+            sock.close()
+            self.disconnects += 1
+            for req_id in pending:
+                self._finish(req_id, error=ConnectionError("Servidor de inferencia desconectado"))
+
+    def _read(self, sock, generation):
+        while True:
+            req_id, req_generation, status, n = RESPONSE.unpack(recv_exact(sock, RESPONSE.size))
+            payload = recv_exact(sock, n)
+            if req_generation != generation:
+                continue  # respuesta de una conexión anterior: su petición ya falló
+            if status == STATUS_OK:
+                self._finish(req_id, row=np.frombuffer(payload, dtype=np.float64), generation=generation)
+            else:
+                self._finish(req_id, error=RuntimeError(payload.decode("utf-8", "replace")), generation=generation)
+
+    def _reap(self):
+        """Falla las peticiones que pasaron su plazo y devuelve sus slots"""
+        interval = min(1.0, self.request_timeout_s / 4)
+        while not self._closed:
+            time.sleep(interval)
+            now = time.monotonic()
+            with self._lock:
+                expired = [req_id for req_id, entry in self._pending.items() if entry[3] <= now]
+            for req_id in expired:
+                if self._finish(req_id, error=TimeoutError(
+                        f"Servidor de inferencia sin respuesta en {self.request_timeout_s:g} s")):
+                    self.timeouts += 1
+
+    def _finish(self, req_id, row=None, error=None, generation=None):
+        """Resuelve la petición y libera su slot. False si ya no estaba pendiente"""
+        with self._lock:
+            entry = self._pending.get(req_id)
+            if entry is None or (generation is not None and entry[2] != generation):
+                return False
+            del self._pending[req_id]
+            slot, future = entry[:2]
+            self._free.append(slot)
+        if error is not None:
+            future.set_exception(error)
+            return True
+        try:
+            future.set_result(self.postprocess_fn(row))
+        except Exception as e:
+            future.set_exception(e)
+        return True
@@ -1,15 +1,260 @@
-from fastapi import FastAPI, UploadFile, File, Form, Body
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Form, Body, Header, Request
+from typing import List, Optional
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+import asyncio
+import collections
+import hmac
+import json
+import signal
+import threading
+import time
 import uvicorn
-import tempfile
-import os
 from pathlib import Path
+from starlette.requests import ClientDisconnect
 
-from inference import predict_top3
+import config
+from admission import BATCH, INTERACTIVE, LANE, AdmissionControl, AdmissionController
+from batching import MicroBatcher
+from cache import LRUCache, image_digest, prediction_key
+from engines import engine_for_path
+from executor import InferenceExecutor, Overloaded
+from ipc import IPCClient
+from metrics import HTTP, STAGES, PrometheusWriter, RequestMetrics, observe_since_request_start
+from profiling import Profiler, ProfilerBusy
+from registry import ModelRegistry
+from shadow import ShadowRunner
+from uploads import RequestBodyLimit, UploadRejected, check_image, iter_parts, multipart_boundary, read_image
+import inference
+from inference import (
+    embed_images,
+    encode_metadata_batch,
+    encode_request_metadata,
+    format_prediction,
+    format_predictions,
+    make_sample,
+    predict_batch,
+    predict_from_embedding,
+    preprocess_image,
+    site_names,
+)
+
+# Micro-batching: agrupa peticiones concurrentes en una sola pasada del modelo
+BATCHER = MicroBatcher(
+    predict_batch,
+    max_batch_size=config.BATCH_MAX_SIZE,
+    max_wait_ms=config.BATCH_MAX_WAIT_MS,
+    postprocess_batch_fn=format_predictions,
+)
+
+# Decodificación/preprocesamiento en un pool acotado, fuera del event loop. Las
+# peticiones admitidas esperan su lugar por carril: batch usa como mucho
+# ADMISSION_BATCH_SHARE de las imágenes y el resto queda para las interactivas
+EXECUTOR = InferenceExecutor(
+    max_workers=config.INFERENCE_WORKERS,
+    max_in_flight=config.INFERENCE_MAX_IN_FLIGHT,
+    retry_after_s=config.RETRY_AFTER_S,
+    lane_shares={INTERACTIVE: 1.0, BATCH: config.ADMISSION_BATCH_SHARE},
+)
+
+# Admisión antes de leer el upload: peticiones procesándose, colas por carril y
+# prioridad de las interactivas sobre los lotes
+ADMISSION = AdmissionController(
+    max_active=config.ADMISSION_MAX_ACTIVE,
+    max_queued=config.ADMISSION_MAX_QUEUED,
+    batch_max_queued=config.ADMISSION_BATCH_MAX_QUEUED,
+    batch_share=config.ADMISSION_BATCH_SHARE,
+    queue_timeout_s=config.ADMISSION_QUEUE_TIMEOUT_S,
+    retry_after_s=config.RETRY_AFTER_S,
+)
+ADMISSION_ROUTES = {
+    "/predict": INTERACTIVE,
+    "/predict/sites": INTERACTIVE,
+    "/predict/batch": BATCH,
+    "/predict/batch/stream": BATCH,
+}
+
+# Tamaño máximo del cuerpo por ruta: una imagen más el resto del formulario
+FORM_OVERHEAD_BYTES = 64 * 1024
+BODY_LIMITS = {
+    "/predict": config.UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES,
+    "/predict/sites": config.UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES,
+    "/predict/batch": config.BATCH_MAX_FILES * (config.UPLOAD_MAX_BYTES + FORM_OVERHEAD_BYTES),
+    "/predict/batch/stream": config.STREAM_MAX_BYTES,
+}
+
+# Caché por contenido: tensor preprocesado por imagen y predicción por imagen+metadatos
+IMAGE_CACHE = LRUCache(
+    max_items=100000,
+    max_bytes=int(config.IMAGE_CACHE_MB * 1024 * 1024),
+    ttl_s=config.CACHE_TTL_S,
+)
+PREDICTION_CACHE = LRUCache(max_items=config.PREDICTION_CACHE_ITEMS, ttl_s=config.CACHE_TTL_S)
+
+# Con el modelo dividido (solo keras): features de la rama de imagen por digest,
+# calculadas en batch igual que el modelo completo. El batcher se crea al
+# terminar de cargar el modelo, si se pudo dividir.
+EMBEDDING_CACHE = LRUCache(max_items=config.EMBEDDING_CACHE_ITEMS, ttl_s=config.CACHE_TTL_S)
+EMBED_BATCHER = None
+
+# Con SKIN_INFERENCE_SOCKET el modelo vive en inference_server.py y este proceso
+# solo decodifica; el cliente se crea en el lifespan (después del fork de serve.py)
+IPC_CLIENT = None
+
+_loader_thread = None
+_loader_lock = threading.Lock()
+
+
+def _load_model():
+    """Corre en un hilo aparte: carga el modelo sin bloquear el arranque del servidor"""
+    global EMBED_BATCHER
+    try:
+        inference.load_model()
+    except Exception as e:
+        print(f"❌ No se pudo cargar el modelo: {e}")
+        return
+    if inference.SPLIT is not None and EMBED_BATCHER is None:
+        EMBED_BATCHER = MicroBatcher(
+            embed_images,
+            max_batch_size=config.BATCH_MAX_SIZE,
+            max_wait_ms=config.BATCH_MAX_WAIT_MS,
+        ).start()
+
+
+def _start_model_loading():
+    global _loader_thread
+    with _loader_lock:
+        if _loader_thread is None:
+            _loader_thread = threading.Thread(target=_load_model, name="model-loader", daemon=True)
+            _loader_thread.start()
+
+
+def _use_ipc():
+    return IPC_CLIENT is not None and IPC_CLIENT.connected
+
+
+def _local_inference_allowed():
+    """Sin servidor de inferencia, o con fallback y el servidor caído más de IPC_CONNECT_TIMEOUT_S"""
+    if IPC_CLIENT is None:
+        return True
+    return config.IPC_FALLBACK and IPC_CLIENT.unavailable_for() >= config.IPC_CONNECT_TIMEOUT_S
+
+
+def _fallback_if_unavailable():
+    if not _use_ipc() and _local_inference_allowed():
+        print("⚠️ Servidor de inferencia no disponible, cargando el modelo en este proceso")
+        _start_model_loading()
+
+
+def _model_ready():
+    return _use_ipc() or inference.is_ready()
+
+
+def _model_status():
+    status = dict(inference.model_status())
+    if IPC_CLIENT is not None:
+        status["ipc"] = IPC_CLIENT.stats()
+    return status
+
+
+def _submit(sample):
+    """Encola una muestra en el servidor de inferencia si está conectado, si no en el modelo local"""
+    if _use_ipc() or (IPC_CLIENT is not None and not inference.is_ready()):
+        # Sin modelo local el cliente IPC falla rápido en vez de cargarlo en el batcher
+        return IPC_CLIENT.submit(sample)
+    return BATCHER.submit(sample)
+
+
+# Versiones del modelo: la base (inference.py, con su camino rápido) y las que se
+# carguen en caliente, cada una con su micro-batcher
+REGISTRY = ModelRegistry(
+    inference.load_version_engine,
+    inference.predict_with,
+    warmup_fn=inference.warmup_engine,
+    max_batch_size=config.BATCH_MAX_SIZE,
+    max_wait_ms=config.BATCH_MAX_WAIT_MS,
+    postprocess_batch_fn=format_predictions,
+)
+REGISTRY.register_builtin(config.MODEL_VERSION, _submit, engine_name=config.ENGINE)
+
+# Modo sombra: compara una versión candidata en una fracción de /predict
+SHADOW = ShadowRunner(max_in_flight=config.SHADOW_MAX_IN_FLIGHT, log_path=config.SHADOW_LOG or None)
+SHADOW.configure(config.SHADOW_VERSION, config.SHADOW_FRACTION)
+
+# Perfiles de CPU / memoria / TensorFlow bajo demanda (/profile y SIGUSR2)
+PROFILER = Profiler(
+    config.PROFILE_DIR,
+    max_seconds=config.PROFILE_MAX_SECONDS,
+    interval_ms=config.PROFILE_INTERVAL_MS,
+    overhead_budget=config.PROFILE_OVERHEAD_BUDGET,
+)
+
+
+def _profile_in_background():
+    try:
+        PROFILER.cpu(config.PROFILE_SIGNAL_SECONDS)
+    except ProfilerBusy as e:
+        print(f"⚠️ {e}")
+
+
+def _profile_on_signal(signum, frame):
+    """kill -USR2 <pid>: perfil de CPU de este proceso (con serve.py, de ese worker)"""
+    threading.Thread(target=_profile_in_background, name="profile-signal", daemon=True).start()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global IPC_CLIENT
+    BATCHER.start()
+    print(f"✅ Micro-batching activo (max {BATCHER.max_batch_size} imágenes / {config.BATCH_MAX_WAIT_MS} ms)")
+    if config.INFERENCE_SOCKET:
+        IPC_CLIENT = IPCClient(
+            config.INFERENCE_SOCKET,
+            inference.image_shape(),
+            inference.sex_dims(),
+            format_prediction,
+            slots=config.IPC_SLOTS,
+            retry_after_s=config.RETRY_AFTER_S,
+            request_timeout_s=config.IPC_REQUEST_TIMEOUT_S,
+        ).start()
+        print(f"🔌 Inferencia en proceso aparte vía {config.INFERENCE_SOCKET}")
+        if config.IPC_FALLBACK and config.LOAD_MODEL_ON_STARTUP:
+            timer = threading.Timer(config.IPC_CONNECT_TIMEOUT_S, _fallback_if_unavailable)
+            timer.daemon = True
+            timer.start()
+    elif config.LOAD_MODEL_ON_STARTUP:
+        _start_model_loading()
+    for name, path in config.MODEL_VERSIONS.items():
+        REGISTRY.load(name, path, engine_for_path(path))
+    if config.CANARY:
+        REGISTRY.set_canary(config.CANARY)
+    if config.PROFILE_SIGNAL and hasattr(signal, "SIGUSR2"):
+        try:
+            signal.signal(signal.SIGUSR2, _profile_on_signal)
+        except ValueError:
+            pass  # Fuera del hilo principal (ej. TestClient): solo /profile
+    yield
+    SHADOW.shutdown()
+    BATCHER.stop()
+    REGISTRY.stop()
+    if IPC_CLIENT is not None:
+        IPC_CLIENT.close()
+    if EMBED_BATCHER is not None:
+        EMBED_BATCHER.stop()
+    EXECUTOR.shutdown()
+
+
+app = FastAPI(title="Skin Cancer Multimodal API", lifespan=lifespan)
+
+# Control de admisión: el middleware más interno, así sus 503 llevan CORS y se
+# cuentan en /metrics
+app.add_middleware(AdmissionControl, controller=ADMISSION, routes=ADMISSION_ROUTES, enabled=config.ADMISSION_ENABLED)
 
-app = FastAPI(title="Skin Cancer Multimodal API")
+# Límite del cuerpo por ruta: fuera de la admisión, así un upload demasiado grande
+# se rechaza por su Content-Length sin esperar en la cola
+app.add_middleware(RequestBodyLimit, limits=BODY_LIMITS)
 
 # Configuración de CORS para permitir peticiones desde el frontend
 app.add_middleware(
@@ -20,6 +265,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Conteos, errores y duración por ruta para /metrics
+app.add_middleware(RequestMetrics)
+
 # Ruta al directorio dist del frontend
 FRONTEND_DIST = Path(__file__).parent.parent / "oncoderma-frontend" / "dist"
 
@@ -29,8 +277,312 @@ FRONTEND_DIST = Path(__file__).parent.parent / "oncoderma-frontend" / "dist"
 
 @app.get("/health")
 async def health():
+    """Liveness: el proceso responde (no depende de que el modelo esté cargado)"""
+    return {"status": "ok"}
+
+@app.get("/health/live")
+async def health_live():
     return {"status": "ok"}
 
+@app.get("/health/ready")
+async def health_ready():
+    """Readiness: 200 solo con el modelo cargado; si no, 503 con el progreso de la carga"""
+    status = _model_status()
+    ready = _model_ready()
+    return JSONResponse(
+        {"status": "ready" if ready else status["state"], "model": status},
+        status_code=200 if ready else 503,
+    )
+
+@app.get("/stats")
+async def stats():
+    """Métricas de inferencia: histograma de tamaños de batch y espera en cola"""
+    return {
+        "batching": BATCHER.stats(),
+        "ipc": IPC_CLIENT.stats() if IPC_CLIENT is not None else None,
+        "executor": EXECUTOR.stats(),
+        "admission": ADMISSION.stats(),
+        "cache": {
+            "enabled": config.CACHE_ENABLED,
+            "images": IMAGE_CACHE.stats(),
+            "predictions": PREDICTION_CACHE.stats(),
+            "embeddings": EMBEDDING_CACHE.stats(),
+        },
+        "models": REGISTRY.stats(),
+        "shadow": SHADOW.stats(),
+    }
+
+def _batcher_metrics(w, batchers):
+    """Cola, tamaño de batch y tiempos de cada micro-batcher activo (etiqueta batcher=nombre)"""
+    stats = {name: b.stats() for name, b in batchers.items() if b is not None}
+    w.gauge("batch_queue_depth", "Muestras esperando en la cola del micro-batcher",
+            [({"batcher": name}, st["queue_depth"]) for name, st in stats.items()])
+    w.counter("batches_total", "Pasadas del modelo por tamaño de batch",
+              [({"batcher": name, "size": size}, count)
+               for name, st in stats.items() for size, count in st["batch_size_histogram"].items()])
+    w.histogram("batch_queue_wait_seconds", "Espera en cola antes de la pasada del modelo",
+                [({"batcher": name}, st["queue_wait_ms"]) for name, st in stats.items()])
+    w.histogram("batch_forward_seconds", "Duración de cada pasada del modelo (batch completo)",
+                [({"batcher": name}, st["forward_ms"]) for name, st in stats.items()])
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Métricas en formato de texto de Prometheus (histogramas, sin logs por petición)"""
+    w = PrometheusWriter()
+
+    w.counter("http_requests_total", "Peticiones HTTP por método, ruta y estado",
+              [({"method": m, "route": r, "status": st}, c) for (m, r, st), c in HTTP.requests.snapshot().items()])
+    w.counter("http_errors_total", "Respuestas 5xx por ruta",
+              [({"route": r}, c) for r, c in HTTP.errors.snapshot().items()])
+    w.gauge("http_requests_in_flight", "Peticiones HTTP en curso", HTTP.in_flight)
+    w.histogram("http_request_duration_seconds", "Duración de la petición HTTP por ruta",
+                [({"route": r}, snap) for r, snap in HTTP.duration_ms.snapshot().items()])
+    w.histogram("stage_duration_seconds",
+                "Duración por etapa: queue, upload_read, temp_io, digest, decode, resize, to_array, "
+                "preprocess_input, metadata, model, serialize",
+                [({"stage": stage}, snap) for stage, snap in STAGES.snapshot().items()])
+
+    executor = EXECUTOR.stats()
+    w.gauge("inference_in_flight", "Imágenes en inferencia (límite de admisión)", executor["in_flight"])
+    w.gauge("inference_max_in_flight", "Límite de imágenes en inferencia", executor["max_in_flight"])
+    w.counter("inference_rejected_total", "Peticiones rechazadas con 503 por sobrecarga", executor["rejected"])
+    w.gauge("inference_lane_in_flight", "Imágenes en inferencia por carril de admisión",
+            [({"lane": name}, lane["in_flight"]) for name, lane in executor["lanes"].items()])
+    w.gauge("inference_lane_waiting", "Peticiones admitidas esperando lugar en el executor por carril",
+            [({"lane": name}, lane["waiting"]) for name, lane in executor["lanes"].items()])
+
+    admission = ADMISSION.stats()
+    lanes = admission["lanes"]
+    w.gauge("admission_active", "Peticiones admitidas procesándose por carril",
+            [({"lane": name}, lane["active"]) for name, lane in lanes.items()])
+    w.gauge("admission_queued", "Peticiones esperando admisión por carril",
+            [({"lane": name}, lane["queued"]) for name, lane in lanes.items()])
+    w.counter("admission_rejected_total", "Peticiones rechazadas antes de leer el upload por carril y motivo",
+              [({"lane": name, "reason": reason}, count)
+               for name, lane in lanes.items() for reason, count in lane["rejected"].items()])
+    w.histogram("admission_queue_seconds", "Espera en la cola de admisión por carril",
+                [({"lane": name}, lane["queue_ms"]) for name, lane in lanes.items()])
+
+    batchers = {"main": BATCHER, "embed": EMBED_BATCHER}
+    batchers.update({f"version:{name}": v.batcher for name, v in REGISTRY.versions().items() if v.batcher is not None})
+    _batcher_metrics(w, batchers)
+
+    status = inference.model_status()
+    w.gauge("model_ready", "1 si el modelo (o el servidor de inferencia) está listo", int(_model_ready()))
+    w.gauge("model_load_seconds", "Duración de la última carga del modelo base", status.get("load_seconds"))
+    models = REGISTRY.stats()["versions"]
+    w.counter("model_predictions_total", "Predicciones hechas por el modelo (sin caché) por versión",
+              [({"version": name}, v["predictions"]) for name, v in models.items()])
+    w.histogram("model_latency_seconds", "Latencia del modelo por versión (cola + pasada)",
+                [({"version": name}, v["latency_ms"]) for name, v in models.items()])
+
+    caches = {"images": IMAGE_CACHE, "predictions": PREDICTION_CACHE, "embeddings": EMBEDDING_CACHE}
+    cache_stats = {name: c.stats() for name, c in caches.items()}
+    w.counter("cache_hits_total", "Aciertos de caché", [({"cache": n}, st["hits"]) for n, st in cache_stats.items()])
+    w.counter("cache_misses_total", "Fallos de caché", [({"cache": n}, st["misses"]) for n, st in cache_stats.items()])
+    w.gauge("cache_items", "Entradas en caché", [({"cache": n}, st["items"]) for n, st in cache_stats.items()])
+
+    if IPC_CLIENT is not None:
+        ipc = IPC_CLIENT.stats()
+        w.gauge("ipc_connected", "1 si el servidor de inferencia está conectado", int(ipc["connected"]))
+        w.gauge("ipc_in_flight", "Imágenes enviadas al servidor de inferencia sin respuesta", ipc["in_flight"])
+        w.counter("ipc_timeouts_total", "Imágenes sin respuesta del servidor de inferencia dentro del plazo",
+                  ipc["timeouts"])
+
+    if SHADOW.enabled:
+        shadow = SHADOW.stats()
+        w.counter("shadow_compared_total", "Comparaciones completadas en modo sombra", shadow["compared"])
+        w.counter("shadow_dropped_total", "Muestras de sombra descartadas por el límite", shadow["dropped"])
+        w.gauge("shadow_top1_agreement", "Acuerdo top-1 entre versión principal y sombra", shadow["top1_agreement"])
+
+    return Response(w.text(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# ============================================
+# VERSIONES DEL MODELO (registry.py)
+# ============================================
+
+def _admin_error(token):
+    """Los cambios de modelo requieren X-Admin-Token = SKIN_ADMIN_TOKEN"""
+    if not config.ADMIN_TOKEN:
+        return JSONResponse({"error": "Administración deshabilitada (definir SKIN_ADMIN_TOKEN)"}, status_code=403)
+    if not hmac.compare_digest(token or "", config.ADMIN_TOKEN):
+        return JSONResponse({"error": "Token de administración inválido"}, status_code=401)
+    return None
+
+@app.get("/models")
+async def models():
+    """Versiones cargadas, versión por defecto, canary, latencia y drift por versión"""
+    return REGISTRY.stats()
+
+@app.post("/models/{name}")
+async def load_model_version(name: str, body: dict = Body(...), x_admin_token: Optional[str] = Header(None)):
+    """
+    Carga una versión nueva en segundo plano: {"path": "model_multimodal_improved.keras"}
+    (relativa a fastapi_skin_demo/model; "engine" opcional, si no según la extensión).
+    Recibe tráfico solo cuando termina el warmup; consultar el estado en GET /models.
+    """
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    model_dir = inference.MODEL_DIR.resolve()
+    path = (model_dir / str(body.get("path", ""))).resolve()
+    if model_dir not in path.parents or not path.is_file():
+        return JSONResponse({"error": f"Archivo de modelo no encontrado en {model_dir}: {body.get('path')}"}, status_code=404)
+    try:
+        REGISTRY.load(name, path, body.get("engine") or engine_for_path(path))
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    return JSONResponse({"version": name, "state": "loading"}, status_code=202)
+
+@app.post("/models/{name}/promote")
+async def promote_model_version(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Cambio atómico de la versión por defecto; las peticiones en curso terminan en la anterior"""
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    try:
+        previous = REGISTRY.promote(name)
+    except KeyError:
+        return JSONResponse({"error": f"Versión desconocida: '{name}'"}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    return {"default": name, "previous": previous}
+
+@app.put("/models/canary")
+async def set_canary(body: dict = Body(...), x_admin_token: Optional[str] = Header(None)):
+    """{"weights": {"improved": 0.1}} manda el 10% del tráfico sin versión explícita a "improved" """
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    try:
+        REGISTRY.set_canary(body.get("weights") or {})
+    except KeyError as e:
+        return JSONResponse({"error": f"Versión desconocida: {e}"}, status_code=404)
+    except (TypeError, ValueError) as e:
+        return JSONResponse({"error": str(e)}, status_code=422)
+    return {"canary": REGISTRY.stats()["canary"]}
+
+@app.get("/models/shadow")
+async def shadow_stats():
+    """Acuerdo top-1, diferencias de probabilidad y latencias de la versión sombra"""
+    return SHADOW.stats()
+
+@app.put("/models/shadow")
+async def set_shadow(body: dict = Body(...), x_admin_token: Optional[str] = Header(None)):
+    """{"version": "improved", "fraction": 0.05}; fraction 0 o version null lo desactiva"""
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    version = body.get("version")
+    try:
+        fraction = float(body.get("fraction", 0.0))
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "fraction debe ser un número entre 0 y 1"}, status_code=422)
+    if version and version not in REGISTRY.stats()["versions"]:
+        return JSONResponse({"error": f"Versión desconocida: '{version}'"}, status_code=404)
+    SHADOW.configure(version, fraction)
+    return SHADOW.stats()
+
+@app.delete("/models/{name}")
+async def unload_model_version(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Descarga una versión que no es la por defecto, esperando a que terminen sus peticiones"""
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    try:
+        await asyncio.to_thread(REGISTRY.unload, name)
+    except KeyError:
+        return JSONResponse({"error": f"Versión desconocida: '{name}'"}, status_code=404)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    return {"unloaded": name}
+
+# ============================================
+# PERFILES BAJO DEMANDA (profiling.py)
+# ============================================
+
+def _profile_params(body, **defaults):
+    """Números del cuerpo JSON con sus valores por defecto; ValueError si no lo son"""
+    body = body or {}
+    return {key: type(default)(body.get(key, default)) for key, default in defaults.items()}
+
+@app.get("/profile")
+async def profile_status(x_admin_token: Optional[str] = Header(None)):
+    """Captura en curso, traza de TensorFlow y archivos de perfiles guardados"""
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    return {**PROFILER.status(), "files": PROFILER.files()}
+
+@app.post("/profile/cpu")
+async def profile_cpu(body: Optional[dict] = Body(None), x_admin_token: Optional[str] = Header(None)):
+    """
+    {"seconds": 10, "interval_ms": 10}: perfil de CPU por muestreo de todos los hilos.
+    Responde al terminar con las funciones más frecuentes; el archivo .folded abre en speedscope.
+    """
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    try:
+        params = _profile_params(body, seconds=10.0, interval_ms=config.PROFILE_INTERVAL_MS, top=20)
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "seconds, interval_ms y top deben ser números"}, status_code=422)
+    try:
+        return await asyncio.to_thread(PROFILER.cpu, **params)
+    except ProfilerBusy as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+
+@app.post("/profile/memory")
+async def profile_memory(body: Optional[dict] = Body(None), x_admin_token: Optional[str] = Header(None)):
+    """
+    {"seconds": 10, "frames": 1}: tracemalloc durante la ventana; responde con las líneas
+    que más memoria viva asignaron. El .tracemalloc se compara con tracemalloc.Snapshot.load.
+    """
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    try:
+        params = _profile_params(body, seconds=10.0, frames=1, top=20)
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "seconds, frames y top deben ser números"}, status_code=422)
+    try:
+        return await asyncio.to_thread(PROFILER.memory, **params)
+    except ProfilerBusy as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+
+@app.post("/profile/tf")
+async def profile_tf(body: Optional[dict] = Body(None), x_admin_token: Optional[str] = Header(None)):
+    """{"samples": 32}: traza de TensorFlow de las próximas N muestras del modelo (abrir con TensorBoard)"""
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    try:
+        params = _profile_params(body, samples=32, timeout_s=config.PROFILE_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "samples y timeout_s deben ser números"}, status_code=422)
+    if _use_ipc():
+        return JSONResponse({"error": "El modelo corre en el servidor de inferencia, no en este proceso"}, status_code=409)
+    try:
+        result = await asyncio.to_thread(PROFILER.tf_trace, **params)
+    except ImportError:
+        return JSONResponse({"error": "TensorFlow no está instalado"}, status_code=409)
+    except ProfilerBusy as e:
+        return JSONResponse({"error": str(e)}, status_code=409)
+    if config.ENGINE != "keras":
+        result["warning"] = f"Motor {config.ENGINE}: la traza solo tiene eventos de operaciones de TensorFlow"
+    return JSONResponse(result, status_code=202)
+
+@app.get("/profile/files/{name}")
+async def profile_file(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Descarga un perfil guardado (las trazas de TensorFlow son directorios: abrir con TensorBoard)"""
+    error = _admin_error(x_admin_token)
+    if error is not None:
+        return error
+    path = PROFILER.file_path(name)
+    if path is None:
+        return JSONResponse({"error": f"Perfil no encontrado: {name}"}, status_code=404)
+    return FileResponse(path, filename=name)
+
 @app.post("/api/auth/login")
 async def login(credentials: dict = Body(...)):
     """
@@ -58,25 +610,495 @@ async def login(credentials: dict = Body(...)):
         "message": "Usuario o contraseña incorrectos"
     }
 
+def _not_ready_response(version):
+    """
+    503 mientras el modelo base carga (y dispara la carga si aún no empezó). Las
+    otras versiones del registro solo se eligen ya listas: no dependen del base.
+    """
+    if not version.builtin or _model_ready():
+        return None
+    if _local_inference_allowed():
+        _start_model_loading()
+    return JSONResponse(
+        {"error": "El modelo aún no está listo", "model": _model_status()},
+        status_code=503,
+        headers={"Retry-After": str(config.RETRY_AFTER_S)},
+    )
+
+def _overloaded_response(e):
+    return JSONResponse(
+        {"error": str(e)},
+        status_code=503,
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+async def _get_image(contents, digest):
+    """Tensor preprocesado desde la caché o decodificando. Retorna (tensor, hit)"""
+    img_arr = IMAGE_CACHE.get(digest)
+    if img_arr is not None:
+        return img_arr, True
+    img_arr = await EXECUTOR.run(preprocess_image, contents)
+    IMAGE_CACHE.put(digest, img_arr)
+    return img_arr, False
+
+async def _get_embedding(contents, digest):
+    """Features de la rama de imagen desde la caché o calculándolas. Retorna (features, hit)"""
+    embedding = EMBEDDING_CACHE.get(digest)
+    if embedding is not None:
+        return embedding, True
+    img_arr = await EXECUTOR.run(preprocess_image, contents)
+    embedding = await asyncio.wrap_future(EMBED_BATCHER.submit(img_arr))
+    EMBEDDING_CACHE.put(digest, embedding)
+    return embedding, False
+
+def _split_path(version):
+    """El modelo dividido (features cacheadas por imagen) solo existe para la versión base local"""
+    return version.builtin and EMBED_BATCHER is not None and not _use_ipc()
+
+async def _model_call(version, sample):
+    """Una muestra por el micro-batcher de la versión, registrando su latencia"""
+    start = time.perf_counter()
+    result = await asyncio.wrap_future(version.submit(sample))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    version.observe(result["top3"], elapsed_ms)
+    STAGES.observe("model", elapsed_ms)
+    return result
+
+def _timed_digest(contents):
+    with STAGES.time("digest"):
+        return image_digest(contents)
+
+async def _read_upload(file):
+    """
+    Bytes del upload (el parser multipart ya lo dejó en memoria o en un archivo
+    temporal), leídos por bloques y validados por cabecera. Lanza UploadRejected.
+    """
+    with STAGES.time("temp_io"):
+        return await read_image(
+            file,
+            max_bytes=config.UPLOAD_MAX_BYTES,
+            max_pixels=config.UPLOAD_MAX_PIXELS,
+            formats=config.UPLOAD_FORMATS,
+            chunk_size=config.UPLOAD_CHUNK_KB * 1024,
+        )
+
+def _upload_error_response(e):
+    return JSONResponse({"error": str(e)}, status_code=e.status_code)
+
+def _json(content, **kwargs):
+    """JSONResponse serializa al construirse: se mide como etapa "serialize" """
+    with STAGES.time("serialize"):
+        return JSONResponse(content=content, **kwargs)
+
+async def _predict_contents(contents, age, sex, anatom_site_general, version):
+    """
+    Predicción de una imagen en memoria pasando por la caché.
+    Retorna ({"top3", "probs", "uncertain"}, estado_cache) con estado "prediction",
+    "embedding", "image" o "miss".
+    """
+    metadata = encode_request_metadata(age, sex, anatom_site_general)
+    return await _predict_encoded(contents, *metadata, version)
+
+async def _predict_encoded(contents, age_norm, sex_ohe, site_idx, version):
+    """Como _predict_contents pero con los metadatos ya codificados (caminos batch)"""
+    if not config.CACHE_ENABLED:
+        img_arr = await EXECUTOR.run(preprocess_image, contents)
+        sample = make_sample(img_arr, age_norm, sex_ohe, site_idx)
+        return await _model_call(version, sample), "miss"
+
+    digest = await EXECUTOR.run(_timed_digest, contents)
+    # La carga de la versión va en la clave: cada modelo tiene sus propias predicciones
+    # cacheadas, y recargar otro archivo con el mismo nombre no hereda las anteriores
+    key = prediction_key(digest, age_norm, sex_ohe, site_idx, version.cache_id)
+
+    preds = PREDICTION_CACHE.get(key)
+    if preds is not None:
+        return preds, "prediction"
+
+    if _split_path(version):
+        # Solo corre la cabeza si las features de esta imagen ya están cacheadas
+        start = time.perf_counter()
+        embedding, hit = await _get_embedding(contents, digest)
+        probs = await EXECUTOR.run(predict_from_embedding, embedding, [(age_norm, sex_ohe, site_idx)])
+        preds = format_predictions(probs)[0]
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        version.observe(preds["top3"], elapsed_ms)
+        STAGES.observe("model", elapsed_ms)
+        status = "embedding" if hit else "miss"
+    else:
+        img_arr, hit = await _get_image(contents, digest)
+        sample = make_sample(img_arr, age_norm, sex_ohe, site_idx)
+        preds = await _model_call(version, sample)
+        status = "image" if hit else "miss"
+
+    PREDICTION_CACHE.put(key, preds)
+    return preds, status
+
+async def _predict_all_sites(contents, age, sex, version):
+    """Top 3 para la misma imagen y paciente en cada zona anatómica conocida"""
+    sites = site_names()
+    metadata = encode_metadata_batch([age] * len(sites), [sex] * len(sites), sites)
+    # Sin caché se decodifica/calcula directo, sin leer ni escribir ninguna caché
+    digest = await EXECUTOR.run(_timed_digest, contents) if config.CACHE_ENABLED else None
+
+    if _split_path(version):
+        # Una sola pasada de la cabeza con N filas de metadatos
+        if config.CACHE_ENABLED:
+            embedding, _ = await _get_embedding(contents, digest)
+        else:
+            img_arr = await EXECUTOR.run(preprocess_image, contents)
+            embedding = await asyncio.wrap_future(EMBED_BATCHER.submit(img_arr))
+        probs = await EXECUTOR.run(predict_from_embedding, embedding, metadata)
+        results = format_predictions(probs)
+    else:
+        if config.CACHE_ENABLED:
+            img_arr, _ = await _get_image(contents, digest)
+        else:
+            img_arr = await EXECUTOR.run(preprocess_image, contents)
+        results = await asyncio.gather(*[_model_call(version, make_sample(img_arr, *m)) for m in metadata])
+
+    if config.CACHE_ENABLED:
+        for m, preds in zip(metadata, results):
+            PREDICTION_CACHE.put(prediction_key(digest, *m, version.cache_id), preds)
+    return dict(zip(sites, results))
+
+async def _shadow_predict(contents, age, sex, anatom_site_general):
+    """Predicción del modelo sombra (top3 y probs). Su digest/decode corre en el pool de la sombra"""
+    version = REGISTRY.acquire(SHADOW.version)
+    try:
+        metadata = encode_request_metadata(age, sex, anatom_site_general)
+        img_arr = None
+        if config.CACHE_ENABLED:
+            digest = await SHADOW.run_in_pool(image_digest, contents)
+            img_arr = IMAGE_CACHE.get(digest)
+        if img_arr is None:
+            img_arr = await SHADOW.run_in_pool(preprocess_image, contents)
+        return await asyncio.wrap_future(version.submit(make_sample(img_arr, *metadata)))
+    finally:
+        version.end()
+
+def _acquire_version(requested):
+    """
+    Versión del registro para esta petición. Retorna (versión, None), o (None, 404)
+    si no existe, o (None, 503) si es la versión base y el modelo aún no cargó.
+    """
+    try:
+        version = REGISTRY.acquire(requested)
+    except KeyError:
+        return None, JSONResponse(
+            {"error": f"Versión de modelo desconocida o no lista: '{requested}'", "models": REGISTRY.stats()["versions"]},
+            status_code=404,
+        )
+    not_ready = _not_ready_response(version)
+    if not_ready is not None:
+        version.end()
+        return None, not_ready
+    return version, None
+
 @app.post("/predict")
 async def predict(
     file: UploadFile = File(...),
     age: float = Form(...),
     sex: str = Form(...),
     anatom_site_general: str = Form(...),
+    model_version: Optional[str] = Form(None),
+):
+    observe_since_request_start("upload_read")
+    version, error = _acquire_version(model_version)
+    if error is not None:
+        return error
+    try:
+        async with EXECUTOR.slot(lane=LANE.get()):
+            contents = await _read_upload(file)
+            start = time.perf_counter()
+            # Todo en memoria: los bytes del upload van directo al decodificador
+            preds, cache_status = await _predict_contents(contents, age, sex, anatom_site_general, version)
+            primary_ms = (time.perf_counter() - start) * 1000
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except UploadRejected as e:
+        return _upload_error_response(e)
+    finally:
+        version.end()
+
+    # Después de tener la respuesta: la sombra no suma latencia a esta petición
+    SHADOW.maybe_start(
+        version.name, preds, primary_ms,
+        lambda: _shadow_predict(contents, age, sex, anatom_site_general),
+        primary_cached=cache_status == "prediction",
+    )
+
+    return _json(
+        preds,
+        headers={"X-Cache": cache_status, "X-Model-Version": version.name},
+    )
+
+def _check_batch_form(files, age, sex, anatom_site_general, max_files):
+    """Valida los campos repetidos de un batch. Retorna una respuesta de error o None"""
+    n = len(files)
+    if n > max_files:
+        return JSONResponse(
+            {"error": f"Máximo {max_files} imágenes por petición, se recibieron {n}"},
+            status_code=413,
+        )
+    if not (len(age) == len(sex) == len(anatom_site_general) == n):
+        return JSONResponse(
+            {"error": "age, sex y anatom_site_general deben repetirse una vez por imagen"},
+            status_code=422,
+        )
+    return None
+
+@app.post("/predict/batch")
+async def predict_batch_endpoint(
+    files: List[UploadFile] = File(...),
+    age: List[float] = Form(...),
+    sex: List[str] = Form(...),
+    anatom_site_general: List[str] = Form(...),
+    model_version: Optional[str] = Form(None),
 ):
-    suffix = os.path.splitext(file.filename)[-1] or ".jpg"
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-        tmp.write(await file.read())
-        tmp_path = tmp.name
+    """
+    Varias imágenes en una sola petición multipart. Cada imagen lleva su propia
+    edad/sexo/zona (campos repetidos en el mismo orden que `files`). Las imágenes
+    se decodifican en paralelo y el micro-batcher las agrupa en pasadas del modelo.
+    Solo hay en proceso tantas como lugares concedió el executor (el límite del
+    carril): cada upload se lee recién cuando le toca. Una imagen inválida solo
+    marca error en su propia entrada.
+    """
+    observe_since_request_start("upload_read")
+    n = len(files)
+    error = _check_batch_form(files, age, sex, anatom_site_general, config.BATCH_MAX_FILES)
+    if error is not None:
+        return error
+
+    version, error = _acquire_version(model_version)
+    if error is not None:
+        return error
+
+    metadata = encode_metadata_batch(age, sex, anatom_site_general)
+
+    async def one(i, window):
+        async with window:
+            contents = await _read_upload(files[i])
+            await files[i].close()
+            preds, cache_status = await _predict_encoded(contents, *metadata[i], version)
+        return {"index": i, "filename": files[i].filename, **preds, "cache": cache_status}
+
+    try:
+        async with EXECUTOR.slot(n, lane=LANE.get()) as weight:
+            window = asyncio.Semaphore(weight)
+            outcomes = await asyncio.gather(*[one(i, window) for i in range(n)], return_exceptions=True)
+    except Overloaded as e:
+        return _overloaded_response(e)
+    finally:
+        version.end()
+
+    results = []
+    for i, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            results.append({"index": i, "filename": files[i].filename, "error": f"{type(outcome).__name__}: {outcome}"})
+        else:
+            results.append(outcome)
+    return _json({"results": results}, headers={"X-Model-Version": version.name})
+
+# /predict/batch/stream: metadatos de cada imagen (se emparejan en orden con los archivos)
+STREAM_FIELDS = ("age", "sex", "anatom_site_general")
+STREAM_FIELD_MAX_BYTES = 256
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que solo envía. Con ASGI < 2.4 (uvicorn con h11) la original
+    escucha receive() para detectar la desconexión y se comería el cuerpo que el
+    generador todavía está leyendo; aquí la desconexión llega como ClientDisconnect
+    al leer request.stream().
+    """
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.stream_response(send)
+        except OSError:
+            raise ClientDisconnect()
+
+
+def _is_image(part):
+    return part.filename is not None and part.name == "files"
+
+
+def _stream_field(fields, part):
+    """Guarda un campo de texto del stream. Retorna UploadRejected o None"""
+    values = fields.get(part.name)
+    if values is None:
+        return None
+    if part.error is not None:
+        return part.error
+    if len(values) >= config.STREAM_MAX_FILES:
+        return UploadRejected(413, f"Máximo {config.STREAM_MAX_FILES} valores de '{part.name}' por petición")
+    values.append(part.data.decode("utf-8", "replace"))
+    return None
+
+
+def _next_metadata(fields):
+    """Siguiente (age, sex, anatom_site_general); None en los que no llegaron antes del archivo"""
+    return tuple(fields[name].popleft() if fields[name] else None for name in STREAM_FIELDS)
 
+
+async def _next_part(parts):
+    """(siguiente parte o None al terminar, UploadRejected o None)"""
+    try:
+        return await anext(parts, None), None
+    except UploadRejected as e:
+        return None, e
+    except ValueError as e:
+        return None, UploadRejected(400, f"Multipart inválido: {e}")
+
+
+@app.post("/predict/batch/stream")
+async def predict_batch_stream(request: Request, model_version: Optional[str] = None):
+    """
+    Igual que /predict/batch pero responde NDJSON: una línea por imagen en cuanto
+    termina su batch (orden de llegada, con `index`), y una línea final de resumen.
+
+    El multipart se parsea a medida que llega (uploads.iter_parts, sin
+    request.form()): no hay límite de campos del parser, nada va a disco temporal
+    y solo se sigue leyendo el cuerpo cuando hay lugar en la ventana de
+    SKIN_STREAM_WINDOW imágenes. La memoria queda acotada por la ventana por
+    SKIN_UPLOAD_MAX_BYTES más los metadatos aún sin emparejar.
+
+    Cada archivo `files` toma el siguiente valor de age, sex y anatom_site_general,
+    que deben llegar antes que él (todos al principio o intercalados).
+    model_version va en la query o como campo antes del primer archivo.
+    """
+    boundary = multipart_boundary(request.headers.get("content-type", "").encode("latin-1"))
+    if boundary is None:
+        return JSONResponse({"error": "Se esperaba multipart/form-data"}, status_code=415)
+
+    parts = iter_parts(request.stream(), boundary, config.UPLOAD_MAX_BYTES, STREAM_FIELD_MAX_BYTES)
+    fields = {name: collections.deque() for name in STREAM_FIELDS + ("model_version",)}
+
+    # Campos hasta el primer archivo: la versión se decide antes de empezar a responder
+    part, error = await _next_part(parts)
+    while error is None and part is not None and not _is_image(part):
+        error = _stream_field(fields, part)
+        if error is None:
+            part, error = await _next_part(parts)
+    if error is not None:
+        return _upload_error_response(error)
+    if part is None:
+        return JSONResponse({"error": "Se requiere al menos un archivo en 'files'"}, status_code=422)
+    observe_since_request_start("upload_read")
+
+    version, error = _acquire_version(model_version or (fields["model_version"] or [None])[0])
+    if error is not None:
+        return error
+
+    window = max(1, config.STREAM_WINDOW)
+    lane = LANE.get()
+    try:
+        weight = EXECUTOR.acquire(window) if lane is None else await EXECUTOR.reserve(window, lane)
+    except Overloaded as e:
+        version.end()
+        return _overloaded_response(e)
+    except BaseException:
+        version.end()
+        raise
+
+    async def one(i, part, metadata):
+        start = time.perf_counter()
+        try:
+            if part.error is not None:
+                raise part.error
+            if None in metadata:
+                raise ValueError("age, sex y anatom_site_general de cada imagen deben llegar antes de su archivo")
+            encoded = encode_request_metadata(float(metadata[0]), metadata[1], metadata[2])
+            contents = check_image(part.data, config.UPLOAD_MAX_PIXELS, config.UPLOAD_FORMATS)
+            preds, cache_status = await _predict_encoded(contents, *encoded, version)
+            result = {"index": i, "filename": part.filename, **preds, "cache": cache_status}
+        except Exception as e:
+            result = {"index": i, "filename": part.filename, "error": f"{type(e).__name__}: {e}"}
+        result["latency_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return result
+
+    async def stream(part):
+        pending = set()
+        count = 0
+        errors = 0
+        summary = {}
+        start = time.perf_counter()
+        try:
+            while part is not None or pending:
+                # El cuerpo solo se sigue leyendo mientras haya lugar en la ventana
+                while part is not None and len(pending) < window:
+                    if _is_image(part):
+                        if count >= config.STREAM_MAX_FILES:
+                            summary["error"] = f"Máximo {config.STREAM_MAX_FILES} imágenes por petición, el resto no se procesó"
+                            part = None
+                            break
+                        pending.add(asyncio.ensure_future(one(count, part, _next_metadata(fields))))
+                        count += 1
+                    else:
+                        error = _stream_field(fields, part)
+                        if error is not None:
+                            summary["error"] = str(error)
+                            part = None
+                            break
+                    part, error = await _next_part(parts)
+                    if error is not None:
+                        summary["error"] = str(error)
+                if not pending:
+                    continue
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    errors += "error" in result
+                    yield json.dumps(result) + "\n"
+            yield json.dumps({
+                "done": True,
+                "count": count,
+                "errors": errors,
+                "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+                **summary,
+            }) + "\n"
+        finally:
+            # Cliente desconectado o fin normal: no dejar trabajo huérfano
+            for task in pending:
+                task.cancel()
+            EXECUTOR.release(weight, lane)
+            version.end()
+
+    return RequestStreamingResponse(
+        stream(part), media_type="application/x-ndjson", headers={"X-Model-Version": version.name}
+    )
+
+@app.post("/predict/sites")
+async def predict_sites(
+    file: UploadFile = File(...),
+    age: float = Form(...),
+    sex: str = Form(...),
+    model_version: Optional[str] = Form(None),
+):
+    """
+    Flujo "¿y si?" del frontend: la misma imagen evaluada en todas las zonas
+    anatómicas de site2idx en una sola petición.
+    """
+    observe_since_request_start("upload_read")
+    version, error = _acquire_version(model_version)
+    if error is not None:
+        return error
     try:
-        preds = predict_top3(tmp_path, age, sex, anatom_site_general)
+        async with EXECUTOR.slot(lane=LANE.get()):
+            contents = await _read_upload(file)
+            sites = await _predict_all_sites(contents, age, sex, version)
+    except Overloaded as e:
+        return _overloaded_response(e)
+    except UploadRejected as e:
+        return _upload_error_response(e)
     finally:
-        if os.path.exists(tmp_path):
-            os.remove(tmp_path)
+        version.end()
 
-    return JSONResponse(content={"top3": preds})
+    return _json(
+        {"sites": sites},
+        headers={"X-Model-Version": version.name},
+    )
 
 # ============================================
 # SERVIR FRONTEND
@@ -0,0 +1,245 @@
+"""
+Métricas en memoria para el servidor de inferencia.
+Baratas de actualizar (un lock + sumas), pensadas para dejarse activas siempre.
+
+STAGES acumula la latencia de cada etapa de /predict (lectura del upload, decode,
+resize, modelo, serialización...) y PrometheusWriter las expone en /metrics en el
+formato de texto de Prometheus.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+
+# Buckets por defecto en milisegundos
+DEFAULT_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 2500, 5000)
+# Etapas internas: algunas duran microsegundos (metadatos, preprocess_input)
+STAGE_MS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 250, 500, 1000, 2500)
+
+
+class Histogram:
+    """Histograma acumulativo de buckets fijos (estilo Prometheus)"""
+
+    def __init__(self, buckets=DEFAULT_MS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # último = +Inf
+        self._sum = 0.0
+        self._count = 0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+            self._count += 1
+            if value > self._max:
+                self._max = value
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count, vmax = self._sum, self._count, self._max
+        cumulative = {}
+        running = 0
+        for le, c in zip(list(self.buckets) + ["+Inf"], counts):
+            running += c
+            cumulative[str(le)] = running
+        return {
+            "count": count,
+            "sum": total,
+            "avg": (total / count) if count else 0.0,
+            "max": vmax,
+            "buckets": cumulative,
+        }
+
+
+class Counts:
+    """Conteo por valor discreto (ej. tamaño de batch -> número de batches)"""
+
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def inc(self, key, amount=1):
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(sorted(self._counts.items()))
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe((time.perf_counter() - self.start) * 1000.0)
+        return False
+
+
+class LabeledHistogram:
+    """Un Histogram por etiqueta (ej. etapa o ruta), creados a medida que aparecen"""
+
+    def __init__(self, buckets=DEFAULT_MS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, key):
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, Histogram(self.buckets))
+        return child
+
+    def observe(self, key, value):
+        self.labels(key).observe(value)
+
+    def time(self, key):
+        """with STAGES.time("decode"): ... registra la duración en ms"""
+        return _Timer(self.labels(key))
+
+    def snapshot(self):
+        with self._lock:
+            children = dict(self._children)
+        return {key: child.snapshot() for key, child in sorted(children.items())}
+
+
+# Latencia por etapa de una predicción (ms)
+STAGES = LabeledHistogram(STAGE_MS_BUCKETS)
+
+# Inicio de la petición HTTP actual (lo fija RequestMetrics), para medir cuánto
+# tardó en llegar y parsearse el upload antes de entrar al endpoint
+REQUEST_START = contextvars.ContextVar("request_start", default=None)
+
+
+def observe_since_request_start(stage):
+    start = REQUEST_START.get()
+    if start is not None:
+        STAGES.observe(stage, (time.perf_counter() - start) * 1000.0)
+
+
+class HTTPStats:
+    """Peticiones por (método, ruta, estado), errores 5xx por ruta, duración y peticiones en curso"""
+
+    def __init__(self):
+        self.requests = Counts()
+        self.errors = Counts()
+        self.duration_ms = LabeledHistogram()
+        self.in_flight = 0
+
+
+HTTP = HTTPStats()
+
+
+class RequestMetrics:
+    """
+    Middleware ASGI que alimenta HTTP. La ruta es la plantilla ("/predict",
+    "/models/{name}") para que el número de series no crezca con las URLs.
+    """
+
+    def __init__(self, app, stats=HTTP):
+        self.app = app
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        token = REQUEST_START.set(start)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        self.stats.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.stats.in_flight -= 1
+            REQUEST_START.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "other"
+            self.stats.requests.inc((scope["method"], route, status[0]))
+            if status[0] >= 500:
+                self.stats.errors.inc(route)
+            self.stats.duration_ms.observe(route, (time.perf_counter() - start) * 1000.0)
+
+
+# ============================================================================
+# FORMATO DE TEXTO DE PROMETHEUS
+# ============================================================================
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+class PrometheusWriter:
+    """Arma la respuesta de /metrics. Los histogramas en ms se exportan en segundos"""
+
+    def __init__(self, prefix="skin_"):
+        self.prefix = prefix
+        self._lines = []
+
+    def _header(self, name, help_text, kind):
+        self._lines.append(f"# HELP {self.prefix}{name} {help_text}")
+        self._lines.append(f"# TYPE {self.prefix}{name} {kind}")
+
+    def counter(self, name, help_text, samples):
+        """samples: lista de (etiquetas, valor) o un número sin etiquetas"""
+        self._simple(name, help_text, "counter", samples)
+
+    def gauge(self, name, help_text, samples):
+        self._simple(name, help_text, "gauge", samples)
+
+    def _simple(self, name, help_text, kind, samples):
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        self._header(name, help_text, kind)
+        for labels, value in samples:
+            self._lines.append(f"{self.prefix}{name}{_labels(labels)} {_number(value)}")
+
+    def histogram(self, name, help_text, samples, scale=0.001):
+        """samples: lista de (etiquetas, Histogram.snapshot()); scale pasa ms -> s"""
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+        self._header(name, help_text, "histogram")
+        full = self.prefix + name
+        for labels, snap in samples:
+            for le, count in snap["buckets"].items():
+                bound = "+Inf" if le == "+Inf" else repr(round(float(le) * scale, 9))
+                self._lines.append(f"{full}_bucket{_labels({**labels, 'le': bound})} {count}")
+            self._lines.append(f"{full}_sum{_labels(labels)} {_number(snap['sum'] * scale)}")
+            self._lines.append(f"{full}_count{_labels(labels)} {snap['count']}")
+
+    def text(self):
+        return "\n".join(self._lines) + "\n"
@@ -0,0 +1,123 @@
+"""
+Post-procesamiento vectorizado de las probabilidades del modelo.
+
+Las tablas de clases se arman UNA vez desde los artifacts. Para un batch (N, C):
+- Top-k sobre todo el batch en una sola llamada. Con pocas clases (el modelo tiene
+  4) un argsort estable de (N, C) es lo más barato; con muchas clases se usa
+  np.argpartition (sin ordenar las C clases) y solo se ordenan las k candidatas.
+- Mismo orden que np.argsort(preds)[::-1] de fastapi_skin_demo. Con empates
+  exactos (raros con softmax) el orden de argsort depende de la implementación
+  de sort de NumPy; aquí es determinista: a igual probabilidad, primero el índice menor.
+- Flag `uncertain` de fastapi_skin_demo calculado para todas las filas a la vez:
+  top1 < 0.60 o top1 - top2 < 0.10.
+- El vector completo de probabilidades por clase (`probs`), como `all_probs` de la demo.
+
+Las conversiones a float de Python se hacen con un solo .tolist() por batch.
+"""
+import numpy as np
+
+# Umbrales de fastapi_skin_demo/app/main.py
+UNCERTAIN_TOP1_PROB = 0.60
+UNCERTAIN_MARGIN = 0.10
+
+DEFAULT_CLASS2IDX = {"MEL": 0, "NV": 1, "BCC": 2, "BKL": 3}
+
+# Hasta este número de clases se ordena la fila completa en vez de argpartition:
+# con C chico el costo fijo de argpartition + lexsort domina
+FULL_SORT_MAX_CLASSES = 64
+
+
+def _gather(values, indices):
+    """values[i, indices[i, j]] para cada fila (indexado avanzado: menos costo fijo que take_along_axis)"""
+    return values[np.arange(len(values))[:, None], indices]
+
+
+def _ordered(indices, probs):
+    """Ordena las candidatas de cada fila: probabilidad descendente, empate -> índice menor"""
+    order = np.lexsort((indices, -_gather(probs, indices)), axis=1)
+    return _gather(indices, order)
+
+
+class Postprocessor:
+
+    def __init__(self, class2idx=None, k=3, uncertain_prob=UNCERTAIN_TOP1_PROB, uncertain_margin=UNCERTAIN_MARGIN):
+        class2idx = class2idx or DEFAULT_CLASS2IDX
+        size = max(int(v) for v in class2idx.values()) + 1
+        idx2class = {int(v): c for c, v in class2idx.items()}
+        # Índices sin nombre en los artifacts se muestran como el número (igual que format_top3)
+        self.labels = tuple(idx2class.get(i, str(i)) for i in range(size))
+        self.k = int(k)
+        self.uncertain_prob = float(uncertain_prob)
+        self.uncertain_margin = float(uncertain_margin)
+
+    def _labels(self, num_classes):
+        if num_classes <= len(self.labels):
+            return self.labels
+        return self.labels + tuple(str(i) for i in range(len(self.labels), num_classes))
+
+    def top_k(self, probs, k=None):
+        """Índices (N, k) de las k clases más probables de cada fila, ordenados"""
+        probs = np.asarray(probs)
+        c = probs.shape[1]
+        k = min(k or self.k, c)
+        if c <= FULL_SORT_MAX_CLASSES or k == c:
+            # Estable sobre -probs: a igual probabilidad queda primero el índice menor
+            return np.argsort(-probs, axis=1, kind="stable")[:, :k]
+
+        # Las k primeras columnas quedan con las k mayores (sin orden) y la columna k
+        # con la (k+1)-ésima
+        part = np.argpartition(-probs, k, axis=1)
+        candidates = part[:, :k]
+        kth = _gather(probs, part[:, k:k + 1])
+        # Empate en el borde: argpartition elige cualquiera de las clases empatadas;
+        # esas filas (raras) se ordenan completas para que el resultado sea determinista
+        ties = (_gather(probs, candidates) == kth).any(axis=1)
+        if ties.any():
+            candidates = candidates.copy()
+            candidates[ties] = np.argsort(-probs[ties], axis=1, kind="stable")[:, :k]
+        return _ordered(candidates, probs)
+
+    def _uncertain(self, top_probs):
+        """Flag desde las probabilidades ya ordenadas (N, >=1) de cada fila"""
+        top1 = top_probs[:, 0]
+        if top_probs.shape[1] < 2:
+            return top1 < self.uncertain_prob
+        return (top1 < self.uncertain_prob) | ((top1 - top_probs[:, 1]) < self.uncertain_margin)
+
+    def uncertain(self, probs):
+        """Flag de incertidumbre para cada fila (array bool (N,))"""
+        probs = np.asarray(probs)
+        return self._uncertain(_gather(probs, self.top_k(probs, 2)))
+
+    def top3_rows(self, probs):
+        """Top k de cada fila en el formato de la API: [{"class", "prob"}, ...]"""
+        probs = np.asarray(probs)
+        labels = self._labels(probs.shape[1])
+        top = self.top_k(probs)
+        top_probs = _gather(probs, top).tolist()
+        return [
+            [{"class": labels[i], "prob": p} for i, p in zip(idx_row, prob_row)]
+            for idx_row, prob_row in zip(top.tolist(), top_probs)
+        ]
+
+    def rows(self, probs):
+        """
+        Resultado completo por fila: {"top3": [...], "probs": {clase: prob}, "uncertain": bool}.
+        probs: array (N, C) de un batch.
+        """
+        probs = np.asarray(probs)
+        labels = self._labels(probs.shape[1])
+        top = self.top_k(probs, max(self.k, 2))
+        # Un solo gather: sirve para el flag y para el top-k de la respuesta
+        top_probs = _gather(probs, top)
+        uncertain = self._uncertain(top_probs).tolist()
+        top, top_probs = top[:, :self.k].tolist(), top_probs[:, :self.k].tolist()
+        all_probs = probs.tolist()
+        return [
+            {
+                "top3": [{"class": labels[i], "prob": p} for i, p in zip(idx_row, prob_row)],
+                "probs": dict(zip(labels, row)),
+                "uncertain": flag,
+            }
+            for idx_row, prob_row, row, flag in zip(top, top_probs, all_probs, uncertain)
+        ]
@@ -0,0 +1,222 @@
+"""
+Preprocesamiento de imagen y metadatos, sin dependencias de TensorFlow.
+Se puede importar desde scripts y herramientas sin cargar el modelo.
+"""
+import io
+
+import numpy as np
+from PIL import Image
+
+
+# ============================================================================
+# FUNCIONES COPIADAS EXACTAMENTE DE fastapi_skin_demo/app/utils/preprocessing.py
+# LÍNEA POR LÍNEA, SIN CAMBIOS
+# ============================================================================
+
+def preprocess_image_bytes(contents, img_size=(224,224)):
+    """COPIA EXACTA - NO MODIFICAR"""
+    img = Image.open(io.BytesIO(contents)).convert("RGB")
+    img = img.resize((img_size[0], img_size[1]), Image.BILINEAR)
+    arr = np.array(img).astype("float32")
+    return efficientnet_preprocess_input(arr)
+
+
+def efficientnet_preprocess_input(x):
+    """
+    Equivalente a tf.keras.applications.efficientnet.preprocess_input, que es un
+    passthrough: EfficientNet normaliza dentro del propio grafo. Se replica aquí
+    para no importar TensorFlow solo por esta función (motores tflite/onnx).
+    """
+    return x
+
+
+def encode_metadata(age_input, sex_input, site_input, artifacts):
+    """COPIA EXACTA - NO MODIFICAR"""
+    sex2idx = artifacts.get("sex2idx", {"male":0,"female":1,"unknown":2})
+    site2idx = artifacts.get("site2idx", {"other":0})
+    age_mean = float(artifacts.get("age_mean",60))
+    age_std = float(artifacts.get("age_std",16))
+
+    try:
+        age = float(age_input)
+    except:
+        age = age_mean
+    age_norm = (age - age_mean) / (age_std if age_std!=0 else 1)
+
+    s = str(sex_input).lower()
+    if s in ["f","female","mujer"]:
+        s="female"
+    elif s in ["m","male","hombre"]:
+        s="male"
+    sex_idx = sex2idx.get(s, sex2idx.get("unknown",0))
+    sex_ohe = [0.0]*len(sex2idx)
+    sex_ohe[int(sex_idx)] = 1.0
+
+    site_str = str(site_input)
+    site_idx = site2idx.get(site_str, site2idx.get("other",0))
+
+    return age_norm, sex_ohe, int(site_idx)
+
+
+# ============================================================================
+# MISMO PREPROCESAMIENTO EN DOS ETAPAS (decode / resize) para herramientas que
+# miden el tiempo de cada una. Resultado idéntico a preprocess_image_bytes.
+# ============================================================================
+
+def decode_image(contents):
+    """Bytes -> imagen PIL RGB decodificada"""
+    img = Image.open(io.BytesIO(contents)).convert("RGB")
+    return img
+
+
+def image_to_array(img, img_size=(224,224)):
+    """Imagen PIL RGB -> tensor float32 (H, W, 3) listo para el modelo"""
+    img = img.resize((img_size[0], img_size[1]), Image.BILINEAR)
+    arr = np.array(img).astype("float32")
+    return efficientnet_preprocess_input(arr)
+
+
+def preprocess_image_bytes_staged(contents, img_size=(224,224), timer=None, fast=False, draft_factor=2,
+                                  min_pixels=None):
+    """
+    Mismo resultado que preprocess_image_bytes (o preprocess_image_bytes_fast con
+    fast=True) pero con cada etapa dentro de timer(etapa), un context manager que
+    mide su duración (ver metrics.STAGES).
+    """
+    with timer("decode"):
+        img = decode_image_fast(contents, img_size, draft_factor, min_pixels) if fast else decode_image(contents)
+    with timer("resize"):
+        img = img.resize((img_size[0], img_size[1]), Image.BILINEAR)
+    with timer("to_array"):
+        arr = np.array(img).astype("float32")
+    with timer("preprocess_input"):
+        return efficientnet_preprocess_input(arr)
+
+
+# ============================================================================
+# DECODE RÁPIDO (opcional, SKIN_FAST_DECODE=1)
+# Las fotos de celular (12+ MP) se decodifican casi enteras solo para reducirlas
+# a 224x224. Con JPEG, draft() le pide al decodificador una versión escalada
+# 1/2, 1/4 o 1/8 (escalado en el dominio DCT) que siga siendo al menos
+# `draft_factor` veces el tamaño final, y luego se hace el mismo resize BILINEAR.
+# El resultado NO es bit a bit idéntico: ver FAST_DECODE_TOLERANCE y
+# verificar_decodificacion.py. Otros formatos se decodifican normalmente.
+# Debajo de FAST_DECODE_MIN_PIXELS no se usa draft: en fotos chicas (VGA) el
+# decode completo ya es barato y draft no gana nada, así que se sigue el camino
+# exacto. La conversión a float32 es la misma que image_to_array.
+# ============================================================================
+
+# Diferencia máxima aceptada contra preprocess_image_bytes (escala 0-255 por píxel)
+FAST_DECODE_TOLERANCE = {"mean_abs": 1.0, "max_abs": 8.0}
+
+# Píxeles mínimos de la imagen original (ancho x alto) para decodificar con draft
+FAST_DECODE_MIN_PIXELS = 1_000_000
+
+
+def decode_image_fast(contents, img_size=(224,224), draft_factor=2, min_pixels=None):
+    """
+    Bytes -> imagen PIL RGB, decodificando JPEG a tamaño reducido cuando la imagen
+    tiene al menos min_pixels (el tamaño sale del encabezado, antes de decodificar)
+    """
+    if min_pixels is None:
+        min_pixels = FAST_DECODE_MIN_PIXELS
+    img = Image.open(io.BytesIO(contents))
+    if img.format == "JPEG" and img.width * img.height >= min_pixels:
+        img.draft("RGB", (img_size[0] * draft_factor, img_size[1] * draft_factor))
+    return img.convert("RGB")
+
+
+def preprocess_image_bytes_fast(contents, img_size=(224,224), draft_factor=2, min_pixels=None):
+    """
+    Equivalente aproximado a preprocess_image_bytes (ver FAST_DECODE_TOLERANCE);
+    idéntico para imágenes con menos de min_pixels
+    """
+    img = decode_image_fast(contents, img_size, draft_factor, min_pixels)
+    return image_to_array(img, img_size)
+
+
+# ============================================================================
+# CODIFICACIÓN VECTORIZADA DE METADATOS (batch / offline)
+# Mismo resultado que encode_metadata para cada fila, incluyendo alias
+# ("mujer"/"hombre"), valores desconocidos y edades no parseables (-> age_mean).
+# Las tablas se arman UNA vez desde los artifacts; cada columna se resuelve
+# sobre sus valores distintos y se expande con un solo índice de NumPy.
+# ============================================================================
+
+SEX_ALIASES = {"f": "female", "female": "female", "mujer": "female",
+               "m": "male", "male": "male", "hombre": "male"}
+
+
+def _parse_age(value, default):
+    try:
+        return float(value)
+    except:
+        return default
+
+
+def _map_column(values, fn, dtype):
+    """Aplica fn a cada valor distinto de la columna y expande el resultado"""
+    arr = np.asarray(values)
+    if arr.ndim == 0:
+        arr = arr.reshape(1)
+    if arr.dtype.kind in "US":
+        # Factorizar con un dict es más rápido que np.unique (que ordena) en texto
+        codes = {}
+        inverse = np.fromiter((codes.setdefault(v, len(codes)) for v in arr.tolist()), np.intp, len(arr))
+        mapped = np.array([fn(u) for u in codes], dtype=dtype)
+        return mapped[inverse]
+    # Numérico u objeto (None, mezclas): memo por (tipo, valor), así True y 1 no se mezclan
+    memo = {}
+    out = np.empty(len(arr), dtype=dtype)
+    for i, v in enumerate(arr.tolist()):
+        try:
+            key = (type(v), v)
+            if key not in memo:
+                memo[key] = fn(v)
+            out[i] = memo[key]
+        except TypeError:
+            # Valor no hashable
+            out[i] = fn(v)
+    return out
+
+
+class MetadataEncoder:
+    """encode_metadata para columnas completas, con tablas precalculadas"""
+
+    def __init__(self, artifacts):
+        self.sex2idx = artifacts.get("sex2idx", {"male":0,"female":1,"unknown":2})
+        self.site2idx = artifacts.get("site2idx", {"other":0})
+        self.age_mean = float(artifacts.get("age_mean",60))
+        self.age_std = float(artifacts.get("age_std",16))
+        self._age_div = self.age_std if self.age_std != 0 else 1
+        self._unknown_sex = self.sex2idx.get("unknown", 0)
+        self._other_site = self.site2idx.get("other", 0)
+        self._sex_eye = np.eye(len(self.sex2idx))
+
+    def _sex_index(self, value):
+        s = str(value).lower()
+        s = SEX_ALIASES.get(s, s)
+        return int(self.sex2idx.get(s, self._unknown_sex))
+
+    def _site_index(self, value):
+        return int(self.site2idx.get(str(value), self._other_site))
+
+    def encode_batch(self, ages, sexes, sites):
+        """
+        Columnas de edad, sexo y zona -> dict con age (N,), sex_ohe (N, k) y site_idx (N,),
+        listo para el diccionario de entradas del modelo.
+        """
+        ages_arr = np.asarray(ages)
+        if ages_arr.dtype.kind in "biuf":
+            age = ages_arr.astype(np.float64).reshape(-1)
+        else:
+            age = _map_column(ages_arr, lambda v: _parse_age(v, self.age_mean), np.float64)
+        age_norm = (age - self.age_mean) / self._age_div
+
+        sex_idx = _map_column(sexes, self._sex_index, np.int64)
+        site_idx = _map_column(sites, self._site_index, np.int64)
+        return {
+            "age": age_norm,
+            "sex_ohe": self._sex_eye[sex_idx],
+            "site_idx": site_idx,
+        }
@@ -0,0 +1,324 @@
+"""
+Perfiles bajo demanda del proceso en producción (CPU, memoria y traza de TensorFlow).
+
+- CPU: muestreo de las pilas de todos los hilos con sys._current_frames() cada
+  `interval_ms`, durante un tiempo acotado. Se guarda en formato "folded"
+  (una línea "hilo;archivo:función;... muestras"), que abren speedscope y
+  flamegraph.pl.
+- Memoria: tracemalloc durante una ventana; el snapshot tiene las asignaciones de
+  Python (incluidos los buffers de numpy) hechas en la ventana que siguen vivas.
+  Se guarda el snapshot binario (para comparar con Snapshot.load) y un resumen.
+- TensorFlow: tf.profiler sobre las próximas N muestras que pasan por el modelo
+  (solo motor keras; tflite/onnx no generan eventos de TF). Se abre con TensorBoard.
+
+Presupuesto de overhead mientras corre una captura:
+- CPU: cada muestra retiene el GIL mientras recorre las pilas. El intervalo se
+  alarga solo para que ese tiempo no pase de `overhead_budget` (2% por defecto)
+  del tiempo de pared; el valor medido se reporta en `overhead_pct`.
+- Memoria: tracemalloc encarece cada asignación de Python (del orden de 1.5-2x en
+  código que asigna mucho, la inferencia del modelo no cambia). No se puede
+  acotar por muestra, así que se acota la ventana (`max_seconds`) y se guarda un
+  solo frame por asignación salvo que se pidan más.
+- TensorFlow: solo afecta las pasadas trazadas; fuera de la captura cuesta leer
+  un booleano por batch.
+
+Solo una captura de CPU o memoria a la vez: se influirían entre sí.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+
+# Hojas de pila de un hilo esperando (cola vacía, socket, event loop sin trabajo).
+# Se cuentan aparte para que el resumen muestre dónde se gasta CPU
+IDLE_LEAVES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socket.py", "accept"),
+}
+
+
+class ProfilerBusy(Exception):
+    """Ya hay una captura del mismo tipo en curso"""
+
+
+def _frame_label(code):
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class SamplingProfiler:
+    """Muestreo de pilas de todos los hilos de Python (excepto el propio)"""
+
+    def __init__(self, interval_ms=10.0, overhead_budget=0.02, max_depth=64):
+        self.interval = max(0.001, interval_ms / 1000.0)
+        self.overhead_budget = max(0.001, overhead_budget)
+        self.max_depth = max_depth
+
+    def run(self, seconds):
+        """Bloquea `seconds`. Retorna {(hilo, pila): muestras} y estadísticas del muestreo"""
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        cost = 0.0
+        interval = self.interval
+        start = time.perf_counter()
+        deadline = start + seconds
+        while True:
+            t0 = time.perf_counter()
+            if t0 >= deadline:
+                break
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                stacks[(names.get(ident, str(ident)), tuple(reversed(stack)))] += 1
+            samples += 1
+            spent = time.perf_counter() - t0
+            cost += spent
+            # Respetar el presupuesto: dormir al menos spent * (1 - b) / b
+            interval = max(self.interval, spent * (1 - self.overhead_budget) / self.overhead_budget)
+            time.sleep(max(0.0, min(interval, deadline - time.perf_counter())))
+        elapsed = time.perf_counter() - start
+        return stacks, {
+            "seconds": round(elapsed, 3),
+            "samples": samples,
+            "interval_ms": round(self.interval * 1000, 3),
+            "effective_interval_ms": round(elapsed / samples * 1000, 3) if samples else None,
+            "overhead_pct": round(100 * cost / elapsed, 3) if elapsed else 0.0,
+            "overhead_budget_pct": 100 * self.overhead_budget,
+        }
+
+
+def folded(stacks):
+    """Formato folded: 'hilo;a.py:f;b.py:g 12' (raíz primero)"""
+    lines = []
+    for (thread, stack), count in stacks.most_common():
+        lines.append(";".join([thread.replace(";", "_")] + [_frame_label(c) for c in stack]) + f" {count}")
+    return "\n".join(lines) + "\n"
+
+
+def summarize(stacks, top=20):
+    """Funciones con más muestras propias (hoja) y acumuladas, sin los hilos en espera"""
+    own, cumulative = Counter(), Counter()
+    busy = idle = 0
+    for (_, stack), count in stacks.items():
+        if not stack:
+            continue
+        leaf = stack[-1]
+        if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE_LEAVES:
+            idle += count
+            continue
+        busy += count
+        own[_frame_label(leaf)] += count
+        for label in {_frame_label(c) for c in stack}:
+            cumulative[label] += count
+    return {
+        "busy_samples": busy,
+        "idle_samples": idle,
+        "top_self": [{"function": f, "samples": n, "pct": round(100 * n / busy, 1)} for f, n in own.most_common(top)],
+        "top_cumulative": [
+            {"function": f, "samples": n, "pct": round(100 * n / busy, 1)} for f, n in cumulative.most_common(top)
+        ],
+    }
+
+
+def memory_snapshot(seconds, frames=1):
+    """
+    Activa tracemalloc durante `seconds` (si no estaba activo) y toma un snapshot.
+    Retorna (snapshot, memoria trazada actual, pico) en bytes.
+    """
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start(max(1, int(frames)))
+    try:
+        time.sleep(seconds)
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if started:
+            tracemalloc.stop()
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    return snapshot, current, peak
+
+
+class InferenceTrace:
+    """
+    Traza de TensorFlow de las próximas N muestras del modelo. inference.py envuelve
+    cada pasada con forward(n); sin captura activa solo lee un booleano.
+    """
+
+    def __init__(self):
+        self.running = False
+        self.remaining = 0
+        self.logdir = None
+        self.traced = 0
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def start(self, logdir, samples, timeout_s):
+        import tensorflow as tf  # ImportError si no está instalado
+
+        with self._lock:
+            if self.running:
+                raise ProfilerBusy("Ya hay una traza de TensorFlow en curso")
+            tf.profiler.experimental.start(str(logdir))
+            self.logdir, self.traced, self.remaining = str(logdir), 0, max(1, int(samples))
+            self.running = True
+            # Si no llegan peticiones, la traza se cierra igual al vencer el plazo
+            self._timer = threading.Timer(timeout_s, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return
+            self.running = False
+            self._timer.cancel()
+            import tensorflow as tf
+            try:
+                tf.profiler.experimental.stop()
+            except Exception as e:
+                print(f"⚠️ No se pudo cerrar la traza de TensorFlow: {e}")
+                return
+        print(f"✅ Traza de TensorFlow ({self.traced} muestras) en {self.logdir}")
+
+    @contextmanager
+    def forward(self, n):
+        if not self.running:
+            yield
+            return
+        yield
+        with self._lock:
+            self.traced += n
+            self.remaining -= n
+            done = self.remaining <= 0
+        if done:
+            self.stop()
+
+    def status(self):
+        return {"active": self.running, "logdir": self.logdir, "traced_samples": self.traced,
+                "remaining_samples": max(0, self.remaining)}
+
+
+# Traza global: la usan las funciones de inferencia de inference.py
+TF_TRACE = InferenceTrace()
+
+
+class Profiler:
+    """Capturas guardadas como archivos en `directory` (perfiles de CPU, memoria y trazas)"""
+
+    def __init__(self, directory, max_seconds=60.0, interval_ms=10.0, overhead_budget=0.02):
+        self.directory = Path(directory)
+        self.max_seconds = float(max_seconds)
+        self.interval_ms = float(interval_ms)
+        self.overhead_budget = float(overhead_budget)
+        self._busy = threading.Lock()
+        self.current = None
+
+    def _path(self, kind, ext):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return self.directory / f"{kind}-{stamp}-{os.getpid()}{ext}"
+
+    def _seconds(self, seconds):
+        return min(max(0.1, float(seconds)), self.max_seconds)
+
+    @contextmanager
+    def _capture(self, kind):
+        if not self._busy.acquire(blocking=False):
+            raise ProfilerBusy(f"Ya hay una captura en curso ({self.current})")
+        self.current = kind
+        try:
+            yield
+        finally:
+            self.current = None
+            self._busy.release()
+
+    def cpu(self, seconds=10.0, interval_ms=None, top=20):
+        """Perfil de CPU por muestreo. Bloquea durante la captura"""
+        seconds = self._seconds(seconds)
+        with self._capture("cpu"):
+            sampler = SamplingProfiler(interval_ms or self.interval_ms, self.overhead_budget)
+            stacks, info = sampler.run(seconds)
+        path = self._path("cpu", ".folded")
+        path.write_text(folded(stacks), encoding="utf-8")
+        print(f"🔍 Perfil de CPU: {path.name} ({info['samples']} muestras, overhead {info['overhead_pct']}%)")
+        return {"file": path.name, **info, **summarize(stacks, top)}
+
+    def memory(self, seconds=10.0, frames=1, top=20):
+        """Snapshot de tracemalloc tras una ventana de `seconds`. Bloquea durante la captura"""
+        seconds = self._seconds(seconds)
+        frames = min(max(1, int(frames)), 25)
+        with self._capture("memory"):
+            snapshot, current, peak = memory_snapshot(seconds, frames)
+        path = self._path("memory", ".tracemalloc")
+        snapshot.dump(str(path))
+        stats = snapshot.statistics("traceback" if frames > 1 else "lineno")
+        report = self._path("memory", ".txt")
+        with open(report, "w", encoding="utf-8") as f:
+            f.write(f"# Asignaciones vivas hechas en {seconds:.1f} s; trazado {current / 2**20:.1f} MB, "
+                    f"pico {peak / 2**20:.1f} MB\n")
+            for stat in stats[:100]:
+                f.write(f"\n{stat.size / 1024:.1f} KiB en {stat.count} bloques\n")
+                f.write("\n".join(stat.traceback.format()) + "\n")
+        print(f"🔍 Snapshot de memoria: {path.name}")
+        return {
+            "file": path.name,
+            "report": report.name,
+            "seconds": seconds,
+            "traced_mb": round(current / 2**20, 3),
+            "peak_mb": round(peak / 2**20, 3),
+            "top": [
+                {"where": str(stat.traceback[0]), "kib": round(stat.size / 1024, 1), "blocks": stat.count}
+                for stat in stats[:top]
+            ],
+        }
+
+    def tf_trace(self, samples=32, timeout_s=None):
+        """Arma la traza de TensorFlow para las próximas `samples` muestras. No bloquea"""
+        logdir = self._path("tf", "")
+        TF_TRACE.start(logdir, samples, self._seconds(timeout_s or self.max_seconds))
+        print(f"🔍 Traza de TensorFlow armada para {samples} muestras en {logdir.name}")
+        return {"logdir": logdir.name, "samples": int(samples)}
+
+    def files(self):
+        if not self.directory.is_dir():
+            return []
+        return [
+            {"name": p.name, "bytes": p.stat().st_size if p.is_file() else None, "dir": p.is_dir()}
+            for p in sorted(self.directory.iterdir())
+        ]
+
+    def file_path(self, name):
+        """Ruta de un archivo de perfil; None si no existe o sale del directorio"""
+        directory = self.directory.resolve()
+        path = (directory / name).resolve()
+        if path.parent != directory or not path.is_file():
+            return None
+        return path
+
+    def status(self):
+        return {
+            "directory": str(self.directory),
+            "capturing": self.current,
+            "max_seconds": self.max_seconds,
+            "interval_ms": self.interval_ms,
+            "overhead_budget_pct": 100 * self.overhead_budget,
+            "tf_trace": TF_TRACE.status(),
+        }
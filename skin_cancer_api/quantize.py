@@ -0,0 +1,178 @@
+"""
+Cuantización post-entrenamiento del modelo multimodal (TFLite) con reporte
+de acuerdo vs velocidad contra el modelo Keras float32.
+
+Variantes:
+    float16 -> pesos en float16 (la mitad de tamaño, acuerdo casi total)
+    dynamic -> pesos int8, activaciones float (sin calibración)
+    int8    -> pesos y activaciones int8, calibradas con imágenes representativas
+
+Uso:
+    python quantize.py --calib-dir /datos/dermatoscopia --report quant_report.json
+    python quantize.py --variants float16 int8 --calib-dir ../Img
+
+Servir una variante:
+    SKIN_ENGINE=tflite SKIN_MODEL_VARIANT=int8 uvicorn main:app
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from bench_engines import rss_mb
+from engines import INPUT_NAMES, CompiledInference, TFLiteEngine, _conform
+from export_model import ARTIFACTS_PATH, BASE_DIR, MODEL_DIR, export_tflite, load_keras_model
+from preprocessing import encode_metadata, preprocess_image_bytes
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def load_image_set(directory, artifacts, limit=200, seed=0):
+    """
+    Carga hasta `limit` imágenes de `directory` con el preprocesamiento de la API
+    y les asigna metadatos válidos (edad/sexo/zona) reproducibles.
+    """
+    files = sorted(p for p in Path(directory).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)[:limit]
+    rng = np.random.default_rng(seed)
+    sexes = list(artifacts.get("sex2idx", {"unknown": 2}))
+    sites = list(artifacts.get("site2idx", {"other": 0}))
+    img_size = tuple(artifacts.get("img_size", [224, 224]))
+
+    samples = []
+    for path in files:
+        try:
+            image = preprocess_image_bytes(path.read_bytes(), img_size)
+        except Exception as e:
+            print(f"⚠️ Se omite {path.name}: {e}")
+            continue
+        age_norm, sex_ohe, site_idx = encode_metadata(
+            int(rng.integers(20, 90)), sexes[rng.integers(len(sexes))], sites[rng.integers(len(sites))], artifacts
+        )
+        samples.append({"image": image, "age": age_norm, "sex_ohe": sex_ohe, "site_idx": site_idx})
+
+    if not samples:
+        raise RuntimeError(f"❌ No hay imágenes utilizables en {directory}")
+    if len(samples) < 50:
+        print(f"⚠️ Solo {len(samples)} imágenes en {directory}: la calibración int8 y el reporte "
+              f"serán poco representativos, usa --calib-dir con imágenes dermatoscópicas reales")
+    return {
+        "image": np.stack([s["image"] for s in samples]),
+        "age": np.array([s["age"] for s in samples]),
+        "sex_ohe": np.array([s["sex_ohe"] for s in samples]),
+        "site_idx": np.array([s["site_idx"] for s in samples]),
+    }
+
+
+def representative_dataset(model, batch):
+    """Generador para el conversor TFLite: una muestra por paso, en el orden de la firma"""
+    specs = CompiledInference._input_specs(model)
+
+    def gen():
+        for i in range(len(batch["image"])):
+            yield [
+                _conform(np.asarray(batch[name])[i:i + 1], specs[name].shape, specs[name].dtype.as_numpy_dtype)
+                for name in INPUT_NAMES
+            ]
+
+    return gen
+
+
+def latency_ms(predict, batch, iters):
+    single = {k: np.asarray(v)[:1] for k, v in batch.items()}
+    predict(single)
+    times = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        predict(single)
+        times.append((time.perf_counter() - t0) * 1000)
+    return {"p50": float(np.percentile(times, 50)), "p95": float(np.percentile(times, 95))}
+
+
+def agreement(preds, reference):
+    ref_top1 = np.argmax(reference, 1)
+    top3 = np.argsort(preds, 1)[:, ::-1][:, :3]
+    ref_top3 = np.argsort(reference, 1)[:, ::-1][:, :3]
+    return {
+        "top1_agreement": float(np.mean(np.argmax(preds, 1) == ref_top1)),
+        "top1_in_top3": float(np.mean([r in t for r, t in zip(ref_top1, top3)])),
+        "top3_agreement": float(np.mean([set(a) == set(b) for a, b in zip(top3, ref_top3)])),
+        "max_abs_diff": float(np.max(np.abs(preds - reference))),
+        "mean_abs_diff": float(np.mean(np.abs(preds - reference))),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", help="Ruta al .keras (por defecto el primero disponible)")
+    parser.add_argument("--variants", nargs="+", default=["float16", "dynamic", "int8"],
+                        choices=["float16", "dynamic", "int8"])
+    parser.add_argument("--calib-dir", default=str(BASE_DIR / "Img"), help="Imágenes de calibración")
+    parser.add_argument("--eval-dir", help="Imágenes para el reporte (por defecto las de calibración)")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--iters", type=int, default=50, help="Repeticiones para medir latencia")
+    parser.add_argument("--out-dir", default=str(MODEL_DIR))
+    parser.add_argument("--report", default="quant_report.json")
+    args = parser.parse_args(argv)
+
+    with open(ARTIFACTS_PATH, "r", encoding="utf-8") as f:
+        artifacts = json.load(f)
+
+    model, model_path = load_keras_model(args.model)
+    calib = load_image_set(args.calib_dir, artifacts, args.limit)
+    evaluation = load_image_set(args.eval_dir, artifacts, args.limit, seed=1) if args.eval_dir else calib
+    reference = model.predict(evaluation, verbose=0)
+
+    report = {
+        "model": str(model_path),
+        "calibration_images": len(calib["image"]),
+        "eval_images": len(evaluation["image"]),
+        "variants": {
+            "float32": {
+                "engine": "keras",
+                "size_mb": model_path.stat().st_size / 1e6,
+                "latency_ms": latency_ms(lambda b: model.predict(b, verbose=0), evaluation, args.iters),
+                **agreement(reference, reference),
+            }
+        },
+    }
+
+    out_dir = Path(args.out_dir)
+    for variant in args.variants:
+        out_path = out_dir / f"{model_path.stem}.{variant}.tflite"
+        rep = representative_dataset(model, calib) if variant == "int8" else None
+        export_tflite(model, out_path, quantization=variant, representative_dataset=rep)
+
+        rss_before, _ = rss_mb()
+        engine = TFLiteEngine(out_path, num_threads=os.cpu_count())
+        preds = engine.predict(evaluation)
+        rss_after, _ = rss_mb()
+
+        report["variants"][variant] = {
+            "engine": "tflite",
+            "path": str(out_path),
+            "size_mb": out_path.stat().st_size / 1e6,
+            "rss_delta_mb": rss_after - rss_before,
+            "latency_ms": latency_ms(engine.predict, evaluation, args.iters),
+            **agreement(preds, reference),
+        }
+
+    print("\n" + "=" * 88)
+    print(f"{'variante':<9} {'MB':>7} {'p50 ms':>8} {'p95 ms':>8} {'top-1':>7} {'top1∈top3':>10} {'top-3':>7} {'max|Δ|':>9}")
+    print("=" * 88)
+    for name, r in report["variants"].items():
+        print(f"{name:<9} {r['size_mb']:>7.1f} {r['latency_ms']['p50']:>8.2f} {r['latency_ms']['p95']:>8.2f} "
+              f"{r['top1_agreement'] * 100:>6.1f}% {r['top1_in_top3'] * 100:>9.1f}% "
+              f"{r['top3_agreement'] * 100:>6.1f}% {r['max_abs_diff']:>9.2e}")
+
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Reporte guardado en {args.report}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
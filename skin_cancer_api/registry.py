@@ -0,0 +1,279 @@
+"""
+Registro de versiones del modelo: carga en segundo plano, cambio atómico y canary.
+
+La versión base es el modelo que carga inference.load_model() (con su camino
+rápido: modelo dividido, caché de features o proceso de inferencia aparte). Otras
+versiones se cargan en un hilo, se calientan y recién entonces quedan disponibles,
+cada una con su propio micro-batcher.
+
+Cada petición elige su versión una sola vez (explícita, por canary o la versión
+por defecto) y la mantiene hasta responder. Promover una versión solo cambia el
+puntero a la versión por defecto; las peticiones en curso terminan en la versión
+anterior, que sigue cargada hasta que se descarga (y se espera a que se vacíe).
+"""
+import itertools
+import random
+import threading
+import time
+
+from batching import MicroBatcher
+from metrics import Counts, Histogram
+
+# Cada carga tiene su propio número: dos cargas con el mismo nombre (descargar y
+# volver a cargar otro archivo como "cand") no comparten predicciones en caché
+_LOAD_IDS = itertools.count(1)
+
+
+class ModelVersion:
+    """Una versión servible: cómo encolar muestras y sus métricas"""
+
+    def __init__(self, name, submit_fn=None, path=None, engine_name=None, builtin=False):
+        self.name = name
+        # Identidad de esta carga para las claves de caché (ver _LOAD_IDS)
+        self.cache_id = f"{name}#{next(_LOAD_IDS)}"
+        self.submit_fn = submit_fn
+        self.path = path
+        self.engine_name = engine_name
+        self.builtin = builtin
+        self.engine = None
+        self.batcher = None
+        self.state = "ready" if builtin else "loading"  # loading | ready | failed
+        self.error = None
+        self.load_seconds = None
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+        # Métricas: latencia del modelo (sin caché) y distribución de la clase top-1
+        self.latency_ms = Histogram()
+        self.top1 = Counts()
+        self.top1_prob_sum = 0.0
+        self.predictions = 0
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def submit(self, sample):
+        return self.submit_fn(sample)
+
+    def begin(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def end(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def observe(self, top3, latency_ms):
+        """Registra una predicción hecha por el modelo (no las que salen de la caché)"""
+        self.latency_ms.observe(latency_ms)
+        self.top1.inc(top3[0]["class"])
+        with self._lock:
+            self.top1_prob_sum += top3[0]["prob"]
+            self.predictions += 1
+
+    def top1_distribution(self):
+        counts = self.top1.snapshot()
+        total = sum(counts.values())
+        return {k: v / total for k, v in counts.items()} if total else {}
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "error": self.error,
+            "builtin": self.builtin,
+            "engine": self.engine_name,
+            "path": str(self.path) if self.path else None,
+            "load_seconds": self.load_seconds,
+            "in_flight": self.in_flight,
+            "predictions": self.predictions,
+            "mean_top1_prob": self.top1_prob_sum / self.predictions if self.predictions else None,
+            "top1_distribution": self.top1_distribution(),
+            "latency_ms": self.latency_ms.snapshot(),
+        }
+
+
+def total_variation(p, q):
+    """Distancia de variación total entre dos distribuciones {clase: frecuencia} (0 = iguales, 1 = disjuntas)"""
+    keys = set(p) | set(q)
+    return 0.5 * sum(abs(p.get(k, 0.0) - q.get(k, 0.0)) for k in keys)
+
+
+class ModelRegistry:
+    """
+    load_fn(engine_name, path) -> motor con .predict(batch), ya listo para usar.
+    warmup_fn(engine) corre unas pasadas antes de exponer la versión.
+    predict_fn(engine, samples) arma el batch y llama al motor.
+    postprocess_fn / postprocess_batch_fn: como en MicroBatcher.
+    """
+
+    def __init__(self, load_fn, predict_fn, postprocess_fn=None, warmup_fn=None, max_batch_size=16, max_wait_ms=10.0,
+                 postprocess_batch_fn=None):
+        self.load_fn = load_fn
+        self.predict_fn = predict_fn
+        self.postprocess_fn = postprocess_fn
+        self.postprocess_batch_fn = postprocess_batch_fn
+        self.warmup_fn = warmup_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._versions = {}
+        self._default = None
+        self._canary = {}
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # Alta y baja de versiones
+    # ------------------------------------------------------------------
+
+    def register_builtin(self, name, submit_fn, path=None, engine_name=None):
+        """Versión base (el modelo de inference.py). Es la versión por defecto si no hay otra"""
+        version = ModelVersion(name, submit_fn, path=path, engine_name=engine_name, builtin=True)
+        with self._lock:
+            self._versions[name] = version
+            if self._default is None:
+                self._default = name
+        return version
+
+    def load(self, name, path, engine_name):
+        """Carga y calienta una versión en un hilo. Retorna la versión (estado loading)"""
+        with self._lock:
+            current = self._versions.get(name)
+            if current is not None and current.state != "failed":
+                raise ValueError(f"La versión '{name}' ya existe ({current.state})")
+            version = ModelVersion(name, path=path, engine_name=engine_name)
+            self._versions[name] = version
+        threading.Thread(target=self._load, args=(version,), name=f"load-{name}", daemon=True).start()
+        return version
+
+    def _load(self, version):
+        start = time.perf_counter()
+        try:
+            engine = self.load_fn(version.engine_name, version.path)
+            if self.warmup_fn is not None:
+                self.warmup_fn(engine)
+            batcher = MicroBatcher(
+                lambda samples: self.predict_fn(engine, samples),
+                self.postprocess_fn,
+                max_batch_size=self.max_batch_size,
+                max_wait_ms=self.max_wait_ms,
+                postprocess_batch_fn=self.postprocess_batch_fn,
+            ).start()
+        except Exception as e:
+            version.state, version.error = "failed", str(e)
+            version.load_seconds = time.perf_counter() - start
+            print(f"❌ No se pudo cargar la versión {version.name}: {e}")
+            return
+        version.engine, version.batcher = engine, batcher
+        version.submit_fn = batcher.submit
+        version.load_seconds = time.perf_counter() - start
+        # El estado se publica al final: recién aquí la versión recibe tráfico
+        version.state = "ready"
+        print(f"✅ Versión {version.name} lista en {version.load_seconds:.1f} s")
+
+    def unload(self, name, drain_timeout_s=30.0):
+        """Quita una versión (no la por defecto) y espera a que terminen sus peticiones en curso"""
+        with self._lock:
+            version = self._versions.get(name)
+            if version is None:
+                raise KeyError(name)
+            if name == self._default:
+                raise ValueError(f"'{name}' es la versión por defecto; promover otra antes de descargarla")
+            if version.builtin:
+                raise ValueError("La versión base no se puede descargar")
+            del self._versions[name]
+            self._canary.pop(name, None)
+        deadline = time.monotonic() + drain_timeout_s
+        while version.in_flight > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        if version.batcher is not None:
+            version.batcher.stop()
+        version.engine = None
+
+    # ------------------------------------------------------------------
+    # Enrutamiento
+    # ------------------------------------------------------------------
+
+    def promote(self, name):
+        """Cambia la versión por defecto de forma atómica"""
+        with self._lock:
+            version = self._versions.get(name)
+            if version is None:
+                raise KeyError(name)
+            if not version.ready:
+                raise ValueError(f"La versión '{name}' no está lista ({version.state})")
+            previous, self._default = self._default, name
+            self._canary.pop(name, None)
+        print(f"🔀 Versión por defecto: {previous} -> {name}")
+        return previous
+
+    def set_canary(self, weights):
+        """weights: {versión: fracción del tráfico}; el resto va a la versión por defecto"""
+        weights = {k: float(v) for k, v in weights.items() if float(v) > 0}
+        with self._lock:
+            unknown = [k for k in weights if k not in self._versions]
+            if unknown:
+                raise KeyError(", ".join(unknown))
+            if sum(weights.values()) > 1.0:
+                raise ValueError("La suma de pesos del canary no puede superar 1")
+            self._canary = weights
+
+    def acquire(self, requested=None):
+        """
+        Versión para una petición: la pedida explícitamente, o sorteo del canary
+        entre versiones listas, o la por defecto. KeyError si la pedida no existe.
+        Cuenta la petición como en curso: el llamador debe llamar version.end().
+        """
+        with self._lock:
+            version = self._pick(requested)
+            version.begin()
+            return version
+
+    def _pick(self, requested):
+        if requested:
+            version = self._versions.get(requested)
+            if version is None or not version.ready:
+                raise KeyError(requested)
+            return version
+        if self._canary:
+            r = random.random()
+            for name, weight in self._canary.items():
+                if r < weight:
+                    version = self._versions.get(name)
+                    if version is not None and version.ready:
+                        return version
+                    break
+                r -= weight
+        return self._versions[self._default]
+
+    def versions(self):
+        with self._lock:
+            return dict(self._versions)
+
+    @property
+    def default(self):
+        return self._default
+
+    # ------------------------------------------------------------------
+    # Estado
+    # ------------------------------------------------------------------
+
+    def stats(self):
+        with self._lock:
+            versions = dict(self._versions)
+            default, canary = self._default, dict(self._canary)
+        reference = versions[default].top1_distribution() if default in versions else {}
+        out = {}
+        for name, version in versions.items():
+            stats = version.stats()
+            # Drift: cuánto se aleja la distribución de clases top-1 de la versión por defecto
+            stats["drift_vs_default"] = total_variation(stats["top1_distribution"], reference) if reference else None
+            out[name] = stats
+        return {"default": default, "canary": canary, "versions": out}
+
+    def stop(self):
+        with self._lock:
+            versions = list(self._versions.values())
+        for version in versions:
+            if version.batcher is not None:
+                version.batcher.stop()
+
@@ -0,0 +1,127 @@
+"""
+Servidor multi-worker con memoria compartida (pre-fork).
+
+`uvicorn --workers N` arranca cada worker con spawn: cada uno vuelve a importar
+numpy/PIL/FastAPI, los artifacts y su propia copia del modelo, así que la RAM crece
+lineal con N. Aquí el proceso padre importa la app una sola vez, congela el heap
+(gc.freeze, para que el GC no toque esas páginas y rompa el copy-on-write) y luego
+hace fork de N workers que aceptan conexiones del mismo socket.
+
+El modelo se carga en cada worker DESPUÉS del fork: los runtimes de TensorFlow,
+XNNPACK y onnxruntime crean hilos que no sobreviven a un fork. Para que los pesos
+también se compartan usar tflite, que mapea el archivo en memoria (mmap):
+
+    SKIN_ENGINE=tflite SKIN_TFLITE_XNNPACK=0 python serve.py --workers 4
+
+Con keras u onnx se comparte todo lo demás, pero cada worker tiene sus pesos.
+Medición de RSS/PSS por worker y throughput: bench_workers.py
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+
+def bind_socket(host, port):
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock, log_level):
+    import uvicorn
+
+    # El padre maneja SIGTERM/SIGINT para todos; uvicorn instala los suyos en server.run
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    server = uvicorn.Server(uvicorn.Config(app, log_level=log_level, lifespan="on"))
+    server.run(sockets=[sock])
+
+
+def spawn(app, sock, log_level):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            run_worker(app, sock, log_level)
+        except BaseException as e:
+            print(f"❌ Worker {os.getpid()} terminó con error: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args(argv)
+
+    if not hasattr(os, "fork"):
+        print("❌ serve.py necesita fork (Linux/macOS); en Windows usar uvicorn directamente")
+        return 1
+
+    sock = bind_socket(args.host, args.port)
+
+    # Todo lo que se importa aquí queda en páginas compartidas por los workers.
+    # No debe haber hilos vivos antes del fork (el batcher y el modelo arrancan
+    # en el lifespan de cada worker).
+    start = time.perf_counter()
+    import main as api
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    print(f"📦 App precargada en {time.perf_counter() - start:.1f} s (pid {os.getpid()})")
+
+    workers = {}
+    for _ in range(args.workers):
+        workers[spawn(api.app, sock, args.log_level)] = time.monotonic()
+    print(f"✅ {args.workers} workers escuchando en {args.host}:{args.port}")
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # Reemplaza workers caídos; si mueren apenas arrancan (ej. error de import)
+    # se deja de reintentar para no entrar en un bucle de forks
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        started = workers.pop(pid, None)
+        if stopping or started is None:
+            continue
+        print(f"⚠️ Worker {pid} terminó (estado {status})")
+        if time.monotonic() - started < 5:
+            print("❌ El worker murió al arrancar, no se reinicia")
+            continue
+        workers[spawn(api.app, sock, args.log_level)] = time.monotonic()
+
+    sock.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Modo sombra: un modelo candidato evaluado sobre tráfico real sin afectar la respuesta.
+
+Una fracción de las peticiones a /predict se repite en segundo plano con la versión
+sombra (del registro de versiones) DESPUÉS de responder con la principal. La
+comparación (acuerdo top-1, diferencias de probabilidad y latencias) se acumula en
+/models/shadow y opcionalmente en un archivo JSONL.
+
+Acotado para no quitarle recursos a la inferencia principal:
+  - como mucho `max_in_flight` comparaciones en curso; el resto se descarta
+  - decode/preprocesamiento en su propio pool de hilos, no en el de las peticiones
+  - el modelo sombra tiene su propio micro-batcher (el de su versión)
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Histogram
+
+DELTA_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+def _probs(preds):
+    """Probabilidades de todas las clases; solo el Top 3 si la predicción no trae probs"""
+    return preds.get("probs") or {r["class"]: r["prob"] for r in preds["top3"]}
+
+
+def compare_predictions(primary, shadow):
+    """
+    Compara dos predicciones ({"top3", "probs"}). Las diferencias de probabilidad
+    usan el vector completo: una clase que falta en uno de los dos cuenta como 0.
+    """
+    p = _probs(primary)
+    s = _probs(shadow)
+    classes = set(p) | set(s)
+    top1 = primary["top3"][0]["class"]
+    p_top3 = {r["class"] for r in primary["top3"]}
+    s_top3 = {r["class"] for r in shadow["top3"]}
+    return {
+        "agree": top1 == shadow["top3"][0]["class"],
+        "primary_top1": top1,
+        "shadow_top1": shadow["top3"][0]["class"],
+        # Probabilidad que la sombra le da a la clase top-1 de la principal
+        "top1_delta": s.get(top1, 0.0) - p.get(top1, 0.0),
+        "max_abs_delta": max(abs(s.get(c, 0.0) - p.get(c, 0.0)) for c in classes),
+        "top3_overlap": len(p_top3 & s_top3) / len(p_top3 | s_top3),
+    }
+
+
+class ShadowRunner:
+
+    def __init__(self, max_in_flight=4, workers=1, log_path=None):
+        self.version = None
+        self.fraction = 0.0
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._pool = ThreadPoolExecutor(max(1, int(workers)), thread_name_prefix="shadow")
+        self._lock = threading.Lock()
+        self._log = open(log_path, "a", encoding="utf-8") if log_path else None
+        self._tasks = set()
+
+        self.in_flight = 0
+        self.sampled = 0
+        self.dropped = 0
+        self.compared = 0
+        self.errors = 0
+        self.agreements = 0
+        self.primary_ms = Histogram()
+        self.shadow_ms = Histogram()
+        self.abs_top1_delta = Histogram(DELTA_BUCKETS)
+        self.max_abs_delta = Histogram(DELTA_BUCKETS)
+
+    def configure(self, version, fraction):
+        self.version = version or None
+        self.fraction = min(1.0, max(0.0, float(fraction)))
+
+    @property
+    def enabled(self):
+        return self.version is not None and self.fraction > 0
+
+    async def run_in_pool(self, fn, *args):
+        """Trabajo de CPU de la sombra (digest, decode) en su propio pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+
+    def maybe_start(self, primary_version, primary, primary_ms, job, primary_cached=False):
+        """
+        Sortea la petición y, si toca y hay lugar, lanza `job()` en segundo plano.
+        primary: predicción de la versión principal ({"top3", "probs", ...}).
+        job: función que retorna la corrutina con la predicción del modelo sombra.
+        Con primary_cached la latencia principal no se compara (no pasó por el modelo).
+        Nunca bloquea ni falla.
+        """
+        if not self.enabled or primary_version == self.version or random.random() >= self.fraction:
+            return False
+        with self._lock:
+            self.sampled += 1
+            if self.in_flight >= self.max_in_flight:
+                self.dropped += 1
+                return False
+            self.in_flight += 1
+        task = asyncio.ensure_future(self._run(primary_version, primary, primary_ms, job, primary_cached))
+        # Referencia fuerte: asyncio solo guarda referencias débiles a las tareas
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, primary_version, primary, primary_ms, job, primary_cached):
+        try:
+            await self._compare(primary_version, primary, primary_ms, job, primary_cached)
+        finally:
+            # También si se cancela (shutdown): si no, in_flight llega a max_in_flight
+            # y la sombra deja de correr
+            with self._lock:
+                self.in_flight -= 1
+
+    async def _compare(self, primary_version, primary, primary_ms, job, primary_cached):
+        shadow_version = self.version
+        try:
+            start = time.perf_counter()
+            shadow = await job()
+            shadow_ms = (time.perf_counter() - start) * 1000
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            self._write({"ts": time.time(), "shadow": shadow_version, "error": f"{type(e).__name__}: {e}"})
+            return
+
+        result = compare_predictions(primary, shadow)
+        if not primary_cached:
+            self.primary_ms.observe(primary_ms)
+        self.shadow_ms.observe(shadow_ms)
+        self.abs_top1_delta.observe(abs(result["top1_delta"]))
+        self.max_abs_delta.observe(result["max_abs_delta"])
+        with self._lock:
+            self.compared += 1
+            self.agreements += result["agree"]
+        self._write({
+            "ts": time.time(),
+            "primary": primary_version,
+            "shadow": shadow_version,
+            **result,
+            "primary_cache": primary_cached,
+            "primary_ms": round(primary_ms, 2),
+            "shadow_ms": round(shadow_ms, 2),
+        })
+
+    def _write(self, record):
+        if self._log is not None:
+            with self._lock:
+                self._log.write(json.dumps(record) + "\n")
+                self._log.flush()
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "fraction": self.fraction,
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "sampled": self.sampled,
+            "dropped": self.dropped,
+            "compared": self.compared,
+            "errors": self.errors,
+            "top1_agreement": self.agreements / self.compared if self.compared else None,
+            "abs_top1_delta": self.abs_top1_delta.snapshot(),
+            "max_abs_delta": self.max_abs_delta.snapshot(),
+            "primary_ms": self.primary_ms.snapshot(),
+            "shadow_ms": self.shadow_ms.snapshot(),
+        }
+
+    def shutdown(self):
+        for task in list(self._tasks):
+            task.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        if self._log is not None:
+            self._log.close()
+            self._log = None
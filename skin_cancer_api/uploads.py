@@ -0,0 +1,328 @@
+"""
+Lectura acotada de las imágenes subidas.
+
+Dos niveles, los dos antes de decodificar:
+
+- RequestBodyLimit (middleware ASGI): tamaño máximo del cuerpo por ruta. Con
+  Content-Length se rechaza sin leer nada; sin él (chunked) se cuentan los bytes a
+  medida que llegan y se corta al pasar el límite, antes de que el parser
+  multipart termine de volcar el upload a disco.
+- read_image: lee el archivo subido en bloques de `chunk_size` con un máximo de
+  bytes, reconoce el formato por los primeros bytes (firma) y las dimensiones por
+  la cabecera (PIL.Image.open solo parsea la cabecera, no decodifica píxeles).
+  Una imagen con demasiados píxeles declarados (bomba de descompresión: pocos KB
+  que se expanden a GB al decodificar) se rechaza sin seguir leyendo.
+
+Así la memoria por petición queda acotada por max_bytes y la del decode por
+max_pixels, sin importar cuántas peticiones haya en curso.
+
+Para cuerpos con miles de imágenes (/predict/batch/stream) iter_parts parsea el
+multipart a medida que llega, sin request.form(): nada va a disco temporal y el
+cuerpo solo se sigue leyendo cuando quien consume pide la siguiente parte.
+"""
+import collections
+import io
+import json
+import warnings
+
+from PIL import Image
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+# Firmas de los formatos aceptables (MPO, el JPEG de varias fotos de algunos
+# celulares, tiene la misma firma que JPEG)
+SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"),
+    (b"MM\x00*", "TIFF"),
+)
+SIGNATURE_BYTES = 12
+
+# Hasta cuántos bytes leídos se intenta obtener las dimensiones de la cabecera en
+# cada bloque; más allá (EXIF enorme) se comprueba una sola vez con el archivo entero
+SNIFF_MAX_BYTES = 256 * 1024
+
+
+class UploadRejected(Exception):
+    """
+    Upload rechazado antes de decodificar. status_code: 413 (tamaño), 415 (formato)
+    o 400 (multipart mal formado)
+    """
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def sniff_format(head):
+    """Formato según los primeros bytes, o None si no es uno conocido"""
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, fmt in SIGNATURES:
+        if head.startswith(signature):
+            return fmt
+    return None
+
+
+def sniff_size(data):
+    """
+    (ancho, alto) de la cabecera sin decodificar, o None si aún faltan bytes.
+    Con más píxeles que el límite propio de PIL lanza Image.DecompressionBombError.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(data)) as img:
+                return img.size
+    except Image.DecompressionBombError:
+        raise
+    except Exception:
+        return None
+
+
+def _check_size(size, max_pixels):
+    width, height = size
+    if width * height > max_pixels:
+        raise UploadRejected(
+            413, f"Imagen de {width}x{height} ({width * height} píxeles): máximo {max_pixels} píxeles"
+        )
+
+
+async def read_image(file, max_bytes, max_pixels, formats, chunk_size=64 * 1024):
+    """
+    Bytes de un UploadFile leídos por bloques. Lanza UploadRejected si pasa de
+    max_bytes, si el formato no está en `formats` o si declara más de max_pixels.
+    """
+    size = getattr(file, "size", None)
+    if size is not None and size > max_bytes:
+        raise UploadRejected(413, f"Archivo de {size} bytes: máximo {max_bytes} bytes")
+
+    chunks = []
+    total = 0
+    fmt = None
+    dims = None
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadRejected(413, f"Archivo de más de {max_bytes} bytes")
+        chunks.append(chunk)
+
+        if fmt is None and total >= SIGNATURE_BYTES:
+            fmt = _check_format(b"".join(chunks)[:SIGNATURE_BYTES], formats)
+        if fmt is not None and dims is None and total <= SNIFF_MAX_BYTES:
+            dims = _sniff_dims(b"".join(chunks), max_pixels)
+
+    contents = b"".join(chunks)
+    if fmt is None:
+        _check_format(contents[:SIGNATURE_BYTES], formats)
+    if dims is None and _sniff_dims(contents, max_pixels) is None:
+        raise UploadRejected(415, "No se pudo leer la cabecera de la imagen")
+    return contents
+
+
+def check_image(contents, max_pixels, formats):
+    """Las comprobaciones de read_image para bytes ya en memoria. Lanza UploadRejected"""
+    _check_format(contents[:SIGNATURE_BYTES], formats)
+    if _sniff_dims(contents, max_pixels) is None:
+        raise UploadRejected(415, "No se pudo leer la cabecera de la imagen")
+    return contents
+
+
+def _check_format(head, formats):
+    fmt = sniff_format(head)
+    if fmt is None or fmt not in formats:
+        raise UploadRejected(415, f"Formato no soportado ({fmt or 'desconocido'}): se aceptan {', '.join(formats)}")
+    return fmt
+
+
+def _sniff_dims(data, max_pixels):
+    try:
+        dims = sniff_size(data)
+    except Image.DecompressionBombError:
+        raise UploadRejected(413, f"Imagen de más de {max_pixels} píxeles (posible bomba de descompresión)")
+    if dims is not None:
+        _check_size(dims, max_pixels)
+    return dims
+
+
+# Máximo de los headers de cada parte (Content-Disposition, Content-Type)
+PART_HEADER_MAX_BYTES = 8 * 1024
+
+
+class Part:
+    """
+    Parte completa del multipart. filename es None en los campos de texto.
+    error: UploadRejected si la parte pasó de su máximo (data queda vacío).
+    """
+
+    __slots__ = ("name", "filename", "data", "error")
+
+    def __init__(self, name, filename, data, error=None):
+        self.name = name
+        self.filename = filename
+        self.data = data
+        self.error = error
+
+
+def multipart_boundary(content_type):
+    """Boundary del header Content-Type, o None si no es multipart/form-data"""
+    ctype, options = parse_options_header(content_type or b"")
+    if ctype != b"multipart/form-data" or not options.get(b"boundary"):
+        return None
+    return options[b"boundary"]
+
+
+async def iter_parts(chunks, boundary, max_file_bytes, max_field_bytes):
+    """
+    Partes de un cuerpo multipart a medida que llegan. chunks: iterador async de
+    bytes (request.stream()). El siguiente bloque solo se lee cuando se pide la
+    siguiente parte: si quien consume deja de pedir, el cuerpo deja de leerse y
+    TCP frena al cliente. Una parte se acumula en memoria hasta su máximo
+    (max_file_bytes con filename, max_field_bytes sin él); pasado este se descarta
+    el resto y sale con error 413. Lanza ValueError si el multipart está mal formado.
+    """
+    done = collections.deque()
+    headers = {}
+    header = [b"", b""]
+    part = {}
+    ended = []
+
+    def on_part_begin():
+        headers.clear()
+        part.update(name="", filename=None, limit=max_field_bytes, chunks=[], size=0, error=None)
+
+    def on_header_field(data, start, end):
+        header[0] += data[start:end]
+        _check_header(header)
+
+    def on_header_value(data, start, end):
+        header[1] += data[start:end]
+        _check_header(header)
+
+    def on_header_end():
+        headers[header[0].strip().lower()] = header[1].strip()
+        header[:] = [b"", b""]
+
+    def on_headers_finished():
+        _, options = parse_options_header(headers.get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            part["filename"] = options[b"filename"].decode("utf-8", "replace")
+            part["limit"] = max_file_bytes
+
+    def on_part_data(data, start, end):
+        if part["error"] is not None:
+            return
+        part["size"] += end - start
+        if part["size"] > part["limit"]:
+            kind = "Archivo" if part["filename"] is not None else f"Campo '{part['name']}'"
+            part["error"] = UploadRejected(413, f"{kind} de más de {part['limit']} bytes")
+            part["chunks"] = []
+            return
+        part["chunks"].append(bytes(data[start:end]))
+
+    def on_part_end():
+        done.append(Part(part["name"], part["filename"], b"".join(part["chunks"]), part["error"]))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_end": lambda: ended.append(True),
+    })
+    async for chunk in chunks:
+        parser.write(chunk)
+        while done:
+            yield done.popleft()
+    parser.finalize()
+    while done:
+        yield done.popleft()
+    if not ended:
+        raise ValueError("el cuerpo terminó antes del boundary final")
+
+
+def _check_header(header):
+    if len(header[0]) + len(header[1]) > PART_HEADER_MAX_BYTES:
+        raise ValueError(f"Header de una parte de más de {PART_HEADER_MAX_BYTES} bytes")
+
+
+class RequestBodyLimit:
+    """
+    Middleware ASGI. limits: {ruta: bytes máximos del cuerpo}; las rutas sin límite
+    (o con 0) pasan sin control. Responde 413 sin leer (Content-Length) o en cuanto
+    el cuerpo recibido supera el límite.
+    """
+
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = {route: limit for route, limit in limits.items() if limit}
+
+    async def __call__(self, scope, receive, send):
+        limit = None
+        if scope["type"] == "http" and scope["method"] == "POST":
+            limit = self.limits.get(scope["path"].rstrip("/") or "/")
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope.get("headers", ())).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            await _too_large(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadRejected(413, f"Petición de más de {limit} bytes")
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # FastAPI convierte el error del parser en un 400: se reemplaza por el 413
+            if exceeded and not started:
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadRejected:
+            if started:
+                raise
+        if exceeded and not started:
+            await _too_large(send, limit)
+
+
+async def _too_large(send, limit):
+    """413 sin leer el cuerpo. Este middleware va fuera de la admisión: la petición no
+    llegó a la cola, así que X-Queue-Time-Ms es 0 (como en las rutas sin control)"""
+    body = json.dumps({"error": f"Petición de más de {limit} bytes"}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 413,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"x-queue-time-ms", b"0.00"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
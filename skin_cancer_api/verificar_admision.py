@@ -0,0 +1,100 @@
+"""
+Verificación: con un /predict/batch grande en curso, un /predict interactivo entra
+sin 503 y un segundo batch espera su turno en lugar de ser rechazado.
+
+Usa un motor falso lento (no carga el modelo): cada pasada tarda SLOW_S segundos.
+
+Uso:
+    python verificar_admision.py
+"""
+import io
+import sys
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+import engines
+
+SLOW_S = 0.3
+BATCH_IMAGES = 32
+
+
+class SlowEngine:
+    path = "lento.fake"
+    split = None
+
+    def predict(self, batch):
+        time.sleep(SLOW_S)
+        n = len(batch["age"])
+        return np.tile([0.7, 0.1, 0.1, 0.1], (n, 1))
+
+
+# Antes de importar main: la carga del modelo usa el motor falso
+engines.load_engine = lambda name, paths, **options: SlowEngine()
+
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+def jpeg(color):
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 48), color).save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def post_batch(client, n, offset, out, key):
+    files = [("files", (f"{i}.jpg", jpeg((offset + i, 0, 0)), "image/jpeg")) for i in range(n)]
+    form = {"age": ["50"] * n, "sex": ["male"] * n, "anatom_site_general": ["other"] * n}
+    out[key] = client.post("/predict/batch", files=files, data=form)
+
+
+def main_check():
+    failures = []
+    with TestClient(main.app) as client:
+        deadline = time.time() + 10
+        while client.get("/health/ready").status_code != 200 and time.time() < deadline:
+            time.sleep(0.05)
+
+        out = {}
+        batches = [
+            threading.Thread(target=post_batch, args=(client, BATCH_IMAGES, 0, out, "batch1")),
+            threading.Thread(target=post_batch, args=(client, BATCH_IMAGES, 100, out, "batch2")),
+        ]
+        for t in batches:
+            t.start()
+        time.sleep(SLOW_S / 2)  # los dos batches ya están en curso o en cola
+
+        r = client.post(
+            "/predict",
+            files={"file": ("x.jpg", jpeg((1, 2, 3)), "image/jpeg")},
+            data={"age": 50, "sex": "male", "anatom_site_general": "other"},
+        )
+        print(f"/predict durante el batch: {r.status_code}, X-Queue-Time-Ms={r.headers.get('x-queue-time-ms')}")
+        if r.status_code != 200:
+            failures.append(f"/predict interactivo recibió {r.status_code}: {r.text[:100]}")
+
+        for t in batches:
+            t.join()
+        for key in ("batch1", "batch2"):
+            r = out[key]
+            errors = [x for x in r.json().get("results", []) if "error" in x] if r.status_code == 200 else []
+            print(f"{key}: {r.status_code}, X-Queue-Time-Ms={r.headers.get('x-queue-time-ms')}, errores={len(errors)}")
+            if r.status_code != 200 or errors:
+                failures.append(f"{key} recibió {r.status_code} ({len(errors)} errores)")
+
+        executor = client.get("/stats").json()["executor"]
+        print(f"executor: {executor}")
+        if executor["rejected"]:
+            failures.append(f"el executor rechazó {executor['rejected']} peticiones admitidas")
+
+    if failures:
+        print("\n❌ " + "\n❌ ".join(failures))
+        return 1
+    print("\n✅ Las interactivas no esperan a los lotes y ningún lote admitido recibe 503")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_check())
@@ -0,0 +1,101 @@
+"""
+Verificación + benchmark del decode rápido (preprocess_image_bytes_fast) contra
+el preprocesamiento exacto de fastapi_skin_demo (preprocess_image_bytes).
+
+- Paridad: diferencia media y máxima por píxel (escala 0-255) dentro de
+  FAST_DECODE_TOLERANCE para cada resolución típica de celular.
+- Benchmark: ms por imagen de cada camino y aceleración.
+
+Uso:
+    python verificar_decodificacion.py
+    python verificar_decodificacion.py --images /ruta/fotos_reales --repeat 10
+"""
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from preprocessing import FAST_DECODE_TOLERANCE, preprocess_image_bytes, preprocess_image_bytes_fast
+
+# (nombre, ancho, alto)
+RESOLUTIONS = [
+    ("VGA", 640, 480),
+    ("1.2MP", 1280, 960),
+    ("FullHD", 1920, 1080),
+    ("8MP", 3264, 2448),
+    ("12MP", 4032, 3024),
+    ("16MP", 4624, 3472),
+]
+
+
+def synthetic_photo(width, height, seed=0, quality=90):
+    """JPEG sintético con gradientes, una 'lesión' oscura y ruido de sensor"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [150 + 60 * np.sin(x / (width / 7) + c) * np.cos(y / (height / 5)) for c in range(3)]
+    img = np.stack(channels, -1)
+    lesion = np.hypot(x - width / 2, y - height / 2) < min(width, height) / 4
+    img[lesion] *= 0.5
+    img = np.clip(img + rng.normal(0, 10, img.shape), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def timed(fn, contents, repeat):
+    fn(contents)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        out = fn(contents)
+    return out, (time.perf_counter() - start) * 1000 / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="Directorio con fotos reales adicionales")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    cases = [(f"{name} {w}x{h}", synthetic_photo(w, h)) for name, w, h in RESOLUTIONS]
+    if args.images:
+        for path in sorted(Path(args.images).rglob("*")):
+            if path.suffix.lower() in {".jpg", ".jpeg", ".png"}:
+                cases.append((path.name, path.read_bytes()))
+
+    print("=" * 86)
+    print("VERIFICACIÓN: decode rápido vs preprocesamiento exacto")
+    print(f"Tolerancia: media |Δ| <= {FAST_DECODE_TOLERANCE['mean_abs']}, "
+          f"máx |Δ| <= {FAST_DECODE_TOLERANCE['max_abs']} (escala 0-255)")
+    print("=" * 86)
+    print(f"{'imagen':<22} {'exacto ms':>10} {'rápido ms':>10} {'x':>6} {'media |Δ|':>10} {'máx |Δ|':>8}")
+
+    all_ok = True
+    for name, contents in cases:
+        reference, t_ref = timed(preprocess_image_bytes, contents, args.repeat)
+        fast, t_fast = timed(preprocess_image_bytes_fast, contents, args.repeat)
+        diff = np.abs(np.asarray(fast) - np.asarray(reference))
+        ok = (
+            fast.shape == reference.shape
+            and fast.dtype == reference.dtype
+            and diff.mean() <= FAST_DECODE_TOLERANCE["mean_abs"]
+            and diff.max() <= FAST_DECODE_TOLERANCE["max_abs"]
+        )
+        all_ok = all_ok and ok
+        status = "✅" if ok else "❌"
+        print(f"{status} {name:<20} {t_ref:>10.1f} {t_fast:>10.1f} {t_ref / t_fast:>6.1f} "
+              f"{diff.mean():>10.3f} {diff.max():>8.1f}")
+
+    print("=" * 86)
+    if all_ok:
+        print("✅ El decode rápido está dentro de la tolerancia en todas las imágenes")
+    else:
+        print("❌ HAY DIFERENCIAS FUERA DE TOLERANCIA - no activar SKIN_FAST_DECODE")
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Verificación: MetadataEncoder.encode_batch (vectorizado) produce EXACTAMENTE lo
+mismo que encode_metadata fila por fila, incluyendo alias, desconocidos y edades
+inválidas. También mide la velocidad de ambos caminos.
+
+Uso:
+    python verificar_metadatos.py
+"""
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+from preprocessing import MetadataEncoder, encode_metadata
+
+ARTIFACTS_PATH = Path(__file__).resolve().parent.parent / "fastapi_skin_demo" / "model" / "preprocess_artifacts.json"
+
+AGES = [65, "45", " 30 ", "abc", None, "1_000", "nan", True, 3.5, "", float("inf"), "1e2", np.float64(0.1), -5]
+SEXES = ["male", "FEMALE", "Mujer", "hombre", "f", "M", "x", None, 1, "unknown", " male", "MUJER", "mUjEr", True]
+SITES = ["head/neck", "HEAD/NECK", "palms/soles", "other", None, "lower extremity", "x", 3,
+         "anterior torso", "posterior torso", "upper extremity", "oral/genital", "lateral torso", ""]
+
+
+def same(row, batch, i):
+    age, sex_ohe, site_idx = row
+    age_ok = (np.isnan(age) and np.isnan(batch["age"][i])) or age == batch["age"][i]
+    return age_ok and list(batch["sex_ohe"][i]) == sex_ohe and int(batch["site_idx"][i]) == site_idx
+
+
+def main():
+    with open(ARTIFACTS_PATH, "r", encoding="utf-8") as f:
+        artifacts = json.load(f)
+    encoder = MetadataEncoder(artifacts)
+
+    print("=" * 70)
+    print("VERIFICACIÓN: codificación vectorizada vs encode_metadata")
+    print("=" * 70)
+
+    columns = {
+        "listas Python": (AGES, SEXES, SITES),
+        "arrays de texto": (np.array([str(a) for a in AGES]), np.array([str(s) for s in SEXES]), np.array([str(s) for s in SITES])),
+        "arrays objeto": (np.array(AGES, dtype=object), np.array(SEXES, dtype=object), np.array(SITES, dtype=object)),
+        "edades numéricas": (np.array([65, 45, 30.5, 0, -1, 120, 59.8] * 2), SEXES, SITES),
+    }
+
+    all_ok = True
+    for name, (ages, sexes, sites) in columns.items():
+        batch = encoder.encode_batch(ages, sexes, sites)
+        ages_list = ages.tolist() if isinstance(ages, np.ndarray) else ages
+        sexes_list = sexes.tolist() if isinstance(sexes, np.ndarray) else sexes
+        sites_list = sites.tolist() if isinstance(sites, np.ndarray) else sites
+        for i, (a, s, t) in enumerate(zip(ages_list, sexes_list, sites_list)):
+            row = encode_metadata(a, s, t, artifacts)
+            if not same(row, batch, i):
+                all_ok = False
+                print(f"❌ {name}[{i}] age={a!r} sex={s!r} site={t!r}: {row} vs "
+                      f"{batch['age'][i]}, {batch['sex_ohe'][i]}, {batch['site_idx'][i]}")
+        print(f"{'✅' if all_ok else '❌'} {name}: {len(ages_list)} filas")
+
+    # Velocidad con una columna grande típica de un CSV
+    n = 100_000
+    rng = np.random.default_rng(0)
+    ages = rng.integers(5, 95, n).astype(str)
+    sexes = rng.choice(["male", "female", "unknown", "Mujer"], n)
+    sites = rng.choice(list(artifacts["site2idx"]) + ["other"], n)
+
+    start = time.perf_counter()
+    for a, s, t in zip(ages.tolist(), sexes.tolist(), sites.tolist()):
+        encode_metadata(a, s, t, artifacts)
+    t_loop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encoder.encode_batch(ages, sexes, sites)
+    t_vec = time.perf_counter() - start
+
+    print(f"\n⏱️  {n} filas: encode_metadata {t_loop * 1000:.0f} ms, "
+          f"encode_batch {t_vec * 1000:.0f} ms ({t_loop / t_vec:.0f}x)")
+
+    print("=" * 70)
+    print("✅ ¡ÉXITO! Resultados idénticos" if all_ok else "❌ HAY DIFERENCIAS - Revisar implementación")
+    return 0 if all_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())